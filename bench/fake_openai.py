@@ -0,0 +1,263 @@
+"""
+本地模拟的OpenAI兼容流式接口（/v1/chat/completions，SSE），供压力测试和离线测试使用
+
+可以配置首个token的等待时间、输出速率，并按比例注入错误响应、中途断开和停顿；
+随机数使用固定种子，同样的请求顺序得到同样的结果。
+
+用法:
+    python -m bench.fake_openai --port 18080 --tokens 200 --token-rate 50 --ttft 0.3
+    python -m bench.fake_openai --error-rate 0.1 --disconnect-rate 0.05 --stall-rate 0.1 --stall-seconds 5
+
+    # 聊天服务器通过环境变量指向模拟服务
+    CHAT_AI_BASE_URL=http://127.0.0.1:18080/v1 python server.py
+
+运行中可以查看统计或修改参数:
+    GET  /fake/stats
+    POST /fake/config   {"token_rate": 10, "error_rate": 0.5}
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import tornado.ioloop
+import tornado.iostream
+import tornado.web
+
+DEFAULT_PORT = 18080
+
+# 可以通过 /fake/config 修改的参数及其类型
+CONFIG_FIELDS = {
+    "tokens": int,
+    "token_rate": float,
+    "ttft": float,
+    "token_text": str,
+    "error_rate": float,
+    "error_status": int,
+    "disconnect_rate": float,
+    "stall_rate": float,
+    "stall_seconds": float,
+}
+
+
+class FakeAIStats:
+    """模拟服务器的请求统计"""
+    def __init__(self):
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.completed = 0
+        self.errors = 0
+        self.disconnects = 0
+        self.stalls = 0
+        # 回复结束前客户端断开（例如聊天服务器取消了请求），或本地的处理任务被取消（例如压测结束）
+        self.cancelled = 0
+        self.tokens = 0
+
+    def snapshot(self):
+        return dict(self.__dict__)
+
+
+class FakeAIServer:
+    """模拟服务器的参数、统计和随机数"""
+
+    def __init__(self, options):
+        self.options = argparse.Namespace(**{name: getattr(options, name) for name in CONFIG_FIELDS})
+        self.stats = FakeAIStats()
+        self.random = random.Random(options.ai_seed)
+
+    def update(self, values):
+        for name, value in values.items():
+            if name not in CONFIG_FIELDS:
+                raise ValueError(f"未知参数: {name}")
+            setattr(self.options, name, CONFIG_FIELDS[name](value))
+
+    def plan(self):
+        """
+        决定一个请求的行为，在请求开始时一次性抽取随机数，保证结果只取决于请求顺序
+
+        Returns:
+            (是否返回错误, 在第几个token后断开或None, 在第几个token后停顿或None)
+        """
+        options = self.options
+        error = self.random.random() < options.error_rate
+        disconnect_at = self.random.randrange(options.tokens + 1) \
+            if self.random.random() < options.disconnect_rate else None
+        stall_at = self.random.randrange(options.tokens + 1) \
+            if self.random.random() < options.stall_rate else None
+        return error, disconnect_at, stall_at
+
+    async def drain(self, timeout=2.0):
+        """等待进行中的流结束（客户端断开后各个流会自行结束），最多等待timeout秒"""
+        deadline = time.monotonic() + timeout
+        while self.stats.active and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+
+class ChatCompletionsHandler(tornado.web.RequestHandler):
+    """模拟 chat.completions 的流式响应"""
+
+    def initialize(self, server):
+        self.server = server
+        self.options = server.options
+        self.stats = server.stats
+        self.closed = asyncio.Event()
+
+    def on_connection_close(self):
+        self.closed.set()
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            self.set_status(400)
+            self.write({"error": {"message": "请求体不是合法的JSON", "type": "invalid_request_error"}})
+            return
+
+        stats = self.stats
+        stats.requests += 1
+        error, disconnect_at, stall_at = self.server.plan()
+        if error:
+            stats.errors += 1
+            self.set_status(self.options.error_status)
+            self.write({"error": {"message": "模拟的上游错误", "type": "server_error",
+                                  "code": self.options.error_status}})
+            return
+
+        stats.active += 1
+        stats.max_active = max(stats.max_active, stats.active)
+        try:
+            if await self.stream(body.get("model", "fake-model"), disconnect_at, stall_at):
+                stats.completed += 1
+        except tornado.iostream.StreamClosedError:
+            stats.cancelled += 1
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        finally:
+            stats.active -= 1
+
+    async def stream(self, model, disconnect_at, stall_at):
+        """输出完整回复时返回True"""
+        options = self.options
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        await self.send_chunk(completion_id, created, model, {"role": "assistant", "content": ""})
+        await self.sleep(options.ttft)
+
+        interval = 1.0 / options.token_rate if options.token_rate > 0 else 0
+        for index in range(options.tokens):
+            if index == stall_at:
+                self.stats.stalls += 1
+                await self.sleep(options.stall_seconds)
+            if index == disconnect_at:
+                # 模拟上游中途断开：不发送结束标记直接关闭连接
+                self.stats.disconnects += 1
+                self.request.connection.close()
+                return False
+            await self.send_chunk(completion_id, created, model, {"content": options.token_text})
+            self.stats.tokens += 1
+            if interval:
+                await self.sleep(interval)
+
+        await self.send_chunk(completion_id, created, model, {}, finish_reason="stop")
+        self.write("data: [DONE]\n\n")
+        await self.flush()
+        return True
+
+    async def sleep(self, seconds):
+        """等待期间客户端断开时立即结束，不再继续输出"""
+        if seconds < 0.1:
+            await asyncio.sleep(seconds)
+        else:
+            try:
+                await asyncio.wait_for(self.closed.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        if self.closed.is_set():
+            raise tornado.iostream.StreamClosedError()
+
+    async def send_chunk(self, completion_id, created, model, delta, finish_reason=None):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        await self.flush()
+
+
+class ModelsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write({"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    def get(self):
+        self.write({"stats": self.server.stats.snapshot(), "config": vars(self.server.options)})
+
+
+class ConfigHandler(tornado.web.RequestHandler):
+    """运行中修改参数，例如在测试中途把输出速率降下来"""
+    def initialize(self, server):
+        self.server = server
+
+    def post(self):
+        try:
+            self.server.update(json.loads(self.request.body or b"{}"))
+        except (ValueError, TypeError) as e:
+            self.set_status(400)
+            self.write({"error": str(e)})
+            return
+        self.write({"config": vars(self.server.options)})
+
+
+def make_fake_app(options):
+    """创建模拟服务器应用；options为add_arguments定义的命令行参数"""
+    server = FakeAIServer(options)
+    app = tornado.web.Application([
+        (r"/v1/chat/completions", ChatCompletionsHandler, {"server": server}),
+        (r"/v1/models", ModelsHandler),
+        (r"/fake/stats", StatsHandler, {"server": server}),
+        (r"/fake/config", ConfigHandler, {"server": server}),
+    ])
+    app.fake_server = server
+    return app
+
+
+def add_arguments(parser):
+    """模拟服务器的命令行参数，压测脚本复用同一组参数"""
+    parser.add_argument("--tokens", type=int, default=100, help="每个回复输出的token数")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒输出的token数，0表示不限速")
+    parser.add_argument("--ttft", type=float, default=0.2, help="第一个token之前的等待时间（秒）")
+    parser.add_argument("--token-text", default="测", help="每个token的文本")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="直接返回错误状态码的请求比例")
+    parser.add_argument("--error-status", type=int, default=500, help="错误响应的状态码，例如429、500、503")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="输出中途断开连接的请求比例")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="输出中途停顿的请求比例")
+    parser.add_argument("--stall-seconds", type=float, default=10.0, help="停顿的时间（秒）")
+    parser.add_argument("--ai-seed", type=int, default=1, help="错误、断开和停顿的随机种子")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容流式接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    make_fake_app(args).listen(args.port, args.host)
+    print(f"模拟AI服务已启动在 http://{args.host}:{args.port}/v1")
+    tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,137 @@
+"""
+本地模拟的Redis发布/订阅服务（RESP协议），供RedisBus的离线测试和多节点压测使用
+
+只实现广播总线用到的命令：AUTH、PING、SUBSCRIBE、UNSUBSCRIBE、PUBLISH、QUIT，
+不保存任何数据。
+
+用法:
+    python -m bench.fake_redis --port 16379
+
+    # 各工作进程通过模拟服务（而不是Unix套接字）共享聊天室
+    CHAT_BROADCAST_BACKEND=redis CHAT_REDIS_URL=redis://127.0.0.1:16379/0 python server.py --processes 2
+"""
+import argparse
+import tornado.ioloop
+import tornado.iostream
+from tornado.tcpserver import TCPServer
+
+DEFAULT_PORT = 16379
+
+
+def encode_reply(value):
+    """编码为RESP回复：bytes为批量字符串，int为整数，list为数组，None为空批量字符串"""
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class FakeRedisStats:
+    """模拟服务的统计"""
+    def __init__(self):
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+
+    def snapshot(self):
+        return dict(self.__dict__)
+
+
+class FakeRedisServer(TCPServer):
+    """只支持发布/订阅的RESP服务"""
+
+    def __init__(self, password=None):
+        super().__init__()
+        self.password = password.encode("utf-8") if password else None
+        self.stats = FakeRedisStats()
+        # 频道的订阅连接: {频道: set(IOStream)}
+        self.channels = {}
+
+    async def handle_stream(self, stream, address):
+        self.stats.connections += 1
+        authenticated = self.password is None
+        subscribed = set()
+        try:
+            while True:
+                command = await self.read_command(stream)
+                name = command[0].upper() if command else b""
+                if name == b"AUTH":
+                    authenticated = self.password is None or command[-1] == self.password
+                    stream.write(b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n")
+                elif not authenticated:
+                    stream.write(b"-NOAUTH Authentication required.\r\n")
+                elif name == b"PING":
+                    stream.write(b"+PONG\r\n")
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(stream)
+                        subscribed.add(channel)
+                        stream.write(encode_reply([b"subscribe", channel, len(subscribed)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscribed):
+                        self._unsubscribe(stream, channel)
+                        subscribed.discard(channel)
+                        stream.write(encode_reply([b"unsubscribe", channel, len(subscribed)]))
+                elif name == b"PUBLISH" and len(command) == 3:
+                    stream.write(encode_reply(self.publish(command[1], command[2])))
+                elif name == b"QUIT":
+                    stream.write(b"+OK\r\n")
+                    stream.close()
+                    return
+                else:
+                    stream.write(b"-ERR unknown command\r\n")
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            for channel in subscribed:
+                self._unsubscribe(stream, channel)
+
+    @staticmethod
+    async def read_command(stream):
+        """读取一条RESP数组形式的命令"""
+        line = (await stream.read_until(b"\r\n"))[:-2]
+        if not line.startswith(b"*"):
+            # 内联命令，例如 telnet 中输入的 PING
+            return line.split()
+        command = []
+        for _ in range(int(line[1:])):
+            length = int((await stream.read_until(b"\r\n"))[1:-2])
+            command.append((await stream.read_bytes(length + 2))[:-2])
+        return command
+
+    def publish(self, channel, payload):
+        """返回收到消息的订阅连接数"""
+        self.stats.published += 1
+        message = encode_reply([b"message", channel, payload])
+        receivers = 0
+        for stream in list(self.channels.get(channel, ())):
+            if not stream.closed():
+                stream.write(message)
+                receivers += 1
+        self.stats.delivered += receivers
+        return receivers
+
+    def _unsubscribe(self, stream, channel):
+        streams = self.channels.get(channel)
+        if streams is not None:
+            streams.discard(stream)
+            if not streams:
+                del self.channels[channel]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地模拟的Redis发布/订阅服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--password", default=None, help="要求客户端先AUTH的密码")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    FakeRedisServer(args.password).listen(args.port, args.host)
+    print(f"模拟Redis服务已启动在 redis://{args.host}:{args.port}/0")
+    tornado.ioloop.IOLoop.current().start()
@@ -0,0 +1,551 @@
+"""
+WebSocket压力测试：大量并发连接、可配置的消息组合，统计端到端广播延迟、吞吐和服务器内存
+
+服务器可以在本进程中启动（server.make_app()，与压测客户端共用一个IOLoop）、
+作为子进程启动（默认，客户端开销不计入服务器），或使用已经运行的服务器（--url）。
+@川小农 消息发往本地模拟的OpenAI兼容接口（bench/fake_openai.py），不访问外网。
+
+延迟的测量方法：发送的消息中带有标记 bench:编号:发送时间，
+一部分客户端（观察者）解析收到的消息，用收到的时间减去标记中的发送时间。
+@新闻 的回复不带标记，只计入负载不计入延迟；@川小农 统计的是从提问到收到第一个片段的时间，
+提问本身的回显单独计为 ai_echo，不计入 text。
+
+用法（在项目根目录下）:
+    python -m bench.ws_load --clients 2000 --duration 30 --rate 200
+    python -m bench.ws_load --mix text=80,news=5,movie=10,ai=5 --rooms 4 --json result.json
+    python -m bench.ws_load --server inprocess --clients 200
+    python -m bench.ws_load --url ws://127.0.0.1:8888 --clients 500
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tornado.escape
+import tornado.httpclient
+import tornado.ioloop
+import tornado.websocket
+from tornado.web import create_signed_value
+from bench.fake_openai import make_fake_app, add_arguments as add_fake_ai_arguments
+
+# 项目根目录，子进程在这里运行
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 消息种类 -> 内容模板，{marker} 替换为延迟标记
+MESSAGE_TEMPLATES = {
+    "text": "{marker} 压测消息",
+    "news": "@新闻",
+    "movie": "@电影 http://bench.local/{marker}.m3u8",
+    "ai": "@川小农 {marker} 你好",
+}
+MARKER_PREFIX = "bench:"
+# AI提问会先以text消息回显给房间，按这个前缀单独统计，不混入普通文本消息的延迟
+AI_ECHO_PREFIX = MESSAGE_TEMPLATES["ai"].split(" ", 1)[0]
+AI_STREAM_TYPE = '"ai_stream_update"'
+
+DEFAULT_PORT = 18888
+
+
+# =================== 服务器 ===================
+def prepare_server_config(data_dir, ai_base_url=None):
+    """
+    修改服务器配置：用户数据库、聊天记录和AI缓存写到临时目录，AI请求发往模拟服务器
+
+    必须在导入server之前调用，各模块导入时读取这些配置
+    """
+    import config
+    config.USERS_DB = os.path.join(data_dir, "users.db")
+    config.CHAT_LOG_DB = os.path.join(data_dir, "chat_log.db")
+    config.AI_CACHE_FILE = os.path.join(data_dir, "ai_cache.json")
+    if ai_base_url:
+        config.AI_BASE_URL = ai_base_url
+        config.AI_API_KEY = "bench"
+
+
+def start_inprocess_server(port, data_dir, ai_base_url):
+    prepare_server_config(data_dir, ai_base_url)
+    from server import make_app
+    make_app(debug=False).listen(port, "127.0.0.1")
+
+
+def start_subprocess_server(port, data_dir, ai_base_url):
+    command = [sys.executable, "-m", "bench.ws_load", "--serve", "--port", str(port), "--data-dir", data_dir]
+    env = dict(os.environ)
+    if ai_base_url:
+        env["CHAT_AI_BASE_URL"] = ai_base_url
+        env["CHAT_AI_API_KEY"] = "bench"
+    # 服务器的连接日志很多，不输出到终端；错误信息仍然输出
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL)
+
+
+def serve(args):
+    """--serve：子进程中运行的服务器"""
+    prepare_server_config(args.data_dir)
+    from server import make_app
+    make_app(debug=False).listen(args.port, "127.0.0.1")
+    print(f"压测服务器已启动在 http://127.0.0.1:{args.port}")
+    tornado.ioloop.IOLoop.current().start()
+
+
+async def wait_ready(http_url, timeout=30):
+    client = tornado.httpclient.AsyncHTTPClient()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.fetch(http_url + "/api/config", request_timeout=1)
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"服务器在{timeout}秒内没有启动: {http_url}")
+
+
+def read_rss(pid):
+    """进程及其子进程的常驻内存（字节），读取/proc，非Linux系统返回None"""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+def raise_fd_limit():
+    """数千个连接需要足够的文件描述符"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+# =================== 统计 ===================
+def percentile(sorted_values, p):
+    """最近秩法的百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(p / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples):
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": values[-1],
+    }
+
+
+class LoadStats:
+    def __init__(self):
+        self.measuring = False
+        self.sent = {}
+        self.frames = 0
+        self.bytes = 0
+        # 观察者收到的延迟样本（毫秒）: {种类: [延迟]}
+        self.latency = {}
+        self.connect_ms = []
+        self.connect_errors = 0
+        self.disconnects = 0
+        # {AI回复ID: 提问发送时间}
+        self.ai_pending = {}
+
+    def add_latency(self, kind, sent_ns, received_ns):
+        if self.measuring:
+            self.latency.setdefault(kind, []).append((received_ns - sent_ns) / 1e6)
+
+
+def parse_marker(content):
+    """从消息内容中取出 (编号, 发送时间)"""
+    start = content.find(MARKER_PREFIX)
+    if start < 0:
+        return None
+    parts = content[start + len(MARKER_PREFIX):].split(":", 2)
+    try:
+        return int(parts[0]), int(parts[1].split(" ", 1)[0].split(".", 1)[0])
+    except (IndexError, ValueError):
+        return None
+
+
+# =================== 客户端 ===================
+class BenchClient:
+    def __init__(self, name, room, observer, stats):
+        self.name = name
+        self.room = room
+        self.observer = observer
+        self.stats = stats
+        self.ws = None
+        # 已收到第一个片段的AI回复ID
+        self.ai_seen = set()
+
+    async def connect(self, ws_url, secret):
+        cookie = create_signed_value(secret, "username", self.name).decode("ascii")
+        request = tornado.httpclient.HTTPRequest(
+            f"{ws_url}/ws?room={tornado.escape.url_escape(self.room)}",
+            headers={"Cookie": f'username="{cookie}"'},
+            connect_timeout=60, request_timeout=60)
+        start = time.perf_counter()
+        self.ws = await tornado.websocket.websocket_connect(request, max_message_size=64 * 1024 * 1024)
+        self.stats.connect_ms.append((time.perf_counter() - start) * 1000)
+
+    async def read_loop(self):
+        stats = self.stats
+        while True:
+            message = await self.ws.read_message()
+            if message is None:
+                stats.disconnects += 1
+                return
+            received_ns = time.perf_counter_ns()
+            if stats.measuring:
+                stats.frames += 1
+                stats.bytes += len(message)
+            if self.observer and (MARKER_PREFIX in message or (stats.ai_pending and AI_STREAM_TYPE in message)):
+                self.observe(json.loads(message), received_ns)
+
+    def observe(self, data, received_ns):
+        msg_type = data.get("type")
+        stats = self.stats
+        if msg_type == "ai_stream_update":
+            response_id = data.get("id")
+            sent_ns = stats.ai_pending.get(response_id)
+            # 每个观察者只记录第一个片段
+            if sent_ns is not None and response_id not in self.ai_seen:
+                self.ai_seen.add(response_id)
+                stats.add_latency("ai_first_chunk", sent_ns, received_ns)
+            return
+        marker = parse_marker(str(data.get("content", "")))
+        if marker is None:
+            return
+        _, sent_ns = marker
+        if msg_type == "ai_chat":
+            stats.ai_pending[data.get("id")] = sent_ns
+        elif msg_type == "movie":
+            stats.add_latency("movie", sent_ns, received_ns)
+        elif msg_type == "text":
+            if str(data.get("content", "")).startswith(AI_ECHO_PREFIX):
+                stats.add_latency("ai_echo", sent_ns, received_ns)
+            else:
+                stats.add_latency("text", sent_ns, received_ns)
+
+    def send(self, kind, message_id):
+        marker = f"{MARKER_PREFIX}{message_id}:{time.perf_counter_ns()}"
+        content = MESSAGE_TEMPLATES[kind].format(marker=marker)
+        self.ws.write_message(json.dumps({"type": "chat", "content": content}, ensure_ascii=False))
+
+
+# =================== 压测 ===================
+def parse_mix(text):
+    mix = []
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        kind = kind.strip()
+        if kind not in MESSAGE_TEMPLATES:
+            raise argparse.ArgumentTypeError(f"未知的消息种类: {kind}（可选 {', '.join(MESSAGE_TEMPLATES)}）")
+        mix.append((kind, float(weight or 1)))
+    return mix
+
+
+async def connect_all(clients, ws_url, secret, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect(client):
+        async with semaphore:
+            try:
+                await client.connect(ws_url, secret)
+            except Exception as e:
+                client.stats.connect_errors += 1
+                if client.stats.connect_errors <= 5:
+                    print(f"连接失败: {client.name}: {e}")
+
+    await asyncio.gather(*(connect(client) for client in clients))
+    return [client for client in clients if client.ws is not None]
+
+
+async def drive(senders, mix, rate, duration, stats, seed):
+    """按固定速率发送消息，按计划时间发送，不因单次延迟累积误差"""
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in mix]
+    weights = [weight for _, weight in mix]
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    message_id = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return
+        due = int(elapsed / interval) + 1
+        while message_id < due:
+            kind = rng.choices(kinds, weights)[0]
+            sender = senders[message_id % len(senders)]
+            sender.send(kind, message_id)
+            stats.sent[kind] = stats.sent.get(kind, 0) + 1
+            message_id += 1
+        await asyncio.sleep(max(0.0, (message_id * interval) - (time.perf_counter() - start)))
+
+
+def room_names(count):
+    import config
+    return [config.CHAT_DEFAULT_ROOM] if count <= 1 else [f"bench-{i}" for i in range(count)]
+
+
+def worker_entry(args, index, ws_url, secret, conn):
+    """压测客户端进程：负责编号 index, index+workers, ... 的连接"""
+    raise_fd_limit()
+    conn.send(asyncio.run(worker_main(args, index, ws_url, secret, conn)))
+    conn.close()
+
+
+async def worker_main(args, index, ws_url, secret, conn):
+    stats = LoadStats()
+    rooms = room_names(args.rooms)
+    observers = args.observers * len(rooms)
+    clients = [BenchClient(f"bench_{i}", rooms[i % len(rooms)], i < observers, stats)
+               for i in range(index, args.clients, args.workers)]
+    clients = await connect_all(clients, ws_url, secret, max(1, args.connect_concurrency // args.workers))
+    readers = [asyncio.ensure_future(client.read_loop()) for client in clients]
+    conn.send(len(clients))
+    # 等待所有进程都连接完成后同时开始
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+
+    result = {"connected": len(clients), "sent": {}, "frames": 0, "bytes": 0, "elapsed": 0.0, "latency": {}}
+    if clients:
+        senders = clients[:max(1, len(range(index, min(args.senders, args.clients), args.workers)))]
+        stats.measuring = True
+        started = time.perf_counter()
+        await drive(senders, parse_mix(args.mix), args.rate / args.workers, args.duration, stats, args.seed + index)
+        # 等待还在途中的消息
+        await asyncio.sleep(args.drain)
+        result["elapsed"] = time.perf_counter() - started
+        stats.measuring = False
+        for client in clients:
+            client.ws.close()
+        for reader in readers:
+            reader.cancel()
+
+    result.update(sent=stats.sent, frames=stats.frames, bytes=stats.bytes, latency=stats.latency,
+                  connect_ms=stats.connect_ms, connect_errors=stats.connect_errors, disconnects=stats.disconnects)
+    return result
+
+
+async def sample_rss(pid, samples, interval=1.0):
+    while True:
+        rss = read_rss(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(interval)
+
+
+def merge_results(results):
+    merged = {"connected": 0, "sent": {}, "frames": 0, "bytes": 0, "elapsed": 0.0, "latency": {},
+              "connect_ms": [], "connect_errors": 0, "disconnects": 0}
+    for result in results:
+        for key in ("connected", "frames", "bytes", "connect_errors", "disconnects"):
+            merged[key] += result[key]
+        merged["elapsed"] = max(merged["elapsed"], result["elapsed"])
+        merged["connect_ms"].extend(result["connect_ms"])
+        for kind, count in result["sent"].items():
+            merged["sent"][kind] = merged["sent"].get(kind, 0) + count
+        for kind, samples in result["latency"].items():
+            merged["latency"].setdefault(kind, []).extend(samples)
+    return merged
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    fd_limit = raise_fd_limit()
+    if args.clients // args.workers + 100 > fd_limit:
+        print(f"警告: 文件描述符上限为{fd_limit}，可能无法建立{args.clients}个连接，可以增加--workers")
+
+    data_dir = tempfile.mkdtemp(prefix="ws_load_")
+    process = None
+    server_pid = None
+    ai_base_url = args.ai_base_url
+    fake_ai = None
+    if ai_base_url is None and any(kind == "ai" for kind, _ in mix):
+        # 模拟AI服务运行在压测主进程中
+        fake_app = make_fake_app(args)
+        fake_app.listen(args.ai_port, "127.0.0.1")
+        fake_ai = fake_app.fake_server
+        ai_base_url = f"http://127.0.0.1:{args.ai_port}/v1"
+
+    if args.url:
+        ws_url = args.url.rstrip("/")
+        server_mode = "external"
+    else:
+        ws_url = f"ws://127.0.0.1:{args.port}"
+        server_mode = args.server
+        if server_mode == "inprocess":
+            start_inprocess_server(args.port, data_dir, ai_base_url)
+            server_pid = os.getpid()
+        else:
+            process = start_subprocess_server(args.port, data_dir, ai_base_url)
+            server_pid = process.pid
+    http_url = "http" + ws_url[2:]
+
+    import config
+    secret = args.cookie_secret or config.COOKIE_SECRET
+    loop = asyncio.get_running_loop()
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    rss_samples = []
+    rss_task = None
+    try:
+        await wait_ready(http_url)
+        rss_before = read_rss(server_pid) if server_pid else None
+
+        print(f"正在建立{args.clients}个连接（{args.rooms}个房间，{args.workers}个客户端进程）...")
+        connect_start = time.perf_counter()
+        for index in range(args.workers):
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(target=worker_entry, args=(args, index, ws_url, secret, child_conn), daemon=True)
+            worker.start()
+            workers.append((worker, parent_conn))
+        connected = 0
+        for _, conn in workers:
+            connected += await loop.run_in_executor(None, conn.recv)
+        connect_seconds = time.perf_counter() - connect_start
+        print(f"已连接{connected}个，用时{connect_seconds:.1f}秒")
+        if not connected:
+            return None
+
+        if server_pid:
+            rss_task = asyncio.ensure_future(sample_rss(server_pid, rss_samples))
+        await asyncio.sleep(args.warmup)
+        print(f"发送中: {args.rate}条/秒，持续{args.duration}秒，消息组合 {args.mix}")
+        for _, conn in workers:
+            conn.send("go")
+        results = [await loop.run_in_executor(None, conn.recv) for _, conn in workers]
+        merged = merge_results(results)
+
+        return {
+            "server": server_mode,
+            "clients": merged["connected"],
+            "rooms": args.rooms,
+            "workers": args.workers,
+            "connect_errors": merged["connect_errors"],
+            "disconnects": merged["disconnects"],
+            "connect_seconds": connect_seconds,
+            "connect_latency": summarize(merged["connect_ms"]),
+            "duration": args.duration,
+            "mix": args.mix,
+            "sent": merged["sent"],
+            "sent_per_second": sum(merged["sent"].values()) / args.duration,
+            "frames_received": merged["frames"],
+            "frames_per_second": merged["frames"] / merged["elapsed"],
+            "bytes_per_second": merged["bytes"] / merged["elapsed"],
+            "latency": {kind: summarize(samples) for kind, samples in merged["latency"].items()},
+            "server_rss_before": rss_before,
+            "server_rss_peak": max(rss_samples) if rss_samples else None,
+            "fake_ai": fake_ai.stats.snapshot() if fake_ai is not None else None,
+        }
+    finally:
+        if rss_task is not None:
+            rss_task.cancel()
+        for worker, _ in workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake_ai is not None:
+            # 服务器退出后模拟AI服务的流随之结束，避免退出时被取消
+            await fake_ai.drain()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def format_bytes(value):
+    if value is None:
+        return "-"
+    return f"{value / 1024 / 1024:.1f}MB"
+
+
+def print_result(result):
+    print()
+    print(f"服务器: {result['server']}  连接: {result['clients']}（失败{result['connect_errors']}，"
+          f"中途断开{result['disconnects']}）  房间: {result['rooms']}  客户端进程: {result['workers']}")
+    print(f"发送: {result['sent_per_second']:.1f}条/秒 {result['sent']}")
+    print(f"接收: {result['frames_per_second']:.0f}帧/秒  {format_bytes(result['bytes_per_second'])}/秒")
+    for kind, summary in sorted(result["latency"].items()):
+        if summary["count"]:
+            print(f"延迟 {kind:<15} p50={summary['p50_ms']:.2f}ms p95={summary['p95_ms']:.2f}ms "
+                  f"p99={summary['p99_ms']:.2f}ms max={summary['max_ms']:.2f}ms（{summary['count']}个样本）")
+    print(f"服务器内存: 开始{format_bytes(result['server_rss_before'])} 峰值{format_bytes(result['server_rss_peak'])}")
+    fake_ai = result["fake_ai"]
+    if fake_ai:
+        print(f"模拟AI服务: 请求{fake_ai['requests']} 完成{fake_ai['completed']} 最大并发{fake_ai['max_active']} "
+              f"错误{fake_ai['errors']} 断开{fake_ai['disconnects']} 停顿{fake_ai['stalls']} 被取消{fake_ai['cancelled']}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WebSocket聊天服务器压力测试")
+    parser.add_argument("--server", choices=("subprocess", "inprocess"), default="subprocess",
+                        help="服务器的启动方式；inprocess与压测客户端共用一个IOLoop，结果包含客户端开销")
+    parser.add_argument("--url", help="使用已经运行的服务器，例如 ws://127.0.0.1:8888")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="启动的服务器监听的端口")
+    parser.add_argument("--cookie-secret", help="外部服务器的COOKIE_SECRET，默认使用config.py中的值")
+    parser.add_argument("--clients", type=int, default=1000, help="并发连接数")
+    parser.add_argument("--rooms", type=int, default=1, help="连接平均分到几个房间")
+    parser.add_argument("--senders", type=int, default=100, help="发送消息的连接数")
+    parser.add_argument("--observers", type=int, default=20, help="每个房间中统计延迟的连接数")
+    parser.add_argument("--rate", type=float, default=100.0, help="所有发送者合计每秒发送的消息数")
+    parser.add_argument("--duration", type=float, default=20.0, help="发送持续时间（秒）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="连接建立后开始发送前的等待时间（秒）")
+    parser.add_argument("--drain", type=float, default=2.0, help="发送结束后等待在途消息的时间（秒）")
+    parser.add_argument("--mix", default="text=90,news=4,movie=5,ai=1",
+                        help="消息组合，种类=权重，可选 text、news、movie、ai")
+    parser.add_argument("--seed", type=int, default=1, help="消息组合的随机种子，相同种子发送相同的序列")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="同时进行的握手数")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="压测客户端进程数；单个Python进程解析大量连接的消息时，客户端本身会成为瓶颈")
+    parser.add_argument("--json", help="把结果写入JSON文件，便于修改前后对比")
+    parser.add_argument("--ai-base-url", help="AI接口地址，默认在压测进程中启动模拟服务器（bench/fake_openai.py）")
+    parser.add_argument("--ai-port", type=int, default=18080, help="模拟AI服务器的端口")
+    add_fake_ai_arguments(parser)
+    # 内部使用：子进程服务器
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return
+    result = asyncio.run(run(args))
+    if result is None:
+        sys.exit(1)
+    print_result(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
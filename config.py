@@ -1,7 +1,8 @@
 import os
 import socket
+import tempfile
+import threading
 import uuid
-from openai import AsyncOpenAI
 
 # 服务器配置
 SERVER_PORT = 8888
@@ -11,17 +12,141 @@ SERVER_HOST = "0.0.0.0"
 COOKIE_SECRET = "__TODO:_GENERATE_YOUR_OWN_RANDOM_VALUE_HERE__"
 DEBUG = True
 
+# WebSocket握手认证：是否必须登录（关闭时未登录的连接仍可使用nickname参数）、
+# 令牌有效期（秒）、已校验会话的缓存条数和缓存时间（秒）
+WS_REQUIRE_AUTH = True
+WS_TOKEN_TTL = 300
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = 300
+
+# WebSocket心跳：每隔多少秒发送ping、发送后多少秒收不到回应时关闭连接（不能超过发送间隔）
+# 断网的连接不会一直占用昵称，也能及时取消它的AI回复
+WS_PING_INTERVAL = 25
+WS_PING_TIMEOUT = 20
+
+# 广播总线配置：local(单进程)、unix(本机多进程)、redis(多节点)
+# 使用 --processes 启动多个工作进程且未指定时，自动使用unix
+BROADCAST_BACKEND = os.environ.get("CHAT_BROADCAST_BACKEND", "local")
+BROADCAST_UNIX_DIR = os.environ.get(
+    "CHAT_BROADCAST_UNIX_DIR",
+    os.path.join(tempfile.gettempdir(), f"daip_chat_bus_{SERVER_PORT}")
+)
+BROADCAST_REDIS_URL = os.environ.get("CHAT_REDIS_URL", "redis://127.0.0.1:6379/0")
+BROADCAST_CHANNEL = "daip_chat"
+
+# 每个连接的发送队列上限，以及溢出策略：
+# coalesce(合并AI流式片段，仍超限时按resync处理)、resync(断开连接，客户端重连后补发错过的消息)、
+# disconnect(断开慢速客户端，不再重连)
+SEND_QUEUE_MAX_MESSAGES = 256
+SEND_QUEUE_MAX_BYTES = 1024 * 1024
+SEND_QUEUE_POLICY = "coalesce"
+
+# SQLite连接池：每个进程最多打开的连接数、等待锁的超时（毫秒）、内存映射大小（字节）、每个连接缓存的预编译语句数
+DB_POOL_SIZE = 4
+DB_BUSY_TIMEOUT_MS = 5000
+DB_MMAP_SIZE = 64 * 1024 * 1024
+DB_CACHED_STATEMENTS = 64
+
+# 数据库专用线程：线程数、最多排队的请求数、单个请求超时（秒）、排队超过多少秒时打印警告
+DB_WORKERS = 2
+DB_MAX_PENDING = 64
+DB_QUERY_TIMEOUT = 3.0
+DB_SLOW_WAIT = 0.1
+
+# 密码哈希：算法(scrypt或pbkdf2)及其参数，计算线程数和最多排队的请求数
+# 修改参数后，已有用户在下次登录时自动按新参数重新计算
+PASSWORD_HASH_ALGORITHM = "scrypt"
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_PBKDF2_ITERATIONS = 600000
+PASSWORD_HASH_WORKERS = min(4, os.cpu_count() or 1)
+PASSWORD_HASH_MAX_PENDING = 32
+
+# 用户名内存索引：用户数超过USERNAME_SET_MAX时改用布隆过滤器，误判率为USERNAME_BLOOM_FP_RATE
+USERNAME_SET_MAX = 200000
+USERNAME_BLOOM_FP_RATE = 0.01
+
+# 房间：默认房间名、房间名最大长度、最多保留消息缓冲的房间数
+CHAT_DEFAULT_ROOM = "大厅"
+ROOM_NAME_MAX = 32
+MAX_ROOM_HISTORIES = 200
+# 在线状态增量的合并时间（秒）：这段时间内的加入/离开合并成一条消息
+PRESENCE_DEBOUNCE = 0.25
+
+# 最近消息的环形缓冲：最多保存的消息条数和字节数，以及一次补发的最大字节数
+HISTORY_MAX_MESSAGES = 1000
+HISTORY_MAX_BYTES = 2 * 1024 * 1024
+HISTORY_SYNC_MAX_BYTES = 256 * 1024
+
+# 用户数据库文件（第一次启动时创建）
+USERS_DB = os.path.join(os.path.dirname(__file__), "data", "users.db")
+
+# 聊天记录：SQLite文件、每批最多写入的条数、攒批的最长时间（秒）、写入跟不上时最多缓冲的条数
+CHAT_LOG_DB = os.path.join(os.path.dirname(__file__), "data", "chat_log.db")
+CHAT_LOG_BATCH_SIZE = 500
+CHAT_LOG_FLUSH_INTERVAL = 0.2
+CHAT_LOG_MAX_PENDING = 100000
+# 聊天记录API每页最多返回的条数
+HISTORY_PAGE_MAX = 200
+
 # 模板和静态文件路径
 TEMPLATES_PATH = os.path.join(os.path.dirname(__file__), "templates")
 STATIC_PATH = os.path.join(os.path.dirname(__file__), "static")
 
-# AI配置
-AI_API_KEY = "sk-orxlsmelhexcosqumhchsiabeasxhwkmvcfzqqjakwhqoaqv"
-AI_BASE_URL = "https://api.siliconflow.cn/v1"
-AI_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+# AI配置，可以用环境变量覆盖，例如离线测试时指向本地模拟服务（python -m bench.fake_openai）
+AI_API_KEY = os.environ.get("CHAT_AI_API_KEY", "sk-orxlsmelhexcosqumhchsiabeasxhwkmvcfzqqjakwhqoaqv")
+AI_BASE_URL = os.environ.get("CHAT_AI_BASE_URL", "https://api.siliconflow.cn/v1")
+AI_MODEL = os.environ.get("CHAT_AI_MODEL", "Qwen/Qwen2.5-7B-Instruct")
 
-# 初始化AsyncOpenAI客户端
-ai_client = AsyncOpenAI(
-    api_key=AI_API_KEY,
-    base_url=AI_BASE_URL
-)
+# AI流式回复的合并参数：每隔多少秒或累计多少字符向聊天室广播一次
+AI_STREAM_FLUSH_INTERVAL = 0.05
+AI_STREAM_FLUSH_CHARS = 256
+
+# AI请求并发控制：全局并发上限、每用户并发上限、排队总长度、每用户最多排队数
+AI_MAX_CONCURRENT = 4
+AI_MAX_PER_USER = 1
+AI_MAX_QUEUE = 20
+AI_MAX_QUEUED_PER_USER = 3
+
+# AI回复的上限：每个回复最长持续多少秒（含排队）、最多读取多少个上游片段，
+# 以及提问者断开、或房间中的人都离开后等待多少秒再取消回复（刷新页面重连不会取消）
+AI_STREAM_DEADLINE = 180
+AI_STREAM_MAX_TOKENS = 4096
+AI_ROOM_EMPTY_GRACE = 10
+
+# 川小农的对话记忆：按用户(user)还是按房间(room)保存、最多保存多少段对话、多久未使用后淘汰（秒），
+# 每段对话发给上游的历史token预算和最多轮数（一问一答为两轮）、每轮最多保存的字符数、
+# 超出预算的旧轮次压缩成摘要的最大字符数
+AI_MEMORY_SCOPE = os.environ.get("CHAT_AI_MEMORY_SCOPE", "user")
+AI_MEMORY_MAX_CONVERSATIONS = 1000
+AI_MEMORY_IDLE_TTL = 3600
+AI_MEMORY_TOKEN_BUDGET = 2000
+AI_MEMORY_MAX_TURNS = 20
+AI_MEMORY_TURN_MAX_CHARS = 1500
+AI_MEMORY_SUMMARY_CHARS = 300
+
+# AI回复缓存：最多缓存多少条、有效期（秒）、持久化文件（设为None则只缓存在内存中）
+AI_CACHE_MAX_ENTRIES = 500
+AI_CACHE_TTL = 6 * 3600
+AI_CACHE_FILE = os.path.join(os.path.dirname(__file__), "data", "ai_cache.json")
+
+# AsyncOpenAI客户端不在启动时创建，避免导入openai拖慢启动；
+# 服务器开始监听后在后台线程中预先创建（见server.make_app），第一次@川小农请求不必等待导入
+_ai_client = None
+_ai_client_lock = threading.Lock()
+
+
+def get_ai_client():
+    """获取（必要时创建）AsyncOpenAI客户端，可以在任意线程中调用"""
+    global _ai_client
+    if _ai_client is None:
+        with _ai_client_lock:
+            if _ai_client is None:
+                from openai import AsyncOpenAI
+
+                _ai_client = AsyncOpenAI(
+                    api_key=AI_API_KEY,
+                    base_url=AI_BASE_URL
+                )
+    return _ai_client
@@ -1,17 +1,19 @@
 import json
+import time
 import tornado.web
-from services.excel_handler import ExcelHandler
+from services.city_service import city_service
+from services.metrics import metrics
+
+CITY_LOOKUP_SECONDS = metrics.histogram("city_lookup_seconds", "/api/city 城市查询的耗时")
 
 class CityHandler(tornado.web.RequestHandler):
     """城市处理程序，提供城市名称到adcode的转换功能"""
     
-    def initialize(self):
-        # 初始化ExcelHandler，用于读取城市数据
-        self.excel_handler = ExcelHandler()
-    
     def get(self):
         # 获取城市名称参数
         city_name = self.get_argument("name", "")
+        # 可选参数：最多返回的城市数量（用于输入联想）
+        limit = self.get_argument("limit", None)
         
         if not city_name:
             self.write({
@@ -22,8 +24,15 @@ class CityHandler(tornado.web.RequestHandler):
             return
         
         try:
-            # 根据城市名称查找匹配的城市
-            matched_cities = self.excel_handler.find_by_city_name(city_name)
+            limit = int(limit) if limit else None
+            if limit is not None and limit <= 0:
+                limit = None
+
+            # 根据城市名称查找匹配的城市（使用进程内共享的城市索引）
+            # 结果已按 完全匹配 > 前缀匹配 > 包含匹配 排序
+            start = time.perf_counter()
+            matched_cities = city_service.find_by_city_name(city_name, limit)
+            CITY_LOOKUP_SECONDS.observe(time.perf_counter() - start)
             
             if not matched_cities:
                 self.write({
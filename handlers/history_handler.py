@@ -0,0 +1,46 @@
+from handlers.base_handler import BaseHandler
+from services.chat_log import chat_log
+from services.db_executor import db_executor, DBBusyError
+from handlers.websocket.chat_hub import normalize_room
+from config import WS_REQUIRE_AUTH, HISTORY_PAGE_MAX, CHAT_DEFAULT_ROOM
+
+# 序号上限，before缺省时表示从最新的消息开始
+MAX_SEQ = 2 ** 63 - 1
+
+
+class HistoryHandler(BaseHandler):
+    """聊天记录分页查询API：/api/history?room=房间名&before=序号&limit=条数"""
+    async def get(self):
+        self.set_header('Content-Type', 'application/json')
+        if WS_REQUIRE_AUTH and not self.get_secure_cookie("username"):
+            self.set_status(401)
+            self.write({"success": False, "message": "未登录"})
+            return
+
+        try:
+            before = int(self.get_argument("before", MAX_SEQ))
+            limit = int(self.get_argument("limit", 50))
+        except ValueError:
+            self.write({"success": False, "message": "参数格式错误"})
+            return
+        # 超出SQLite整数范围的序号会在查询时抛出OverflowError，先限制在有效范围内
+        before = max(0, min(before, MAX_SEQ))
+        limit = max(1, min(limit, HISTORY_PAGE_MAX))
+        room = normalize_room(self.get_argument("room", CHAT_DEFAULT_ROOM))
+        if room is None:
+            self.write({"success": False, "message": "房间名不合法"})
+            return
+
+        try:
+            # 多取一条用来判断是否还有更早的消息
+            payloads = await db_executor.run(chat_log.messages_before, room, before, limit + 1)
+        except DBBusyError:
+            self.write({"success": False, "message": "服务器繁忙，请稍后再试"})
+            return
+
+        has_more = len(payloads) > limit
+        if has_more:
+            payloads = payloads[1:]
+        # 消息在写入时已序列化，直接拼接，不重新解析
+        self.write(b'{"success": true, "has_more": ' + (b"true" if has_more else b"false")
+                   + b', "messages": [' + b", ".join(payloads) + b"]}")
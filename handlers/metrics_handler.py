@@ -0,0 +1,11 @@
+import tornado.web
+from services.metrics import metrics
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """指标API：Prometheus文本格式，多进程模式下每个工作进程各自统计"""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.set_header("Cache-Control", "no-cache")
+        self.write(metrics.render())
@@ -2,6 +2,10 @@ import time
 import json
 from handlers.base_handler import BaseHandler
 from services.db_service import db_service
+from services.db_executor import DBBusyError
+from services.password_hasher import HasherBusyError
+from services.session_auth import session_auth
+from config import WS_TOKEN_TTL
 
 
 class LoginHandler(BaseHandler):
@@ -11,7 +15,7 @@ class LoginHandler(BaseHandler):
         version = str(int(time.time()))
         self.render("login.html", version=version)
     
-    def post(self):
+    async def post(self):
         """处理登录请求"""
         try:
             # 获取请求参数（支持JSON格式）
@@ -28,19 +32,21 @@ class LoginHandler(BaseHandler):
                 return
             
             # 验证用户
-            if db_service.login_user(username, password):
+            if await db_service.login_user_async(username, password):
                 # 登录成功，设置用户会话
                 self.set_secure_cookie("username", username)
                 self.write(json.dumps({"success": True, "message": "登录成功"}))
             else:
                 self.write(json.dumps({"success": False, "message": "用户名或密码错误"}))
+        except (DBBusyError, HasherBusyError):
+            self.write(json.dumps({"success": False, "message": "服务器繁忙，请稍后再试"}))
         except Exception as e:
             self.write(json.dumps({"success": False, "message": f"登录失败: {str(e)}"}))
 
 
 class RegisterHandler(BaseHandler):
     """注册页面处理器"""
-    def post(self):
+    async def post(self):
         """处理注册请求"""
         try:
             # 获取请求参数（支持JSON格式）
@@ -72,17 +78,19 @@ class RegisterHandler(BaseHandler):
                 return
             
             # 注册用户
-            if db_service.register_user(username, password):
+            if await db_service.register_user_async(username, password):
                 self.write(json.dumps({"success": True, "message": "注册成功"}))
             else:
                 self.write(json.dumps({"success": False, "message": "用户名已存在"}))
+        except (DBBusyError, HasherBusyError):
+            self.write(json.dumps({"success": False, "message": "服务器繁忙，请稍后再试"}))
         except Exception as e:
             self.write(json.dumps({"success": False, "message": f"注册失败: {str(e)}"}))
 
 
 class UsernameCheckHandler(BaseHandler):
     """检查用户名是否存在的API处理器"""
-    def post(self):
+    async def post(self):
         """处理用户名检查请求"""
         try:
             # 获取请求参数（支持JSON格式）
@@ -91,14 +99,34 @@ class UsernameCheckHandler(BaseHandler):
                 username = data.get("username", "").strip()
             else:
                 username = self.get_argument("username", "").strip()
-            if db_service.check_username_exists(username):
+            if await db_service.check_username_exists_async(username):
                 self.write(json.dumps({"available": False, "message": "该用户名已被使用"}))
             else:
                 self.write(json.dumps({"available": True, "message": "该用户名可用"}))
+        except DBBusyError:
+            self.write(json.dumps({"available": False, "message": "服务器繁忙，请稍后再试"}))
         except Exception as e:
             self.write(json.dumps({"available": False, "message": f"检查失败: {str(e)}"}))
 
 
+class WebSocketTokenHandler(BaseHandler):
+    """签发WebSocket连接令牌的API处理器"""
+    def get(self):
+        username = self.get_secure_cookie("username")
+        self.set_header("Cache-Control", "no-store")
+        if not username:
+            self.set_status(401)
+            self.write(json.dumps({"success": False, "message": "未登录"}))
+            return
+        username = username.decode()
+        self.write(json.dumps({
+            "success": True,
+            "username": username,
+            "token": session_auth.issue_token(username),
+            "expires_in": WS_TOKEN_TTL
+        }))
+
+
 class ChatHandler(BaseHandler):
     """聊天页面处理器"""
     def get(self):
@@ -0,0 +1,405 @@
+import json
+import time
+from collections import OrderedDict
+import tornado.ioloop
+from services.broadcast_bus import InProcessBus
+from services.chat_log import chat_log
+from services.ai_streams import ai_streams
+from services.metrics import metrics
+from config import CHAT_DEFAULT_ROOM, ROOM_NAME_MAX, MAX_ROOM_HISTORIES, PRESENCE_DEBOUNCE
+from handlers.websocket.frames import encode_text_frame
+from handlers.websocket.history import MessageHistory, SequenceClock, stamp_seq, parse_seq
+
+# 总线消息类型（首字节）
+# 聊天消息、加入、离开的正文以 房间名 + 换行 开头
+BUS_MESSAGE = b"M"        # 聊天消息，正文为 房间名\n + 发给客户端的JSON
+BUS_JOIN = b"J"           # 用户加入房间，正文为 房间名\n昵称
+BUS_LEAVE = b"L"          # 用户离开房间，正文为 房间名\n昵称
+BUS_PRESENCE = b"P"       # 某节点的完整在线列表（心跳），正文为JSON对象 {房间名: [昵称]}
+BUS_SYNC = b"S"           # 新节点请求其他节点回报在线列表
+BUS_KICK = b"K"           # 已登录用户在其他节点重新连接，正文为昵称，收到的节点关闭该用户的旧连接
+
+# 节点ID固定为12个字符
+NODE_ID_LENGTH = 12
+
+# 不分配序号、不进入历史记录的消息类型（系统通知和临时状态）
+HISTORY_EXCLUDED_TYPES = frozenset(("system", "ai_queue", "history", "presence", "presence_add", "presence_remove"))
+
+# 最多同时记录多少条未结束的AI回复（写入聊天记录时合并片段），超过时丢弃最早的一条
+MAX_OPEN_AI_RESPONSES = 1000
+
+BROADCAST_SECONDS = metrics.histogram("chat_broadcast_seconds", "向本进程一个房间的客户端分发一条消息的耗时")
+BROADCAST_MESSAGES = metrics.counter("chat_broadcast_messages_total", "分发的消息数（每个房间一次）")
+BROADCAST_FRAMES = metrics.counter("chat_broadcast_frames_total", "放入发送队列的帧数（消息数×接收人数）")
+BROADCAST_BYTES = metrics.counter("chat_broadcast_bytes_total", "放入发送队列的字节数（帧长度×接收人数）")
+AI_PARTS_EVICTED = metrics.counter("chat_log_ai_parts_evicted_total",
+                                   "未收到结束消息、因未结束的AI回复过多而被丢弃的回复数")
+
+
+def normalize_room(name):
+    """校验房间名：去掉首尾空白，长度不超过ROOM_NAME_MAX，不含控制字符；不合法时返回None"""
+    if not isinstance(name, str):
+        return None
+    name = name.strip()
+    if not name or len(name) > ROOM_NAME_MAX or any(ord(ch) < 32 for ch in name):
+        return None
+    return name
+
+
+class ChatHub:
+    """
+    聊天室中枢：管理本进程的连接和房间，并通过广播总线与其他进程/节点同步消息和在线状态
+
+    每个连接同一时间属于一个房间，广播只遍历该房间的成员。
+    在线状态在加入房间时发送完整快照，之后只发送合并后的增量（presence_add / presence_remove）。
+    总线消息格式为 类型(1字节) + 来源节点ID(12字节) + 正文；
+    聊天消息的正文就是发给客户端的JSON字节，接收节点无需重新解析和序列化
+    """
+
+    # 心跳间隔和远端在线状态的过期时间（秒）
+    HEARTBEAT_INTERVAL = 15
+    PRESENCE_TTL = 45
+
+    def __init__(self):
+        # 本进程的连接: {昵称: WebSocketHandler}，连接的room属性为所在房间
+        self.clients = {}
+        # 本进程各房间的成员: {房间名: {昵称: WebSocketHandler}}
+        self.rooms = {}
+        # 其他节点的在线用户: {节点ID: {房间名: set(昵称)}}
+        self.remote_users = {}
+        # 最近一次收到其他节点消息的时间: {节点ID: monotonic}
+        self.remote_seen = {}
+        self.bus = InProcessBus()
+        self._heartbeat = None
+        # 各房间最近消息的环形缓冲，供客户端重连时补发: {房间名: MessageHistory}
+        self.histories = OrderedDict()
+        self.seq_clock = SequenceClock()
+        self._seq_restored = False
+        # 进行中的AI回复片段: {回复ID: [片段]}，按开始时间排序
+        self.ai_parts = OrderedDict()
+        # 等待合并发送的在线状态变化: {房间名: {昵称: 变化前是否在线}}
+        self.presence_pending = {}
+        self._presence_timer = None
+
+    def set_bus(self, bus):
+        """切换广播总线（需在IOLoop所在进程中调用，多进程时在fork之后调用）"""
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+        self.bus.close()
+
+        self.bus = bus
+        bus.start(self._on_bus_message)
+        if isinstance(bus, InProcessBus):
+            return
+
+        # 请求其他节点回报在线列表，并定期发送自己的在线列表作为心跳
+        self._publish(BUS_SYNC, b"")
+        self._heartbeat = tornado.ioloop.PeriodicCallback(
+            self._send_presence, self.HEARTBEAT_INTERVAL * 1000)
+        self._heartbeat.start()
+
+    # =================== 在线状态 ===================
+    def _expire_remote(self):
+        now = time.monotonic()
+        for node_id, seen in list(self.remote_seen.items()):
+            if now - seen > self.PRESENCE_TTL:
+                del self.remote_seen[node_id]
+                for room, users in self.remote_users.get(node_id, {}).items():
+                    for nickname in users:
+                        self._presence_touch(room, nickname)
+                self.remote_users.pop(node_id, None)
+
+    def is_online(self, nickname):
+        """昵称是否已在任意节点、任意房间上线"""
+        if nickname in self.clients:
+            return True
+        self._expire_remote()
+        return any(nickname in users
+                   for node_rooms in self.remote_users.values() for users in node_rooms.values())
+
+    def online_users(self, room=CHAT_DEFAULT_ROOM):
+        """某个房间在所有节点上的在线用户列表"""
+        users = list(self.rooms.get(room, ()))
+        if self.remote_users:
+            self._expire_remote()
+            seen = set(users)
+            for node_rooms in self.remote_users.values():
+                for nickname in node_rooms.get(room, ()):
+                    if nickname not in seen:
+                        seen.add(nickname)
+                        users.append(nickname)
+        return users
+
+    def _in_room(self, room, nickname):
+        """昵称是否在某个房间在线（任意节点）"""
+        if nickname in self.rooms.get(room, ()):
+            return True
+        return any(nickname in node_rooms.get(room, ()) for node_rooms in self.remote_users.values())
+
+    def add_client(self, nickname, client, room=CHAT_DEFAULT_ROOM):
+        """注册本进程的新连接并加入房间；同名的旧连接被取代"""
+        previous = self.clients.get(nickname)
+        if previous is not None:
+            self._leave_room(previous)
+        self.clients[nickname] = client
+        client.room = None
+        self.join_room(client, room)
+
+    def remove_client(self, nickname, client):
+        """移除本进程的连接，只有注册的连接才会被移除"""
+        if self.clients.get(nickname) is not client:
+            return False
+        self._leave_room(client)
+        del self.clients[nickname]
+        return True
+
+    def kick(self, nickname):
+        """已登录用户在本节点重新连接时调用，通知其他节点关闭该用户的旧连接"""
+        self._publish(BUS_KICK, nickname.encode("utf-8"))
+
+    def join_room(self, client, room):
+        """把连接移到另一个房间并发送该房间的在线快照，返回原来的房间"""
+        previous = client.room
+        if previous != room:
+            self._leave_room(client)
+            self._presence_touch(room, client.nickname)
+            client.room = room
+            self.rooms.setdefault(room, {})[client.nickname] = client
+            self._publish(BUS_JOIN, self._room_body(room, client.nickname.encode("utf-8")))
+        self.send_to(client, {"type": "presence", "room": room, "users": self.online_users(room)})
+        return previous
+
+    def _leave_room(self, client):
+        room = getattr(client, "room", None)
+        members = self.rooms.get(room)
+        if members is None or members.get(client.nickname) is not client:
+            return
+        self._presence_touch(room, client.nickname)
+        del members[client.nickname]
+        if not members:
+            del self.rooms[room]
+            self._check_room_empty(room)
+        self._publish(BUS_LEAVE, self._room_body(room, client.nickname.encode("utf-8")))
+
+    def _room_empty(self, room):
+        """房间在所有节点上都没有人"""
+        if self.rooms.get(room):
+            return False
+        return not any(node_rooms.get(room) for node_rooms in self.remote_users.values())
+
+    def _check_room_empty(self, room):
+        # 房间没有人时，该房间进行中的AI回复稍后被取消（期间有人回来则保留）
+        if self._room_empty(room):
+            ai_streams.room_empty(room, lambda: self._room_empty(room))
+
+    def _presence_touch(self, room, nickname):
+        """在线状态即将变化：记下变化前的状态，稍后合并发送增量"""
+        pending = self.presence_pending.setdefault(room, {})
+        if nickname not in pending:
+            pending[nickname] = self._in_room(room, nickname)
+        if self._presence_timer is None:
+            self._presence_timer = tornado.ioloop.IOLoop.current().call_later(
+                PRESENCE_DEBOUNCE, self._flush_presence)
+
+    def _flush_presence(self):
+        """
+        把一段时间内的加入/离开合并为每个房间最多两条消息
+
+        只比较变化前后的状态，短时间内离开又回来（例如重连）不会产生任何消息
+        """
+        self._presence_timer = None
+        pending, self.presence_pending = self.presence_pending, {}
+        for room, changes in pending.items():
+            if room not in self.rooms:
+                continue
+            added = []
+            removed = []
+            for nickname, before in changes.items():
+                now = self._in_room(room, nickname)
+                if now and not before:
+                    added.append(nickname)
+                elif before and not now:
+                    removed.append(nickname)
+            if added:
+                self.deliver_local(self.encode({"type": "presence_add", "room": room, "users": added}), room)
+            if removed:
+                self.deliver_local(self.encode({"type": "presence_remove", "room": room, "users": removed}), room)
+
+    def _send_presence(self):
+        self._expire_remote()
+        presence = {room: list(members) for room, members in self.rooms.items()}
+        self._publish(BUS_PRESENCE, json.dumps(presence, ensure_ascii=False).encode("utf-8"))
+
+    # =================== 消息广播 ===================
+    @staticmethod
+    def encode(message_dict):
+        """把消息序列化为UTF-8 JSON，每条消息只序列化一次"""
+        return json.dumps(message_dict, ensure_ascii=False).encode("utf-8")
+
+    def restore_seq(self):
+        """从聊天记录中已保存的最大序号继续（时钟回拨时序号也不会倒退）；启动时或第一次分配序号时调用"""
+        if self._seq_restored:
+            return
+        self._seq_restored = True
+        self.seq_clock.observe(chat_log.max_seq())
+
+    def history(self, room):
+        """房间的消息缓冲；房间数超过上限时淘汰最久未使用且没有本地成员的房间"""
+        history = self.histories.get(room)
+        if history is not None:
+            self.histories.move_to_end(room)
+            return history
+        history = self.histories[room] = MessageHistory()
+        if len(self.histories) > MAX_ROOM_HISTORIES:
+            for name in list(self.histories):
+                if name not in self.rooms and name != room:
+                    del self.histories[name]
+                    break
+        return history
+
+    def broadcast(self, message_dict, room=CHAT_DEFAULT_ROOM):
+        """向某个房间在所有节点上的客户端广播消息；聊天消息带上序号并记入历史"""
+        if "seq" in message_dict:
+            # 序号只能由服务器分配，消息中已有的seq会与拼接的序号重复（JSON解析时后者生效）
+            message_dict = {key: value for key, value in message_dict.items() if key != "seq"}
+        payload = self.encode(message_dict)
+        if message_dict.get("type") not in HISTORY_EXCLUDED_TYPES:
+            self.restore_seq()
+            seq = self.seq_clock.next()
+            payload = stamp_seq(payload, seq)
+            self.history(room).append(seq, payload)
+            # 只有消息产生的节点写入聊天记录，其他节点从总线收到的消息不重复写入
+            self._log(message_dict, seq, room, payload)
+        self.deliver_local(payload, room)
+        self._publish(BUS_MESSAGE, self._room_body(room, payload))
+
+    def _log(self, message_dict, seq, room, payload):
+        """写入聊天记录；AI回复的流式片段在回复结束时合并为一条完整回复"""
+        msg_type = message_dict.get("type", "")
+        if msg_type == "ai_stream_update":
+            parts = self.ai_parts.get(message_dict.get("id"))
+            if parts is None:
+                if len(self.ai_parts) >= MAX_OPEN_AI_RESPONSES:
+                    # 结束消息丢失的回复（例如被取消）不会再结束，丢弃最早的一条，不影响新的回复
+                    self.ai_parts.popitem(last=False)
+                    AI_PARTS_EVICTED.inc()
+                parts = self.ai_parts[message_dict.get("id")] = []
+            parts.append(message_dict.get("content", ""))
+            return
+
+        if msg_type == "ai_stream_end":
+            parts = self.ai_parts.pop(message_dict.get("id"), None)
+            if not parts:
+                return
+            # 以结束消息的序号保存完整回复
+            msg_type = "ai_stream_update"
+            payload = stamp_seq(self.encode({
+                "type": msg_type,
+                "id": message_dict.get("id"),
+                "content": "".join(parts)
+            }), seq)
+
+        chat_log.append(seq, room, msg_type, payload)
+
+    def send_to(self, client, message_dict):
+        """只发给一个客户端（不分配序号、不记入历史）"""
+        payload = self.encode(message_dict)
+        client.send_queue.push(encode_text_frame(payload), payload)
+
+    def sync_client(self, client, last_seq):
+        """向单个客户端补发其所在房间中序号大于last_seq的消息"""
+        payload = self.history(client.room).encode_sync(last_seq)
+        client.send_queue.push(encode_text_frame(payload), payload)
+
+    def deliver_local(self, payload, room):
+        """
+        向本进程某个房间的客户端发送已序列化的消息，帧只组装一次，所有连接共享同一份字节
+
+        每个连接都有自己的有界发送队列，慢速客户端不会阻塞其他连接
+        """
+        members = self.rooms.get(room)
+        if not members:
+            return
+        start = time.perf_counter()
+        frame = encode_text_frame(payload)
+        for client in list(members.values()):
+            client.send_queue.push(frame, payload)
+        BROADCAST_SECONDS.observe(time.perf_counter() - start)
+        BROADCAST_MESSAGES.inc()
+        BROADCAST_FRAMES.inc(len(members))
+        BROADCAST_BYTES.inc(len(frame) * len(members))
+
+    # =================== 总线 ===================
+    @staticmethod
+    def _room_body(room, body):
+        return room.encode("utf-8") + b"\n" + body
+
+    @staticmethod
+    def _split_room(body):
+        room, _, rest = body.partition(b"\n")
+        return room.decode("utf-8"), rest
+
+    def _publish(self, kind, body):
+        if isinstance(self.bus, InProcessBus):
+            return
+        self.bus.publish(kind + self.bus.node_id.encode("ascii") + body)
+
+    def _on_bus_message(self, payload):
+        kind = payload[:1]
+        node_id = payload[1:1 + NODE_ID_LENGTH].decode("ascii")
+        body = payload[1 + NODE_ID_LENGTH:]
+        if node_id == self.bus.node_id:
+            return
+
+        self.remote_seen[node_id] = time.monotonic()
+        if kind == BUS_MESSAGE:
+            room, body = self._split_room(body)
+            seq = parse_seq(body)
+            if seq is not None:
+                self.seq_clock.observe(seq)
+                self.history(room).append(seq, body)
+            self.deliver_local(body, room)
+        elif kind == BUS_JOIN:
+            room, nickname = self._split_room(body)
+            nickname = nickname.decode("utf-8")
+            self._presence_touch(room, nickname)
+            self.remote_users.setdefault(node_id, {}).setdefault(room, set()).add(nickname)
+        elif kind == BUS_LEAVE:
+            room, nickname = self._split_room(body)
+            nickname = nickname.decode("utf-8")
+            node_rooms = self.remote_users.setdefault(node_id, {})
+            users = node_rooms.get(room)
+            if users is not None and nickname in users:
+                self._presence_touch(room, nickname)
+                users.discard(nickname)
+                if not users:
+                    del node_rooms[room]
+                    self._check_room_empty(room)
+        elif kind == BUS_PRESENCE:
+            presence = {room: set(users) for room, users in json.loads(body).items()}
+            previous = self.remote_users.get(node_id, {})
+            for room in set(previous) | set(presence):
+                for nickname in previous.get(room, set()) ^ presence.get(room, set()):
+                    self._presence_touch(room, nickname)
+            self.remote_users[node_id] = presence
+        elif kind == BUS_SYNC:
+            self._send_presence()
+        elif kind == BUS_KICK:
+            client = self.clients.get(body.decode("utf-8"))
+            if client is not None:
+                client.supersede()
+
+
+# 创建聊天中枢实例（每个进程一个）
+chat_hub = ChatHub()
+
+
+def _queue_depths():
+    return [client.send_queue.depth for client in chat_hub.clients.values() if hasattr(client, "send_queue")]
+
+
+# 发送队列深度在采集时统计，发送路径上不需要额外维护
+metrics.gauge("chat_connections", "本进程的WebSocket连接数", func=lambda: len(chat_hub.clients))
+metrics.gauge("chat_rooms", "本进程有成员的房间数", func=lambda: len(chat_hub.rooms))
+metrics.gauge("chat_send_queue_depth_max", "本进程发送队列的最大深度（条）", func=lambda: max(_queue_depths(), default=0))
+metrics.gauge("chat_send_queue_messages", "本进程所有发送队列中等待的消息数", func=lambda: sum(_queue_depths()))
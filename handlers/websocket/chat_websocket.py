@@ -1,12 +1,33 @@
 import json
-import uuid
+import time
+import functools
 import tornado.websocket
 import tornado.ioloop
-from services.feature_service import FeatureService
+from services.feature_service import feature_service
+from services.command_dispatcher import command_dispatcher
+from services.ai_streams import ai_streams
+from services.conversation_memory import conversation_memory
 from tornado.web import RequestHandler
+from handlers.websocket.chat_hub import chat_hub, normalize_room
+from handlers.websocket.send_queue import SendQueue
+from services.session_auth import session_auth, COOKIE_NAME
+from services.metrics import metrics
+from config import SEND_QUEUE_MAX_MESSAGES, SEND_QUEUE_MAX_BYTES, SEND_QUEUE_POLICY, WS_REQUIRE_AUTH, CHAT_DEFAULT_ROOM
 
-# 存储已连接的用户: {昵称: WebSocketHandler}
-clients = {}
+# 切换房间的文本命令
+JOIN_COMMAND = "/join"
+LEAVE_COMMAND = "/leave"
+# 停止自己正在进行的AI回复
+STOP_COMMAND = "/stop"
+# 清空川小农的对话记忆，开始新的对话
+RESET_COMMAND = "/reset"
+
+# 存储本进程已连接的用户: {昵称: WebSocketHandler}
+# 其他进程/节点的在线用户由chat_hub通过广播总线同步
+clients = chat_hub.clients
+
+MESSAGE_SECONDS = metrics.histogram("chat_message_handle_seconds", "处理一条客户端消息（on_message）的耗时")
+MESSAGE_ERRORS = metrics.counter("chat_message_errors_total", "处理出错的客户端消息数")
 
 
 class NicknameCheckHandler(RequestHandler):
@@ -17,7 +38,7 @@ class NicknameCheckHandler(RequestHandler):
             self.write({"available": False, "message": "请输入昵称"})
             return
         
-        if nickname in clients:
+        if chat_hub.is_online(nickname):
             self.write({"available": False, "message": "该昵称已被使用"})
         else:
             self.write({"available": True, "message": "昵称可用"})
@@ -29,88 +50,153 @@ class ChatWebSocket(tornado.websocket.WebSocketHandler):
     def check_origin(self, origin):
         return True
 
+    def authenticate(self):
+        """从token参数或登录Cookie得到用户名；不要求登录时退回到nickname参数"""
+        nickname = session_auth.verify(self.get_cookie(COOKIE_NAME), self.get_argument("token", None))
+        self.authenticated = nickname is not None
+        if nickname is None and not WS_REQUIRE_AUTH:
+            nickname = self.get_argument("nickname", None)
+        return nickname
+
     def open(self):
         """新连接打开时的处理"""
-        self.nickname = self.get_argument("nickname", None)
+        self.nickname = self.authenticate()
         if not self.nickname:
-            self.close(code=1008, reason="请输入昵称")
+            reason = "未登录或登录已过期" if WS_REQUIRE_AUTH else "请输入昵称"
+            self.close(code=1008, reason=reason)
             return
         
-        if self.nickname in clients:
-            self.close(code=1008, reason="该昵称已被使用")
-            return
+        # 已登录用户重新连接（例如网络切换后旧连接还没断开）时，新连接取代旧连接；
+        # 旧连接在其他进程/节点上时通过广播总线通知那个节点关闭它
+        previous = clients.get(self.nickname) if self.authenticated else None
+        if previous is None and chat_hub.is_online(self.nickname):
+            if not self.authenticated:
+                self.close(code=1008, reason="该昵称已被使用")
+                return
+            chat_hub.kick(self.nickname)
         
-        clients[self.nickname] = self
-        print(f"用户已连接: {self.nickname}")
+        room = normalize_room(self.get_argument("room", CHAT_DEFAULT_ROOM)) or CHAT_DEFAULT_ROOM
+
+        # 每个连接独立的有界发送队列
+        self.send_queue = SendQueue(self, SEND_QUEUE_MAX_MESSAGES, SEND_QUEUE_MAX_BYTES, SEND_QUEUE_POLICY)
+        chat_hub.add_client(self.nickname, self, room)
+        chat_hub.send_to(self, {"type": "joined", "room": room})
+        # 断开后很快重新连接时，保留之前的AI回复
+        ai_streams.user_returned(self.nickname)
         
-        # 广播加入消息
-        self.broadcast({
-            "type": "system",
-            "content": f"{self.nickname} 加入了聊天室",
-            "online_users": list(clients.keys())
-        })
+        # 加入/离开由chat_hub以在线状态增量的形式合并通知房间内的其他人
+        if previous is not None:
+            previous.supersede()
+            print(f"用户已重新连接: {self.nickname}")
+        else:
+            print(f"用户已连接: {self.nickname}")
+
+        # 客户端带上最后收到的消息序号时，补发断线期间错过的消息
+        last_seq = self.get_argument("last_seq", None)
+        if last_seq and last_seq.isdigit():
+            chat_hub.sync_client(self, int(last_seq))
+
+    def supersede(self):
+        """同一用户在别处重新连接，关闭这个旧连接（客户端收到4000后不再自动重连）"""
+        self.send_queue.close()
+        self.close(code=4000, reason="已在其他位置重新连接")
 
     def on_message(self, message):
         """处理接收到的消息"""
+        start = time.perf_counter()
+        self.handle_message(message)
+        MESSAGE_SECONDS.observe(time.perf_counter() - start)
+
+    def handle_message(self, message):
+        """解析并分发一条客户端消息"""
         try:
             data = json.loads(message)
             msg_type = data.get("type", "text")
             content = data.get("content", "")
+
+            # 客户端请求补发序号大于last_seq的消息
+            if msg_type == "sync":
+                chat_hub.sync_client(self, int(data.get("last_seq") or 0))
+                return
+
+            # 切换房间：{"type": "join", "room": 房间名}、{"type": "leave"}，或文本命令 /join 房间名、/leave
+            if msg_type == "command" and content:
+                command, _, argument = content.strip().partition(" ")
+                if command == JOIN_COMMAND:
+                    msg_type, data = "join", {"room": argument, "last_seq": data.get("last_seq")}
+                elif command == LEAVE_COMMAND:
+                    msg_type = "leave"
+                elif command == STOP_COMMAND:
+                    msg_type = "ai_stop"
+                elif command == RESET_COMMAND:
+                    msg_type = "ai_reset"
+            if msg_type == "join":
+                self.switch_room(data.get("room"), data.get("last_seq"))
+                return
+            if msg_type == "leave":
+                self.switch_room(CHAT_DEFAULT_ROOM, data.get("last_seq"))
+                return
+            # 停止AI回复：{"type": "ai_stop", "id": 回复ID}，不带id时停止自己所有的回复
+            if msg_type == "ai_stop":
+                if not ai_streams.stop(self.nickname, data.get("id")):
+                    chat_hub.send_to(self, {"type": "system", "content": "没有可以停止的AI回复"})
+                return
+            # 清空对话记忆：按房间保存时清空的是整个房间的对话
+            if msg_type == "ai_reset":
+                conversation_memory.clear(conversation_memory.key(self.nickname, self.room))
+                chat_hub.send_to(self, {"type": "system", "content": "已清空川小农的对话记忆"})
+                return
             
             # 检查是否为天气卡片消息（已经处理过的）
-            if msg_type == "chat" and content and "<div class='weather-card'>" in content:
-                # 直接广播天气卡片消息，不需要再次处理
-                self.broadcast(data)
+            if msg_type == "chat" and isinstance(content, str) and "<div class='weather-card'>" in content:
+                # 直接广播天气卡片，消息由服务器重新组装，客户端不能指定发送者、房间或序号
+                self.broadcast({
+                    "type": "chat",
+                    "sender": self.nickname,
+                    "content": content,
+                    "timestamp": data.get("timestamp")
+                })
                 return
             
-            # 初始化FeatureService
-            feature_service = FeatureService()
-            
-            # 检查是否为电影功能
-            if feature_service.is_movie_message(content):
-                response = feature_service.process_movie_message(self.nickname, content, data.get("timestamp"))
-                self.broadcast(response)
-            elif feature_service.is_news_request(content):
-                response = feature_service.process_news_message(self.nickname, content, data.get("timestamp"))
-                self.broadcast(response)
-            elif feature_service.is_ai_request(content):
-                # 准备AI回复
-                user_msg, init_response, user_query, response_id = feature_service.prepare_ai_response(self.nickname, content, data.get("timestamp"))
-                self.broadcast(user_msg)
-                self.broadcast(init_response)
-                
-                # 生成异步任务来流式传输AI响应
-                feature_service.stream_ai_response(self.broadcast, response_id, user_query)
-                return # 在这里返回以避免双重广播
-            else:
-                # 处理普通消息
-                response = feature_service.process_regular_message(self.nickname, content, data.get("timestamp"))
-                self.broadcast(response)
+            # @电影、@新闻、@川小农 等命令：按第一个词查表分发
+            handler, argument = command_dispatcher.lookup(content)
+            if handler is not None:
+                room_broadcast = functools.partial(chat_hub.broadcast, room=self.room)
+                if handler(self.nickname, self.room, argument, data, room_broadcast):
+                    return
+
+            # 处理普通消息
+            self.broadcast(feature_service.process_regular_message(self.nickname, content, data.get("timestamp")))
             
         except Exception as e:
+            MESSAGE_ERRORS.inc()
             print(f"Error handling message: {e}")
 
-    # 不再需要这个方法，因为功能已经移到feature_service中
+    def switch_room(self, room, last_seq=None):
+        """离开当前房间并加入另一个房间"""
+        room = normalize_room(room)
+        if room is None:
+            chat_hub.send_to(self, {"type": "system", "content": "房间名不合法"})
+            return
+        chat_hub.join_room(self, room)
+        chat_hub.send_to(self, {"type": "joined", "room": room})
+        # 带上last_seq时补发新房间中之后的消息，否则补发新房间最近的消息
+        chat_hub.sync_client(self, int(last_seq or 0))
 
     def on_close(self):
         """连接关闭时的处理"""
+        if hasattr(self, 'send_queue'):
+            self.send_queue.close()
         # 只有当这个特定连接是注册的连接时，才从客户端列表中移除
         if hasattr(self, 'nickname') and self.nickname in clients:
-            if clients[self.nickname] == self:
-                del clients[self.nickname]
+            if chat_hub.remove_client(self.nickname, self):
                 print(f"用户已断开连接: {self.nickname}")
-                self.broadcast({
-                    "type": "system",
-                    "content": f"{self.nickname} 离开了聊天室",
-                    "online_users": list(clients.keys())
-                })
+                # 一段时间内没有重新连接（包括连接到其他进程）时，取消该用户排队中和进行中的AI请求，释放名额
+                nickname = self.nickname
+                ai_streams.user_left(nickname, lambda: chat_hub.is_online(nickname))
             else:
                 print(f"{self.nickname}的重复连接已关闭，保留原始连接。")
 
     def broadcast(self, message_dict):
-        """向所有客户端广播消息"""
-        for nickname, client in clients.items():
-            try:
-                client.write_message(json.dumps(message_dict))
-            except:
-                print(f"发送消息给 {nickname} 失败")
+        """向当前房间的所有客户端广播消息（包括其他进程/节点上的客户端）"""
+        chat_hub.broadcast(message_dict, self.room)
@@ -0,0 +1,51 @@
+import struct
+from tornado.iostream import StreamClosedError
+from tornado.websocket import WebSocketClosedError
+
+# FIN位 + 文本帧操作码
+_TEXT_FRAME_HEADER = 0x80 | 0x1
+
+
+def encode_text_frame(payload):
+    """
+    把UTF-8编码的消息组装成完整的服务端WebSocket文本帧（服务端发出的帧不加掩码）
+
+    Args:
+        payload (bytes): UTF-8编码的消息内容
+
+    Returns:
+        bytes: 可直接写入连接的帧
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", _TEXT_FRAME_HEADER, length)
+    elif length <= 0xFFFF:
+        header = struct.pack("!BBH", _TEXT_FRAME_HEADER, 126, length)
+    else:
+        header = struct.pack("!BBQ", _TEXT_FRAME_HEADER, 127, length)
+    return header + payload
+
+
+def write_frame(handler, frame, payload):
+    """
+    把预先组装好的帧写入连接，多个连接可以共享同一份帧数据
+
+    协商了压缩（permessage-deflate）的连接无法共享帧，退回到write_message逐个处理
+
+    Returns:
+        Future: 数据写入内核缓冲区后完成
+    """
+    connection = handler.ws_connection
+    if connection is None or connection.is_closing():
+        raise WebSocketClosedError()
+
+    if getattr(connection, "_compressor", None) is not None or getattr(connection, "mask_outgoing", False):
+        return handler.write_message(payload)
+
+    # 与tornado内部统计保持一致
+    connection._message_bytes_out += len(payload)
+    connection._wire_bytes_out += len(frame)
+    try:
+        return connection.stream.write(frame)
+    except StreamClosedError:
+        raise WebSocketClosedError()
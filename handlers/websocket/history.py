@@ -0,0 +1,117 @@
+import time
+from collections import deque
+from config import HISTORY_MAX_MESSAGES, HISTORY_MAX_BYTES, HISTORY_SYNC_MAX_BYTES
+
+# 带序号的消息以此开头，序号直接拼接在ChatHub序列化好的JSON之前
+SEQ_PREFIX = b'{"seq": '
+
+
+def stamp_seq(payload, seq):
+    """
+    把序号拼接到已序列化的消息中，不需要重新解析和序列化
+
+    payload中不能已有顶层的seq键（ChatHub.broadcast序列化前会去掉），否则JSON中会有两个seq
+    """
+    return SEQ_PREFIX + str(seq).encode("ascii") + b", " + payload[1:]
+
+
+def parse_seq(payload):
+    """读取消息开头的序号，没有序号时返回None"""
+    if not payload.startswith(SEQ_PREFIX):
+        return None
+    end = payload.find(b",", len(SEQ_PREFIX))
+    try:
+        return int(payload[len(SEQ_PREFIX):end])
+    except ValueError:
+        return None
+
+
+class SequenceClock:
+    """
+    消息序号：单调递增的微秒时间戳
+
+    多进程/多节点各自分配序号，以时间戳为基础可以保证各节点的序号大致按时间排列，
+    客户端重连到其他工作进程时，last_seq 仍然可以比较
+    """
+
+    def __init__(self):
+        self.last_seq = 0
+
+    def next(self):
+        self.last_seq = max(self.last_seq + 1, int(time.time() * 1000000))
+        return self.last_seq
+
+    def observe(self, seq):
+        """看到其他节点分配的序号，之后本节点的序号不会比它小"""
+        if seq > self.last_seq:
+            self.last_seq = seq
+
+
+class MessageHistory:
+    """
+    最近消息的环形缓冲：保存 (序号, 序列化后的消息)，按条数和字节数限制内存
+
+    客户端重连时带上最后收到的序号，直接从内存补发之后的消息
+    """
+
+    def __init__(self, max_messages=HISTORY_MAX_MESSAGES, max_bytes=HISTORY_MAX_BYTES):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.messages = deque()
+        self.size = 0
+        # 已被淘汰的最大序号，早于它的last_seq无法完整补发
+        self.evicted_seq = 0
+
+    @property
+    def first_seq(self):
+        return self.messages[0][0] if self.messages else None
+
+    @property
+    def last_seq(self):
+        return self.messages[-1][0] if self.messages else 0
+
+    def append(self, seq, payload):
+        if not self.messages or seq >= self.messages[-1][0]:
+            self.messages.append((seq, payload))
+        else:
+            # 其他节点的消息晚到，按序号插入
+            index = len(self.messages)
+            while index > 0 and self.messages[index - 1][0] > seq:
+                index -= 1
+            self.messages.insert(index, (seq, payload))
+        self.size += len(payload)
+
+        while self.messages and (len(self.messages) > self.max_messages or self.size > self.max_bytes):
+            seq, payload = self.messages.popleft()
+            self.size -= len(payload)
+            self.evicted_seq = max(self.evicted_seq, seq)
+
+    def since(self, last_seq, max_bytes=HISTORY_SYNC_MAX_BYTES):
+        """
+        序号大于last_seq的消息
+
+        Returns:
+            (list[bytes], bool): 消息列表（按序号排列），以及是否有消息因超出缓冲或字节上限而缺失
+        """
+        result = []
+        size = 0
+        truncated = False
+        for seq, payload in reversed(self.messages):
+            if seq <= last_seq:
+                break
+            size += len(payload)
+            if size > max_bytes:
+                truncated = True
+                break
+            result.append(payload)
+        else:
+            # 比last_seq新的消息有一部分已被淘汰
+            truncated = last_seq < self.evicted_seq
+        result.reverse()
+        return result, truncated
+
+    def encode_sync(self, last_seq):
+        """组装发给客户端的history消息，消息正文直接拼接，不重新序列化"""
+        payloads, truncated = self.since(last_seq)
+        return (b'{"type": "history", "truncated": ' + (b"true" if truncated else b"false")
+                + b', "messages": [' + b", ".join(payloads) + b"]}")
@@ -0,0 +1,202 @@
+import json
+from collections import deque
+from handlers.websocket.frames import encode_text_frame, write_frame
+from services.metrics import metrics
+
+# 溢出策略
+POLICY_RESYNC = "resync"             # 断开连接，客户端带着last_seq重连并补发错过的消息
+POLICY_COALESCE = "coalesce"         # 合并同一AI回复的流式片段，仍然超限时按resync处理
+POLICY_DISCONNECT = "disconnect"     # 断开慢速客户端，不再重连
+
+# 要求客户端重连补发的关闭码（客户端不会把它当作最终拒绝）
+RESYNC_CLOSE_CODE = 4001
+
+# ChatHub序列化的AI流式片段在开头（序号之后）带有此类型，用于在溢出时快速识别可合并的消息
+AI_STREAM_TYPE = b'"type": "ai_stream_update"'
+# 类型字段出现的最大偏移：{"seq": 序号, "type": ...
+AI_STREAM_TYPE_END = 64
+
+
+class SendQueueStats:
+    """所有发送队列的汇总统计"""
+    def __init__(self):
+        self.queued_messages = 0
+        self.queued_bytes = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.resynced = 0
+        self.disconnected = 0
+
+    def snapshot(self):
+        return {
+            "queued_messages": self.queued_messages,
+            "queued_bytes": self.queued_bytes,
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "resynced": self.resynced,
+            "disconnected": self.disconnected,
+        }
+
+
+# 创建统计实例（进程内共享）
+send_queue_stats = SendQueueStats()
+
+metrics.counter_func("chat_send_queue_enqueued_total", "因连接忙而进入发送队列的消息数",
+                     lambda: send_queue_stats.queued_messages)
+metrics.counter_func("chat_send_queue_dropped_total", "发送队列溢出断开连接时丢弃的消息数（聊天消息在重连时补发）",
+                     lambda: send_queue_stats.dropped)
+metrics.counter_func("chat_send_queue_coalesced_total", "发送队列溢出时合并的AI片段数", lambda: send_queue_stats.coalesced)
+metrics.counter_func("chat_send_queue_resync_total", "因发送队列溢出而要求客户端重连补发的连接数",
+                     lambda: send_queue_stats.resynced)
+metrics.counter_func("chat_send_queue_disconnected_total", "因发送队列溢出而断开的连接数",
+                     lambda: send_queue_stats.disconnected)
+
+
+class SendQueue:
+    """
+    单个连接的有界发送队列
+
+    同一时间每个连接最多只有一帧在写：上一帧写入内核后才写下一帧，其余帧在队列中排队。
+    慢速客户端只会占满自己的队列，不会让Tornado的写缓冲无限增长，也不会拖慢其他连接。
+    队列不会悄悄丢弃中间的消息（序号不连续，客户端无法发现缺口）：合并后仍然超限时
+    断开连接，客户端带着最后收到的序号重连，从房间历史中补发。
+    """
+
+    def __init__(self, handler, max_messages, max_bytes, policy=POLICY_COALESCE):
+        self.handler = handler
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # 元素为 [帧, 消息正文]
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.closed = False
+        self._inflight = None
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def push(self, frame, payload):
+        """发送一帧；连接空闲时直接写入，否则进入队列"""
+        if self.closed:
+            return False
+
+        if self._inflight is None and not self.queue:
+            return self._write(frame, payload)
+
+        self.queue.append([frame, payload])
+        self.queued_bytes += len(frame)
+        send_queue_stats.queued_messages += 1
+        send_queue_stats.queued_bytes += len(frame)
+        if len(self.queue) > send_queue_stats.max_depth:
+            send_queue_stats.max_depth = len(self.queue)
+
+        if len(self.queue) > self.max_messages or self.queued_bytes > self.max_bytes:
+            self._handle_overflow()
+        return not self.closed
+
+    def _write(self, frame, payload):
+        try:
+            future = write_frame(self.handler, frame, payload)
+        except Exception:
+            self.close()
+            return False
+
+        if future.done():
+            self._inflight = None
+        else:
+            self._inflight = future
+            future.add_done_callback(self._on_written)
+        return True
+
+    def _on_written(self, future):
+        self._inflight = None
+        if future.exception() is not None:
+            self.close()
+            return
+
+        # 写完一帧后继续写下一帧，直到需要等待内核缓冲
+        while self.queue and self._inflight is None and not self.closed:
+            frame, payload = self._pop()
+            self._write(frame, payload)
+
+    def _pop(self):
+        frame, payload = self.queue.popleft()
+        self.queued_bytes -= len(frame)
+        send_queue_stats.queued_messages -= 1
+        send_queue_stats.queued_bytes -= len(frame)
+        return frame, payload
+
+    def _over_limit(self):
+        return len(self.queue) > self.max_messages or self.queued_bytes > self.max_bytes
+
+    def _handle_overflow(self):
+        if self.policy == POLICY_COALESCE:
+            self._coalesce()
+            if not self._over_limit():
+                return
+
+        nickname = getattr(self.handler, 'nickname', None)
+        send_queue_stats.dropped += len(self.queue)
+        self.close()
+        if self.policy == POLICY_DISCONNECT:
+            send_queue_stats.disconnected += 1
+            print(f"发送队列已满，断开慢速客户端: {nickname}")
+            self.handler.close(code=1008, reason="消息接收过慢")
+        else:
+            send_queue_stats.resynced += 1
+            print(f"发送队列已满，要求客户端重连补发: {nickname}")
+            self.handler.close(code=RESYNC_CLOSE_CODE, reason="消息接收过慢，请重新连接")
+
+    def _coalesce(self):
+        """把队列中同一AI回复的多个流式片段合并为一帧"""
+        merged = {}
+        entries = []
+        for frame, payload in self.queue:
+            if payload.find(AI_STREAM_TYPE, 0, AI_STREAM_TYPE_END) != -1:
+                message = json.loads(payload)
+                first = merged.get(message.get("id"))
+                if first is not None:
+                    first[2]["content"] += message.get("content", "")
+                    if "seq" in message:
+                        # 合并后的消息使用最后一个片段的序号，重连时不会重复补发
+                        first[2]["seq"] = message["seq"]
+                    first[3] = True
+                    send_queue_stats.coalesced += 1
+                    continue
+                # [帧, 正文, 解析后的消息, 是否已合并]
+                entry = [frame, payload, message, False]
+                merged[message.get("id")] = entry
+            else:
+                entry = [frame, payload]
+            entries.append(entry)
+
+        if len(entries) == len(self.queue):
+            return
+
+        send_queue_stats.queued_messages -= len(self.queue)
+        send_queue_stats.queued_bytes -= self.queued_bytes
+        self.queue.clear()
+        self.queued_bytes = 0
+        for entry in entries:
+            frame, payload = entry[0], entry[1]
+            if len(entry) == 4 and entry[3]:
+                payload = json.dumps(entry[2], ensure_ascii=False).encode("utf-8")
+                frame = encode_text_frame(payload)
+            self.queue.append([frame, payload])
+            self.queued_bytes += len(frame)
+        send_queue_stats.queued_messages += len(self.queue)
+        send_queue_stats.queued_bytes += self.queued_bytes
+
+    def close(self):
+        """丢弃所有待发送的消息"""
+        if self.closed:
+            return
+        self.closed = True
+        send_queue_stats.queued_messages -= len(self.queue)
+        send_queue_stats.queued_bytes -= self.queued_bytes
+        self.queue.clear()
+        self.queued_bytes = 0
@@ -1,13 +1,41 @@
+import sys
+import time
+
+# 记录启动时间，--profile-startup 模式下统计各模块导入耗时
+_STARTUP_BEGIN = time.perf_counter()
+if "--profile-startup" in sys.argv:
+    from utils.startup_profiler import startup_profiler
+    startup_profiler.install(_STARTUP_BEGIN)
+
+import argparse
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.web
 from config import *
+from services.broadcast_bus import create_bus
 from handlers.base_handler import NoCacheStaticFileHandler
 from handlers.main_handler import MainHandler
 from handlers.config_handler import ConfigHandler
 from handlers.websocket.chat_websocket import ChatWebSocket
-from handlers.page_handlers import LoginHandler, ChatHandler, RegisterHandler, UsernameCheckHandler
+from handlers.websocket.chat_hub import chat_hub
+from handlers.page_handlers import LoginHandler, ChatHandler, RegisterHandler, UsernameCheckHandler, WebSocketTokenHandler
 from handlers.city_handler import CityHandler
+from handlers.history_handler import HistoryHandler
+from handlers.metrics_handler import MetricsHandler
 
-def make_app():
+def warm_ai_client():
+    """导入openai并创建AI客户端（在后台线程中执行），失败时在第一次请求时再试"""
+    try:
+        get_ai_client()
+    except Exception as e:
+        print(f"预先创建AI客户端失败: {e}")
+
+def make_app(**settings):
+    settings.setdefault("debug", DEBUG)
+    # 在后台线程中预先导入openai，第一次@川小农请求不会让IOLoop卡住
+    tornado.ioloop.IOLoop.current().run_in_executor(None, warm_ai_client)
     return tornado.web.Application([
         (r"/", MainHandler),  # 默认重定向到登录页面
         (r"/login", LoginHandler),  # 登录页面
@@ -16,16 +44,47 @@ def make_app():
         (r"/api/check-nickname", UsernameCheckHandler),  # 用户名检查API
         (r"/api/register", RegisterHandler),  # 注册API
         (r"/api/login", LoginHandler),  # 登录API
+        (r"/api/ws-token", WebSocketTokenHandler),  # WebSocket连接令牌API
         (r"/api/city", CityHandler),  # 城市查询API
+        (r"/api/history", HistoryHandler),  # 聊天记录API
+        (r"/api/metrics", MetricsHandler),  # 运行指标API（Prometheus格式）
         (r"/ws", ChatWebSocket),
         (r"/static/(.*)", NoCacheStaticFileHandler, {"path": STATIC_PATH}),
     ],
     template_path=TEMPLATES_PATH,
     cookie_secret=COOKIE_SECRET,
-    debug=DEBUG)
+    websocket_ping_interval=WS_PING_INTERVAL,
+    websocket_ping_timeout=WS_PING_TIMEOUT,
+    **settings)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DaiP 智能聊天室服务器")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="输出各模块导入耗时以及从启动到开始监听的时间")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="工作进程数，0表示CPU核数；多进程之间通过广播总线共享聊天室")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    app = make_app()
+    args = parse_args()
+    backend = BROADCAST_BACKEND
+    # 在fork之前打开聊天记录并读取已保存的最大序号
+    chat_hub.restore_seq()
+    if args.processes != 1:
+        # 先绑定端口再fork，所有工作进程共享同一个监听套接字
+        sockets = tornado.netutil.bind_sockets(SERVER_PORT, SERVER_HOST)
+        tornado.process.fork_processes(args.processes)
+        # 自动重载不支持多进程
+        app = make_app(debug=False)
+        tornado.httpserver.HTTPServer(app).add_sockets(sockets)
+        if backend == "local":
+            backend = "unix"
+    else:
+        app = make_app()
+        app.listen(SERVER_PORT, SERVER_HOST)
+    chat_hub.set_bus(create_bus(backend, BROADCAST_UNIX_DIR, BROADCAST_REDIS_URL, BROADCAST_CHANNEL))
     print(f"服务器已启动在 http://localhost:{SERVER_PORT}")
-    app.listen(SERVER_PORT, SERVER_HOST)
-    tornado.ioloop.IOLoop.current().start()
\ No newline at end of file
+    if args.profile_startup:
+        startup_profiler.report(time.perf_counter())
+        startup_profiler.uninstall()
+    tornado.ioloop.IOLoop.current().start()
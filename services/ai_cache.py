@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+import tornado.ioloop
+from config import AI_CACHE_MAX_ENTRIES, AI_CACHE_TTL, AI_CACHE_FILE
+from services.metrics import metrics
+
+# 问题末尾不影响含义的标点（NFKC之后全角标点已转为半角）
+_TRAILING_PUNCTUATION = " ?!.~。？！…"
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """
+    规范化问题文本：NFKC（全角转半角）、合并空白、转小写、去掉末尾的问号/感叹号等
+
+    例如 "  Python  是什么？" 和 "python 是什么" 得到相同的结果
+    """
+    text = unicodedata.normalize("NFKC", query or "")
+    text = _WHITESPACE.sub(" ", text).strip().lower()
+    return text.rstrip(_TRAILING_PUNCTUATION) or text
+
+
+def make_cache_key(query, model, system_prompt, context=""):
+    """
+    缓存键：规范化后的问题 + 模型 + 系统提示词的哈希
+
+    context为之前对话内容的哈希，同样的问题只有在对话上下文相同时才共享回复；
+    没有上下文时与只看问题的缓存键相同
+    """
+    parts = (model, system_prompt, normalize_query(query))
+    raw = "\0".join(parts + (context,) if context else parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class InflightResponse:
+    """
+    正在生成中的AI回复：一个上游流，多个订阅者
+
+    已收到的片段全部保留，后加入的订阅者先补发已有片段再继续接收新片段；
+    所有订阅者都离开后取消上游任务
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        # 回复不完整（例如达到长度上限被截断）时为False，不写入缓存
+        self.complete = True
+        self.subscribers = 0
+        self.producer = None
+        # 上游请求的排队位置，以及订阅者的排队位置回调
+        self.position = None
+        self.position_listeners = []
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def append(self, content):
+        if content:
+            self.chunks.append(content)
+            self._wake()
+
+    def finish(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def notify_position(self, position):
+        """上游请求排队位置变化时通知所有订阅者"""
+        self.position = position
+        for listener in list(self.position_listeners):
+            listener(position)
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    async def subscribe(self, on_position=None):
+        """依次产出回复片段；上游出错时抛出相同的异常"""
+        self.subscribers += 1
+        if on_position is not None:
+            self.position_listeners.append(on_position)
+            if self.position:
+                on_position(self.position)
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    index += 1
+                    yield self.chunks[index - 1]
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if on_position is not None:
+                self.position_listeners.remove(on_position)
+            if not self.subscribers and not self.done and self.producer is not None:
+                self.producer.cancel()
+
+
+class AIResponseCache:
+    """
+    AI回复缓存：LRU + TTL，可选持久化到data目录
+
+    同时登记正在生成的回复，相同的问题只请求一次上游，结果分发给所有提问者
+    """
+
+    # 写入后延迟多久保存到文件（秒），合并短时间内的多次写入
+    SAVE_DELAY = 5
+
+    def __init__(self, max_entries=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL, file_path=AI_CACHE_FILE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.file_path = file_path
+        # {缓存键: (过期时间, 回复文本)}，按最近使用排序；过期时间使用time.time()以便持久化
+        self.entries = OrderedDict()
+        # {缓存键: InflightResponse}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self._loaded = False
+        self._save_timer = None
+
+    # =================== 缓存 ===================
+    def get(self, key):
+        """返回未过期的缓存回复，没有时返回None"""
+        self._ensure_loaded()
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] < time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, text):
+        if not text or self.max_entries <= 0:
+            return
+        self._ensure_loaded()
+        self.entries[key] = (time.time() + self.ttl, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._schedule_save()
+
+    # =================== 进行中的请求 ===================
+    def get_inflight(self, key):
+        inflight = self.inflight.get(key)
+        if inflight is not None and inflight.done:
+            return None
+        return inflight
+
+    def start_inflight(self, key, produce):
+        """
+        登记一个进行中的请求并启动上游任务
+
+        Args:
+            key: 缓存键
+            produce: 协程函数 produce(inflight)，负责把上游片段写入inflight；
+                     正常结束且回复完整（inflight.complete）时回复写入缓存
+        """
+        inflight = InflightResponse(key)
+        self.inflight[key] = inflight
+
+        async def run():
+            try:
+                await produce(inflight)
+                inflight.finish()
+                if inflight.complete:
+                    self.put(key, inflight.text)
+            except asyncio.CancelledError as e:
+                inflight.finish(e)
+            except Exception as e:
+                inflight.finish(e)
+            finally:
+                if self.inflight.get(key) is inflight:
+                    del self.inflight[key]
+
+        inflight.producer = asyncio.ensure_future(run())
+        return inflight
+
+    # =================== 持久化 ===================
+    def _ensure_loaded(self):
+        # 第一次使用时才读取文件（多进程模式下在fork之后）
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.file_path or not os.path.exists(self.file_path):
+            return
+        try:
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取AI回复缓存失败: {e}")
+            return
+
+        now = time.time()
+        for key, expires_at, text in data.get("entries", []):
+            if expires_at > now:
+                self.entries[key] = (expires_at, text)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        print(f"已加载 {len(self.entries)} 条AI回复缓存")
+
+    def _schedule_save(self):
+        if not self.file_path or self._save_timer is not None:
+            return
+        self._save_timer = tornado.ioloop.IOLoop.current().call_later(self.SAVE_DELAY, self._save)
+
+    def _save(self):
+        self._save_timer = None
+        now = time.time()
+        data = {"entries": [[key, expires_at, text]
+                            for key, (expires_at, text) in self.entries.items() if expires_at > now]}
+        # 在线程池中写文件，不阻塞IOLoop
+        tornado.ioloop.IOLoop.current().run_in_executor(None, self._write_file, data)
+
+    def _write_file(self, data):
+        tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.file_path)
+        except OSError as e:
+            print(f"保存AI回复缓存失败: {e}")
+
+
+# 创建AI回复缓存实例（每个进程一个）
+ai_cache = AIResponseCache()
+
+metrics.counter_func("ai_cache_hits_total", "AI回复缓存命中次数", lambda: ai_cache.hits)
+metrics.counter_func("ai_cache_misses_total", "AI回复缓存未命中次数", lambda: ai_cache.misses)
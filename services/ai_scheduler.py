@@ -0,0 +1,162 @@
+import asyncio
+from collections import deque
+from config import AI_MAX_CONCURRENT, AI_MAX_PER_USER, AI_MAX_QUEUE, AI_MAX_QUEUED_PER_USER
+
+
+class AIQueueFullError(Exception):
+    """AI请求排队已满"""
+    pass
+
+
+class AITicket:
+    """一次AI请求在调度器中的凭据"""
+    __slots__ = ('user', 'response_id', 'on_position', 'future', 'position', 'running')
+
+    def __init__(self, user, response_id, on_position=None):
+        self.user = user
+        self.response_id = response_id
+        # 排队位置变化时回调 on_position(position)
+        self.on_position = on_position
+        self.future = None
+        self.position = 0
+        self.running = False
+
+
+class AIRequestScheduler:
+    """
+    AI请求调度器：全局并发上限 + 每用户并发上限 + 按用户轮转的公平队列
+
+    排队中的请求按用户轮流放行，单个用户连发多条也不会占满队列前部。
+    """
+
+    def __init__(self, max_concurrent=AI_MAX_CONCURRENT, max_per_user=AI_MAX_PER_USER,
+                 max_queue=AI_MAX_QUEUE, max_queued_per_user=AI_MAX_QUEUED_PER_USER):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.active = 0
+        self.active_by_user = {}
+        # 每个用户的等待队列: {用户: deque(AITicket)}
+        self.waiting = {}
+        # 有请求在排队的用户，按轮转顺序排列
+        self.rotation = deque()
+        self.queued = 0
+
+    def _can_run(self, user):
+        return (self.active < self.max_concurrent
+                and self.active_by_user.get(user, 0) < self.max_per_user)
+
+    def _start(self, ticket):
+        ticket.running = True
+        ticket.position = 0
+        self.active += 1
+        self.active_by_user[ticket.user] = self.active_by_user.get(ticket.user, 0) + 1
+
+    async def acquire(self, ticket):
+        """等待直到可以调用上游AI服务"""
+        if not self.queued and self._can_run(ticket.user):
+            self._start(ticket)
+            return
+
+        user_queue = self.waiting.get(ticket.user)
+        if self.queued >= self.max_queue or (user_queue and len(user_queue) >= self.max_queued_per_user):
+            raise AIQueueFullError()
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = self.waiting[ticket.user] = deque()
+            self.rotation.append(ticket.user)
+        user_queue.append(ticket)
+        self.queued += 1
+        # 排队的其他用户可能都被各自的并发上限挡住，此时新请求可以直接放行
+        self._dispatch()
+
+        await ticket.future
+
+    def release(self, ticket):
+        """请求结束（完成、出错或取消）时释放名额"""
+        if ticket.running:
+            ticket.running = False
+            self.active -= 1
+            count = self.active_by_user.get(ticket.user, 1) - 1
+            if count:
+                self.active_by_user[ticket.user] = count
+            else:
+                self.active_by_user.pop(ticket.user, None)
+        else:
+            self._remove_waiting(ticket)
+            if ticket.future is not None and not ticket.future.done():
+                ticket.future.cancel()
+
+        self._dispatch()
+
+    def _remove_waiting(self, ticket):
+        user_queue = self.waiting.get(ticket.user)
+        if not user_queue or ticket not in user_queue:
+            return
+        user_queue.remove(ticket)
+        self.queued -= 1
+        if not user_queue:
+            del self.waiting[ticket.user]
+            self.rotation.remove(ticket.user)
+
+    def _dispatch(self):
+        """按用户轮转放行排队的请求"""
+        while self.queued and self.active < self.max_concurrent:
+            for _ in range(len(self.rotation)):
+                user = self.rotation[0]
+                self.rotation.rotate(-1)
+                if self._can_run(user):
+                    break
+            else:
+                # 排队的用户都已达到各自的并发上限
+                break
+
+            user_queue = self.waiting[user]
+            ticket = user_queue.popleft()
+            self.queued -= 1
+            if not user_queue:
+                del self.waiting[user]
+                self.rotation.remove(user)
+            if ticket.future.done():
+                # 等待中的任务已被取消，还没来得及释放
+                continue
+            self._start(ticket)
+            ticket.future.set_result(None)
+            # 位置0表示排队结束，开始生成
+            self._notify(ticket, 0)
+
+        self._update_positions()
+
+    def _fair_order(self):
+        """模拟轮转顺序，得到排队请求的放行次序"""
+        order = []
+        queues = [list(self.waiting[user]) for user in self.rotation]
+        depth = 0
+        while len(order) < self.queued:
+            for user_queue in queues:
+                if depth < len(user_queue):
+                    order.append(user_queue[depth])
+            depth += 1
+        return order
+
+    def _update_positions(self):
+        """通知排队位置发生变化的请求"""
+        for position, ticket in enumerate(self._fair_order(), 1):
+            if ticket.position != position:
+                ticket.position = position
+                self._notify(ticket, position)
+
+    @staticmethod
+    def _notify(ticket, position):
+        if ticket.on_position is None:
+            return
+        try:
+            ticket.on_position(position)
+        except Exception as e:
+            print(f"通知排队位置失败: {e}")
+
+
+# 创建AI请求调度器实例（进程内共享）
+ai_scheduler = AIRequestScheduler()
@@ -1,17 +1,7 @@
-from config import ai_client, AI_MODEL
+from config import get_ai_client, AI_MODEL
 
-
-class AIService:
-    @staticmethod
-    async def generate_response(query):
-        """生成AI响应"""
-        try:
-            stream = await ai_client.chat.completions.create(
-                model=AI_MODEL,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": """角色：你是一名计算机科学与技术专业的方案编写助手
+# 川小农的系统提示词
+SYSTEM_PROMPT = """角色：你是一名计算机科学与技术专业的方案编写助手
 功能：
 1、你可以接收用户输入的信息或关键字，通过信息或关键字，你可以分析生成与之有关的10个文案主题，以供用户选择。主题列表形式如下：
 [1]xxxxxxx
@@ -21,7 +11,21 @@ class AIService:
 风格一：专业风
 风格二：学生风
 3、你需要提示用户选择风格，并按风格生成与之对应的详细内容。"""
+
+
+class AIService:
+    @staticmethod
+    async def generate_response(query, history=()):
+        """生成AI响应；history为之前的对话消息，放在系统提示词和本次问题之间"""
+        try:
+            stream = await get_ai_client().chat.completions.create(
+                model=AI_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": SYSTEM_PROMPT
                     },
+                    *history,
                     {"role": "user", "content": query}
                 ],
                 stream=True
@@ -30,3 +34,14 @@ class AIService:
             return stream
         except Exception as e:
             raise Exception(f"AI服务错误: {str(e)}")
+
+    @staticmethod
+    async def stream_text(query, history=()):
+        """逐段产出AI回复的文本增量；提前结束或被取消时关闭上游HTTP响应"""
+        stream = await AIService.generate_response(query, history)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
@@ -0,0 +1,155 @@
+import tornado.ioloop
+from config import AI_STREAM_DEADLINE, AI_ROOM_EMPTY_GRACE
+from services.metrics import metrics
+
+# 取消原因，对应发给聊天室的提示
+CANCEL_USER_LEFT = "user_left"
+CANCEL_STOPPED = "stopped"
+CANCEL_TIMEOUT = "timeout"
+CANCEL_ROOM_EMPTY = "room_empty"
+
+AI_STREAMS_CANCELLED = metrics.counter("ai_streams_cancelled_total", "被取消的AI回复数，按原因", ("reason",))
+
+CANCEL_MESSAGES = {
+    CANCEL_USER_LEFT: "\n[已取消: 提问者已离开聊天室]",
+    CANCEL_STOPPED: "\n[已停止: 提问者停止了回复]",
+    CANCEL_TIMEOUT: "\n[已停止: 回复超时]",
+    CANCEL_ROOM_EMPTY: "\n[已取消: 房间中已没有人]",
+}
+
+
+class AIStream:
+    """一个进行中的AI回复任务"""
+    __slots__ = ('response_id', 'user', 'room', 'task', 'reason', '_deadline')
+
+    def __init__(self, response_id, user, room, task):
+        self.response_id = response_id
+        self.user = user
+        self.room = room
+        self.task = task
+        # 被取消的原因，未取消时为None
+        self.reason = None
+        self._deadline = None
+
+
+class AIStreamRegistry:
+    """
+    进行中的AI回复登记表：{response_id: AIStream}
+
+    每个回复都有截止时间；提问者离开、提问者发送停止命令、截止时间到达、
+    或房间中已经没有人时取消回复任务。提问者离开和房间变空都等待一小段时间再确认，
+    刷新页面或网络切换后重新连接不会取消回复。任务取消后订阅的上游流随之关闭
+    （见AIResponseCache：最后一个订阅者离开时取消上游请求）。
+    """
+
+    def __init__(self, deadline=AI_STREAM_DEADLINE, room_empty_grace=AI_ROOM_EMPTY_GRACE):
+        self.deadline = deadline
+        self.room_empty_grace = room_empty_grace
+        self.streams = {}
+        # 各房间进行中的回复: {房间名: set(response_id)}
+        self.by_room = {}
+        # 等待确认房间是否仍然为空的定时器: {房间名: 定时器}
+        self._room_timers = {}
+        # 等待确认提问者是否重新连接的定时器: {用户: 定时器}
+        self._user_timers = {}
+
+    def register(self, response_id, user, room, task):
+        stream = AIStream(response_id, user, room, task)
+        self.streams[response_id] = stream
+        self.by_room.setdefault(room, set()).add(response_id)
+        if self.deadline:
+            stream._deadline = tornado.ioloop.IOLoop.current().call_later(
+                self.deadline, self.cancel, response_id, CANCEL_TIMEOUT)
+        return stream
+
+    def unregister(self, response_id):
+        """回复任务结束时调用"""
+        stream = self.streams.pop(response_id, None)
+        if stream is None:
+            return
+        if stream._deadline is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(stream._deadline)
+        room_streams = self.by_room.get(stream.room)
+        if room_streams is not None:
+            room_streams.discard(response_id)
+            if not room_streams:
+                del self.by_room[stream.room]
+
+    def reason(self, response_id):
+        """回复被取消的原因"""
+        stream = self.streams.get(response_id)
+        return stream.reason if stream is not None else None
+
+    def cancel(self, response_id, reason):
+        stream = self.streams.get(response_id)
+        if stream is None or stream.task is None or stream.task.done():
+            return False
+        if stream.reason is None:
+            stream.reason = reason
+            AI_STREAMS_CANCELLED.labels(reason).inc()
+        stream.task.cancel()
+        return True
+
+    def cancel_user(self, user, reason=CANCEL_USER_LEFT):
+        """取消某个用户所有排队中和进行中的回复"""
+        for stream in list(self.streams.values()):
+            if stream.user == user:
+                self.cancel(stream.response_id, reason)
+
+    def user_left(self, user, is_online):
+        """
+        提问者断开连接时调用；等待一小段时间后is_online()仍为False时
+        取消该用户排队中和进行中的回复
+        """
+        if user in self._user_timers or not any(stream.user == user for stream in self.streams.values()):
+            return
+
+        def check():
+            del self._user_timers[user]
+            if not is_online():
+                self.cancel_user(user, CANCEL_USER_LEFT)
+
+        self._user_timers[user] = tornado.ioloop.IOLoop.current().call_later(self.room_empty_grace, check)
+
+    def user_returned(self, user):
+        """提问者重新连接时调用，不再取消该用户的回复"""
+        timer = self._user_timers.pop(user, None)
+        if timer is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(timer)
+
+    def stop(self, user, response_id=None):
+        """
+        提问者停止回复；不指定response_id时停止该用户所有的回复
+
+        Returns:
+            int: 停止的回复数
+        """
+        if response_id is not None:
+            stream = self.streams.get(response_id)
+            if stream is None or stream.user != user:
+                return 0
+            return 1 if self.cancel(response_id, CANCEL_STOPPED) else 0
+        return sum(1 for stream in list(self.streams.values())
+                   if stream.user == user and self.cancel(stream.response_id, CANCEL_STOPPED))
+
+    def room_empty(self, room, is_empty):
+        """
+        房间中最后一个人离开时调用；等待一小段时间（例如刷新页面重连）后
+        is_empty()仍为True时取消该房间的回复
+        """
+        if room not in self.by_room or room in self._room_timers:
+            return
+
+        def check():
+            del self._room_timers[room]
+            if is_empty():
+                for response_id in list(self.by_room.get(room, ())):
+                    self.cancel(response_id, CANCEL_ROOM_EMPTY)
+
+        self._room_timers[room] = tornado.ioloop.IOLoop.current().call_later(self.room_empty_grace, check)
+
+
+# 创建AI回复登记表实例（每个进程一个）
+ai_streams = AIStreamRegistry()
+
+metrics.gauge("ai_streams_active", "排队中和进行中的AI回复数", func=lambda: len(ai_streams.streams))
@@ -0,0 +1,329 @@
+"""
+广播总线 - 让多个Tornado进程/节点共享同一个聊天室
+
+所有后端都只负责把一段字节从一个节点送到其他节点，消息格式由上层（ChatHub）决定：
+    InProcessBus   单进程，没有其他节点，publish 什么也不做
+    UnixSocketBus  本机多进程（tornado.process.fork_processes），每个进程绑定一个
+                   Unix数据报套接字，发布时逐个发送给目录下的其他套接字；
+                   超过MAX_DATAGRAM的消息拆成多个分片，接收端重新拼接
+    RedisBus       多节点，使用Redis协议的 PUBLISH/SUBSCRIBE，只依赖这两个命令，
+                   任何兼容RESP的服务（包括本地替身 bench/fake_redis.py）都可以使用
+
+注意：publish 不会把消息投递给本节点，本节点的客户端由调用方直接投递。
+"""
+import os
+import socket
+import struct
+import time
+import uuid
+from urllib.parse import urlparse
+
+import tornado.gen
+import tornado.ioloop
+from tornado.tcpclient import TCPClient
+from services.metrics import metrics
+
+BUS_DROPPED = metrics.counter("chat_bus_dropped_total", "广播总线丢弃的消息数，按原因（busy接收方缓冲区已满/error发送失败/"
+                              "incomplete分片不完整/overflow积压过多）", ("reason",))
+BUS_FRAGMENTED = metrics.counter("chat_bus_fragmented_total", "因超过数据报大小而拆成分片发送的消息数")
+
+
+class BroadcastBus:
+    """广播总线基类"""
+    def __init__(self):
+        # 节点ID，用于区分消息来源
+        self.node_id = uuid.uuid4().hex[:12]
+        self.on_message = None
+
+    def start(self, on_message):
+        """开始接收其他节点的消息，on_message(payload: bytes)"""
+        self.on_message = on_message
+
+    def publish(self, payload):
+        """把payload发送给其他所有节点"""
+        raise NotImplementedError
+
+    def close(self):
+        """关闭总线"""
+        pass
+
+    def _dispatch(self, payload):
+        if self.on_message is None:
+            return
+        try:
+            self.on_message(payload)
+        except Exception as e:
+            print(f"处理广播总线消息失败: {e}")
+
+
+class InProcessBus(BroadcastBus):
+    """单进程总线，没有其他节点"""
+    def publish(self, payload):
+        pass
+
+
+class UnixSocketBus(BroadcastBus):
+    """
+    本机多进程总线，基于Unix数据报套接字
+
+    每个数据报以1字节的类型开头：完整消息，或者分片（消息ID、分片序号、分片总数 + 数据）。
+    同一对套接字之间的数据报不会乱序，接收端按消息ID拼接，超时未收齐的分片被丢弃
+    """
+
+    # 重新扫描其他节点的最小间隔（秒）
+    PEER_REFRESH_INTERVAL = 1.0
+    # 单个数据报最多携带的消息字节数，远小于默认的套接字发送缓冲区
+    MAX_DATAGRAM = 32 * 1024
+    # 未收齐的分片最多保留多久（秒）、最多同时拼接多少条消息
+    FRAGMENT_TTL = 5.0
+    MAX_PENDING_FRAGMENTS = 64
+
+    DATAGRAM_WHOLE = b"\x00"
+    DATAGRAM_FRAGMENT = b"\x01"
+    # 分片头：消息ID、分片序号、分片总数
+    FRAGMENT_HEADER = struct.Struct("<8sII")
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.node_id}.sock")
+        self.sock = None
+        self._peers = []
+        self._peers_checked = 0.0
+        # 正在拼接的消息: {消息ID: (过期时间, 分片总数, {分片序号: 数据})}
+        self._fragments = {}
+
+    def start(self, on_message):
+        super().start(on_message)
+        os.makedirs(self.directory, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        tornado.ioloop.IOLoop.current().add_handler(
+            self.sock.fileno(), self._handle_read, tornado.ioloop.IOLoop.READ)
+
+    def _handle_read(self, fd, events):
+        while True:
+            try:
+                payload = self.sock.recv(65536 * 4)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"读取广播总线失败: {e}")
+                return
+            if payload[:1] == self.DATAGRAM_FRAGMENT:
+                payload = self._reassemble(payload)
+                if payload is None:
+                    continue
+            else:
+                payload = payload[1:]
+            self._dispatch(payload)
+
+    def _reassemble(self, datagram):
+        """收到一个分片；消息的分片全部收齐时返回完整消息"""
+        message_id, index, count = self.FRAGMENT_HEADER.unpack_from(datagram, 1)
+        data = datagram[1 + self.FRAGMENT_HEADER.size:]
+        now = time.monotonic()
+
+        entry = self._fragments.get(message_id)
+        if entry is None:
+            for key, (expires, _, _) in list(self._fragments.items()):
+                if expires < now or len(self._fragments) >= self.MAX_PENDING_FRAGMENTS:
+                    del self._fragments[key]
+                    BUS_DROPPED.labels("incomplete").inc()
+            entry = self._fragments[message_id] = (now + self.FRAGMENT_TTL, count, {})
+        parts = entry[2]
+        parts[index] = data
+        if len(parts) < entry[1]:
+            return None
+        del self._fragments[message_id]
+        return b"".join(parts[i] for i in range(entry[1]))
+
+    def _datagrams(self, payload):
+        if len(payload) <= self.MAX_DATAGRAM:
+            return [self.DATAGRAM_WHOLE + payload]
+        BUS_FRAGMENTED.inc()
+        message_id = uuid.uuid4().bytes[:8]
+        count = (len(payload) + self.MAX_DATAGRAM - 1) // self.MAX_DATAGRAM
+        return [
+            self.DATAGRAM_FRAGMENT + self.FRAGMENT_HEADER.pack(message_id, index, count)
+            + payload[index * self.MAX_DATAGRAM:(index + 1) * self.MAX_DATAGRAM]
+            for index in range(count)
+        ]
+
+    def _refresh_peers(self):
+        now = time.monotonic()
+        if now - self._peers_checked < self.PEER_REFRESH_INTERVAL:
+            return
+        self._peers_checked = now
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        self._peers = [
+            os.path.join(self.directory, name) for name in names
+            if name.endswith(".sock") and os.path.join(self.directory, name) != self.path
+        ]
+
+    def publish(self, payload):
+        self._refresh_peers()
+        datagrams = self._datagrams(payload)
+        for peer in list(self._peers):
+            try:
+                for datagram in datagrams:
+                    self.sock.sendto(datagram, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 对应的进程已经退出，清理残留的套接字文件
+                self._peers.remove(peer)
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                # 对方的接收缓冲区已满；已发出的分片在对方超时后丢弃
+                BUS_DROPPED.labels("busy").inc()
+            except OSError as e:
+                BUS_DROPPED.labels("error").inc()
+                print(f"发送广播总线消息失败: {e}")
+
+    def close(self):
+        if self.sock is not None:
+            tornado.ioloop.IOLoop.current().remove_handler(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class RedisBus(BroadcastBus):
+    """多节点总线，使用Redis协议的 PUBLISH/SUBSCRIBE"""
+
+    # 断线重连的最大等待时间（秒）
+    MAX_RECONNECT_DELAY = 10
+
+    def __init__(self, url, channel):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.channel = channel.encode("utf-8")
+        self._publisher = None
+        self._subscriber = None
+        self._pending = []
+        self._closed = False
+
+    def start(self, on_message):
+        super().start(on_message)
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.spawn_callback(self._subscribe_loop)
+        io_loop.spawn_callback(self._publish_loop)
+
+    @staticmethod
+    def _command(*args):
+        """编码为RESP数组"""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    @classmethod
+    async def _read_reply(cls, stream):
+        """读取一条RESP回复"""
+        line = (await stream.read_until(b"\r\n"))[:-2]
+        prefix, rest = line[:1], line[1:]
+        if prefix == b"+":
+            return rest
+        if prefix == b"-":
+            raise Exception(f"Redis错误: {rest.decode('utf-8', 'replace')}")
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            return (await stream.read_bytes(length + 2))[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [await cls._read_reply(stream) for _ in range(length)]
+        raise Exception(f"无法解析的Redis回复: {line!r}")
+
+    async def _connect(self):
+        stream = await TCPClient().connect(self.host, self.port)
+        if self.password:
+            stream.write(self._command("AUTH", self.password))
+            await self._read_reply(stream)
+        return stream
+
+    async def _subscribe_loop(self):
+        delay = 0.5
+        while not self._closed:
+            try:
+                self._subscriber = await self._connect()
+                self._subscriber.write(self._command("SUBSCRIBE", self.channel))
+                delay = 0.5
+                while True:
+                    reply = await self._read_reply(self._subscriber)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        self._dispatch(reply[2])
+            except Exception as e:
+                if self._closed:
+                    return
+                print(f"Redis订阅连接断开: {e}，{delay}秒后重连")
+            await tornado.gen.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    async def _publish_loop(self):
+        delay = 0.5
+        while not self._closed:
+            try:
+                self._publisher = await self._connect()
+                delay = 0.5
+                # 连接建立前积压的消息一次性发出
+                self._flush_pending()
+                while True:
+                    await self._read_reply(self._publisher)
+            except Exception as e:
+                self._publisher = None
+                if self._closed:
+                    return
+                print(f"Redis发布连接断开: {e}，{delay}秒后重连")
+            await tornado.gen.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+    def _flush_pending(self):
+        pending, self._pending = self._pending, []
+        for payload in pending:
+            self.publish(payload)
+
+    def publish(self, payload):
+        stream = self._publisher
+        if stream is None or stream.closed():
+            # 积压有上限，避免Redis长时间不可用时内存无限增长
+            if len(self._pending) < 10000:
+                self._pending.append(payload)
+            else:
+                BUS_DROPPED.labels("overflow").inc()
+            return
+        stream.write(self._command("PUBLISH", self.channel, payload))
+
+    def close(self):
+        self._closed = True
+        for stream in (self._publisher, self._subscriber):
+            if stream is not None:
+                stream.close()
+
+
+def create_bus(backend, unix_dir=None, redis_url=None, channel="daip_chat"):
+    """根据配置创建广播总线"""
+    if backend == "unix":
+        return UnixSocketBus(unix_dir)
+    if backend == "redis":
+        return RedisBus(redis_url, channel)
+    return InProcessBus()
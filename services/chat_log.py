@@ -0,0 +1,169 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import tornado.ioloop
+from services.sqlite_pool import SQLitePool
+from services.metrics import metrics
+from config import CHAT_LOG_DB, CHAT_LOG_BATCH_SIZE, CHAT_LOG_FLUSH_INTERVAL, CHAT_LOG_MAX_PENDING, CHAT_DEFAULT_ROOM
+
+SQL_CREATE_MESSAGES = '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        seq INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        created_at REAL NOT NULL
+    )
+'''
+SQL_CREATE_SEQ_INDEX = 'CREATE INDEX IF NOT EXISTS idx_messages_seq ON messages (seq)'
+# 多房间之前创建的表没有room列，原有消息都属于默认房间
+SQL_TABLE_COLUMNS = 'PRAGMA table_info(messages)'
+SQL_ADD_ROOM_COLUMN = 'ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT {default}'
+SQL_CREATE_ROOM_INDEX = 'CREATE INDEX IF NOT EXISTS idx_messages_room_seq ON messages (room, seq)'
+SQL_INSERT_MESSAGE = 'INSERT INTO messages (seq, room, type, payload, created_at) VALUES (?, ?, ?, ?, ?)'
+SQL_MAX_SEQ = 'SELECT MAX(seq) FROM messages'
+SQL_MESSAGES_BEFORE = 'SELECT payload FROM messages WHERE room = ? AND seq < ? ORDER BY seq DESC LIMIT ?'
+
+
+class ChatLog:
+    """
+    聊天记录：只追加的SQLite表，按序号建索引
+
+    消息先进入内存缓冲，每隔flush_interval秒或攒够batch_size条时，
+    由专用写线程在一个事务中批量写入；上一批还在写时新消息继续攒在缓冲中，
+    下一批自然变大（组提交）。广播路径上只有一次列表追加。
+    数据库文件在第一次使用时才打开（导入模块不会创建文件）。
+    """
+
+    def __init__(self, db_path=CHAT_LOG_DB, batch_size=CHAT_LOG_BATCH_SIZE,
+                 flush_interval=CHAT_LOG_FLUSH_INTERVAL, max_pending=CHAT_LOG_MAX_PENDING):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pool = None
+        # 待写入的行: [(seq, room, type, payload, created_at)]
+        self.pending = []
+        self.written = 0
+        self.dropped = 0
+        self._writing = False
+        self._flush_timer = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """创建表并准备连接池；重复调用时什么也不做"""
+        if self.pool is not None:
+            return
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._init_db()
+        self.pool = SQLitePool(self.db_path, max_size=2)
+        atexit.register(self.flush_sync)
+
+    def _init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(SQL_CREATE_MESSAGES)
+            conn.execute(SQL_CREATE_SEQ_INDEX)
+            columns = [row[1] for row in conn.execute(SQL_TABLE_COLUMNS)]
+            if "room" not in columns:
+                conn.execute(SQL_ADD_ROOM_COLUMN.format(default=self._quote(CHAT_DEFAULT_ROOM)))
+            conn.execute(SQL_CREATE_ROOM_INDEX)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _quote(text):
+        # ALTER TABLE的默认值不能使用参数绑定
+        return "'" + text.replace("'", "''") + "'"
+
+    def max_seq(self):
+        """已保存的最大序号，启动时用来初始化序号"""
+        # 启动时（fork之前）调用，使用临时连接
+        self.open()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(SQL_MAX_SEQ).fetchone()[0] or 0
+        finally:
+            conn.close()
+
+    # =================== 写入 ===================
+    def append(self, seq, room, msg_type, payload):
+        """记录一条已序列化的消息（在IOLoop线程中调用）"""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"聊天记录写入过慢，已丢弃 {self.dropped} 条消息")
+            return
+        self.open()
+        self.pending.append((seq, room, msg_type, payload, time.time()))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = tornado.ioloop.IOLoop.current().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """把缓冲的消息交给写线程"""
+        if self._flush_timer is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._flush_timer)
+            self._flush_timer = None
+        if not self.pending or self._writing:
+            return
+
+        batch, self.pending = self.pending, []
+        self._writing = True
+        future = tornado.ioloop.IOLoop.current().run_in_executor(self._get_writer(), self._write_batch, batch)
+        future.add_done_callback(self._on_written)
+
+    def _on_written(self, future):
+        self._writing = False
+        if self.pending:
+            self.flush()
+
+    def _get_writer(self):
+        # 写线程在第一次写入时才创建，多进程模式下在fork之后
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-log")
+        return self._writer
+
+    def _write_batch(self, batch):
+        with self._lock:
+            try:
+                with self.pool.connection() as conn:
+                    conn.executemany(SQL_INSERT_MESSAGE, batch)
+                self.written += len(batch)
+            except Exception as e:
+                print(f"写入聊天记录失败（{len(batch)}条）: {e}")
+
+    def flush_sync(self):
+        """进程退出时同步写入剩余的消息"""
+        batch, self.pending = self.pending, []
+        if batch:
+            self._write_batch(batch)
+
+    # =================== 查询 ===================
+    def messages_before(self, room, before, limit):
+        """
+        房间中序号小于before的最近limit条消息（在数据库线程中调用）
+
+        Returns:
+            list[bytes]: 按序号从旧到新排列的已序列化消息
+        """
+        self.open()
+        with self.pool.connection() as conn:
+            rows = conn.execute(SQL_MESSAGES_BEFORE, (room, before, limit)).fetchall()
+        rows.reverse()
+        return [bytes(row[0]) for row in rows]
+
+
+# 创建聊天记录实例（每个进程一个）
+chat_log = ChatLog()
+
+metrics.counter_func("chat_log_written_total", "写入聊天记录的消息数", lambda: chat_log.written)
+metrics.counter_func("chat_log_dropped_total", "因写入过慢丢弃的聊天记录数", lambda: chat_log.dropped)
+metrics.gauge("chat_log_pending", "等待写入聊天记录的消息数", func=lambda: len(chat_log.pending))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+城市数据二进制格式 - 紧凑的列式存储，运行时通过mmap只读加载
+
+文件布局（小端序）：
+    头部      magic(8s) 记录数(I) 附加字符串数(I) 单字键数(I) 二元组键数(I)
+              倒排项总数(I) 字符串区字节数(I) 源文件SHA-256(32s)
+    adcode    uint32[记录数]
+    citycode  int32[记录数]    >=0 为数值，<0 表示 -(k+1)，指向第k个附加字符串
+    位数      uint8[记录数]    citycode的数字位数，用于还原前导零
+    排序表    uint32[记录数] * 3  按中文名、adcode、citycode排序的记录位置
+    倒排起点  uint32[单字键数 + 二元组键数 + 1]
+    倒排项    uint32[倒排项总数]  每个键对应的记录位置（升序）
+    偏移表    uint32[字符串数 + 1]
+    字符串区  UTF-8：中文名、附加字符串（如非数字的citycode "\\N"）、
+              单字键、二元组键（键按UTF-8字节序排列，与Python字符串顺序一致）
+
+倒排索引和排序表在编译时生成，读取时不需要pandas，也不需要在每个进程中
+重新构建索引，多个工作进程共享同一份页缓存。源文件的SHA-256用于判断
+二进制文件是否与Excel文件一致（检出代码后文件的mtime不可靠）。
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'CITYIDX2'
+HEADER = struct.Struct('<8sIIIIII32s')
+# 没有源文件时写入的摘要
+NO_SOURCE = b'\0' * 32
+
+
+def file_digest(path):
+    """计算文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def build_postings(names):
+    """
+    构建字符级倒排索引：单字 -> 位置列表，二元组 -> 位置列表（均按位置递增）
+
+    Args:
+        names (sequence): 小写的中文名，空名称为''
+    """
+    char_postings = {}
+    bigram_postings = {}
+    for position, name in enumerate(names):
+        for char in set(name):
+            char_postings.setdefault(char, []).append(position)
+        for bigram in {name[i:i + 2] for i in range(len(name) - 1)}:
+            bigram_postings.setdefault(bigram, []).append(position)
+    return char_postings, bigram_postings
+
+
+def sort_positions(keys):
+    """按键排序的记录位置，键相同时保持原始顺序；键为None的记录不参与排序"""
+    return [position for _, position in sorted(
+        (key, position) for position, key in enumerate(keys) if key is not None)]
+
+
+def write_city_binary(records, output_path, source_digest=NO_SOURCE):
+    """
+    将城市记录编译为二进制文件（先写临时文件再原子替换）
+
+    Args:
+        records (list): 形如 {'中文名', 'adcode', 'citycode'} 的字典列表
+        output_path (str): 输出文件路径
+        source_digest (bytes): 源Excel文件的SHA-256摘要（见file_digest）
+    """
+    adcodes = array('I')
+    citycodes = array('i')
+    widths = array('B')
+    extras = []
+    extra_index = {}
+    names = []
+    adcode_texts = []
+    citycode_texts = []
+
+    for record in records:
+        name = record.get('中文名')
+        names.append(name if isinstance(name, str) else '')
+
+        adcode = str(record.get('adcode'))
+        if not adcode.isdigit() or len(adcode) != 6:
+            raise ValueError(f"无效的adcode: {adcode}")
+        adcodes.append(int(adcode))
+        adcode_texts.append(adcode)
+
+        citycode = record.get('citycode')
+        citycode = '' if citycode is None else str(citycode)
+        citycode_texts.append(citycode)
+        if citycode.isdigit():
+            citycodes.append(int(citycode))
+            widths.append(len(citycode))
+        else:
+            if citycode not in extra_index:
+                extra_index[citycode] = len(extras)
+                extras.append(citycode)
+            citycodes.append(-(extra_index[citycode] + 1))
+            widths.append(0)
+
+    char_postings, bigram_postings = build_postings([name.lower() for name in names])
+    char_keys = sorted(char_postings, key=lambda key: key.encode('utf-8'))
+    bigram_keys = sorted(bigram_postings, key=lambda key: key.encode('utf-8'))
+    posting_starts = array('I', [0])
+    postings = array('I')
+    for key, table in [(key, char_postings) for key in char_keys] + \
+                      [(key, bigram_postings) for key in bigram_keys]:
+        postings.extend(table[key])
+        posting_starts.append(len(postings))
+
+    orders = array('I')
+    orders.extend(sort_positions([name or None for name in names]))
+    # 没有中文名的记录不参与前缀查找，用记录数填充到固定长度
+    orders.extend([len(names)] * (len(names) - len(orders)))
+    orders.extend(sort_positions(adcode_texts))
+    orders.extend(sort_positions(citycode_texts))
+
+    blob = bytearray()
+    offsets = array('I', [0])
+    for text in names + extras + char_keys + bigram_keys:
+        blob += text.encode('utf-8')
+        offsets.append(len(blob))
+
+    columns = [adcodes, citycodes, widths, orders, posting_starts, postings, offsets]
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(names), len(extras), len(char_keys), len(bigram_keys),
+                            len(postings), len(blob), source_digest))
+        for column in columns:
+            f.write(column.tobytes())
+        f.write(blob)
+    os.replace(temp_path, output_path)
+
+
+class _Column:
+    """基于内存映射的只读整数列"""
+
+    __slots__ = ('_view', '_format')
+
+    def __init__(self, buffer, offset, count, fmt, size):
+        self._format = fmt
+        view = memoryview(buffer)[offset:offset + count * size]
+        if sys.byteorder == 'little':
+            self._view = view.cast(fmt)
+        else:
+            # 大端平台上复制一份并转换字节序
+            data = array(fmt, view.tobytes())
+            data.byteswap()
+            self._view = data
+
+    def __len__(self):
+        return len(self._view)
+
+    def __getitem__(self, position):
+        return self._view[position]
+
+    def release(self):
+        if isinstance(self._view, memoryview):
+            self._view.release()
+
+
+class _Postings:
+    """按键二分查找内存映射中的倒排列表，接口与dict.get相同"""
+
+    __slots__ = ('_reader', '_first', '_count')
+
+    def __init__(self, reader, first, count):
+        self._reader = reader
+        # 键在字符串表和倒排起点表中的起始下标
+        self._first = first
+        self._count = count
+
+    def get(self, key, default=None):
+        reader = self._reader
+        target = key.encode('utf-8')
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if reader._bytes(reader._key_base + self._first + middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self._count or reader._bytes(reader._key_base + self._first + low) != target:
+            return default
+        index = self._first + low
+        return reader._postings[reader._posting_starts[index]:reader._posting_starts[index + 1]]
+
+
+class CityBinaryReader:
+    """
+    城市二进制文件读取器，按列访问内存映射中的数据
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < HEADER.size or self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"不是有效的城市数据文件：{file_path}")
+        (_, count, extra_count, char_count, bigram_count,
+         posting_count, blob_size, self.source_digest) = HEADER.unpack_from(self._mmap, 0)
+
+        self.count = count
+        key_count = char_count + bigram_count
+        string_count = count + extra_count + key_count
+        self._key_base = count + extra_count
+
+        columns = []
+        offset = HEADER.size
+        for length, fmt, size in ((count, 'I', 4), (count, 'i', 4), (count, 'B', 1), (count * 3, 'I', 4),
+                                  (key_count + 1, 'I', 4), (posting_count, 'I', 4), (string_count + 1, 'I', 4)):
+            if offset + length * size > len(self._mmap):
+                break
+            columns.append(_Column(self._mmap, offset, length, fmt, size))
+            offset += length * size
+        self._columns = columns
+        self._blob_start = offset
+
+        if len(columns) < 7 or offset + blob_size > len(self._mmap):
+            self.close()
+            raise ValueError(f"城市数据文件已损坏：{file_path}")
+
+        (self._adcodes, self._citycodes, self._widths, self._orders,
+         self._posting_starts, self._postings, self._offsets) = columns
+        self.char_postings = _Postings(self, 0, char_count)
+        self.bigram_postings = _Postings(self, char_count, bigram_count)
+
+    def _bytes(self, index):
+        start = self._blob_start + self._offsets[index]
+        end = self._blob_start + self._offsets[index + 1]
+        return self._mmap[start:end]
+
+    def _string(self, index):
+        return self._bytes(index).decode('utf-8')
+
+    def name(self, position):
+        """获取中文名，空名称返回None"""
+        return self._string(position) or None
+
+    def lower_name(self, position):
+        """获取小写的中文名，用于匹配倒排索引，空名称返回''"""
+        return self._string(position).lower()
+
+    def adcode(self, position):
+        return '%06d' % self._adcodes[position]
+
+    def citycode(self, position):
+        value = self._citycodes[position]
+        if value < 0:
+            return self._string(self.count + (-value - 1))
+        return str(value).zfill(self._widths[position])
+
+    def name_order(self):
+        """按中文名排序的记录位置（不含没有中文名的记录）"""
+        order = self._orders[:self.count]
+        end = len(order)
+        while end and order[end - 1] == self.count:
+            end -= 1
+        return order[:end]
+
+    def adcode_order(self):
+        """按adcode排序的记录位置"""
+        return self._orders[self.count:self.count * 2]
+
+    def citycode_order(self):
+        """按citycode排序的记录位置"""
+        return self._orders[self.count * 2:]
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """释放内存映射"""
+        for column in self._columns:
+            column.release()
+        self._mmap.close()
+
+
+class BinaryColumn:
+    """把二进制文件中的一列包装成按需解码的只读序列"""
+
+    __slots__ = ('_reader', '_getter')
+
+    def __init__(self, reader, getter):
+        self._reader = reader
+        self._getter = getter
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __getitem__(self, position):
+        return self._getter(position)
+
+    def __iter__(self):
+        for position in range(len(self._reader)):
+            yield self._getter(position)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+城市索引模块 - 进程内共享的城市数据索引
+
+运行时优先通过mmap读取编译好的二进制城市文件（见 services/city_binary.py），
+不需要导入pandas；只有二进制文件缺失、损坏或与Excel文件内容不一致时，才解析
+AMap_adcode_citycode.xlsx 并顺便重新编译二进制文件。索引在首次使用时加载，
+之后所有查询都命中不可变的索引，仅当数据文件的mtime变化时才重新检查。
+"""
+
+import os
+import time
+from services.city_binary import BinaryColumn, CityBinaryReader, build_postings, file_digest, sort_positions
+
+# 默认的城市数据文件路径
+DEFAULT_CITY_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data', 'excel', 'AMap_adcode_citycode.xlsx'
+)
+
+# 编译后的二进制城市数据文件路径
+DEFAULT_CITY_BINARY = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data', 'bin', 'AMap_adcode_citycode.bin'
+)
+
+# 两次检查文件mtime之间的最小间隔（秒）
+MTIME_CHECK_INTERVAL = 1.0
+
+
+class CityIndex:
+    """
+    不可变的城市索引，构建完成后只读，可在所有请求之间安全共享
+
+    从二进制文件加载时，各列、倒排索引和排序表都是内存映射上的视图，
+    查询时按需解码，不在每个进程中复制一份
+    """
+
+    __slots__ = (
+        'display_names', 'adcodes', 'citycodes', 'names', 'char_postings', 'bigram_postings',
+        'name_order', 'adcode_order', 'citycode_order'
+    )
+
+    def __init__(self, display_names, adcodes, citycodes, names, char_postings, bigram_postings,
+                 name_order, adcode_order, citycode_order):
+        """
+        Args:
+            display_names (sequence): 中文名列
+            adcodes (sequence): adcode列
+            citycodes (sequence): citycode列
+            names (sequence): 小写的中文名，空名称为''
+            char_postings, bigram_postings: 单字/二元组 -> 位置列表（升序），支持get(key, default)
+            name_order, adcode_order, citycode_order (sequence): 按中文名、adcode、citycode排序的记录位置，
+                键相同时按位置递增
+        """
+        self.display_names = display_names
+        self.adcodes = adcodes
+        self.citycodes = citycodes
+        self.names = names
+        self.char_postings = char_postings
+        self.bigram_postings = bigram_postings
+        self.name_order = name_order
+        self.adcode_order = adcode_order
+        self.citycode_order = citycode_order
+
+    @classmethod
+    def from_records(cls, records):
+        """根据 {'中文名', 'adcode', 'citycode'} 字典列表在内存中构建索引"""
+        records = list(records)
+        display_names = tuple(record.get('中文名') for record in records)
+        adcodes = tuple(record.get('adcode') for record in records)
+        citycodes = tuple(record.get('citycode') for record in records)
+        # 预先转换为小写，避免每次查询时重复处理
+        names = tuple(name.lower() if isinstance(name, str) else '' for name in display_names)
+        char_postings, bigram_postings = build_postings(names)
+        return cls(
+            display_names, adcodes, citycodes, names,
+            {key: tuple(items) for key, items in char_postings.items()},
+            {key: tuple(items) for key, items in bigram_postings.items()},
+            tuple(sort_positions([name if isinstance(name, str) else None for name in display_names])),
+            tuple(sort_positions([str(adcode) for adcode in adcodes])),
+            tuple(sort_positions([str(citycode) for citycode in citycodes])),
+        )
+
+    @classmethod
+    def from_binary(cls, reader):
+        """根据内存映射的二进制城市文件构建索引，所有数据按需从mmap中解码"""
+        return cls(
+            BinaryColumn(reader, reader.name),
+            BinaryColumn(reader, reader.adcode),
+            BinaryColumn(reader, reader.citycode),
+            BinaryColumn(reader, reader.lower_name),
+            reader.char_postings,
+            reader.bigram_postings,
+            reader.name_order(),
+            reader.adcode_order(),
+            reader.citycode_order(),
+        )
+
+    @staticmethod
+    def _lower_bound(order, column, value):
+        """在按column排序的位置表order中二分查找第一个键不小于value的下标"""
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if str(column[order[middle]]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _equal_positions(self, order, column, value):
+        """键等于value的记录位置（升序）"""
+        positions = []
+        for index in range(self._lower_bound(order, column, value), len(order)):
+            position = order[index]
+            if str(column[position]) != value:
+                break
+            positions.append(position)
+        return positions
+
+    def _record(self, position):
+        """按位置组装一条新的记录字典，调用方修改它不会影响共享索引"""
+        return {
+            '中文名': self.display_names[position],
+            'adcode': self.adcodes[position],
+            'citycode': self.citycodes[position],
+        }
+
+    def _copy(self, positions):
+        return [self._record(position) for position in positions]
+
+    def _substring_candidates(self, keyword):
+        """通过倒排索引求交集，得到包含关键字的记录位置（升序）"""
+        if len(keyword) == 1:
+            return self.char_postings.get(keyword, ())
+
+        postings = []
+        for bigram in {keyword[i:i + 2] for i in range(len(keyword) - 1)}:
+            items = self.bigram_postings.get(bigram)
+            if not items:
+                return ()
+            postings.append(items)
+
+        # 从最短的倒排列表开始求交集，候选集合尽快收缩
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for items in postings[1:]:
+            candidates.intersection_update(items)
+            if not candidates:
+                return ()
+
+        if len(postings) == 1:
+            return sorted(candidates)
+        # 二元组全部出现并不代表关键字连续出现，需要再校验一次
+        names = self.names
+        return sorted(position for position in candidates if keyword in names[position])
+
+    def find_by_city_name(self, city_name, limit=None):
+        """
+        根据城市名称模糊查找记录（忽略大小写）
+
+        结果按 完全匹配 > 前缀匹配 > 包含匹配 排序，同一档内保持原始顺序
+
+        Args:
+            city_name (str): 城市名称
+            limit (int): 最多返回的记录数，None表示不限制
+        """
+        keyword = str(city_name).lower()
+        if not keyword:
+            return []
+
+        exact, prefix, contains = [], [], []
+        names = self.names
+        for position in self._substring_candidates(keyword):
+            name = names[position]
+            if name == keyword:
+                exact.append(position)
+            elif name.startswith(keyword):
+                prefix.append(position)
+            else:
+                contains.append(position)
+
+        ranked = exact + prefix + contains
+        if limit is not None:
+            ranked = ranked[:limit]
+        return self._copy(ranked)
+
+    def _prefix_positions(self, prefix):
+        """在按中文名排序的位置表上二分查找前缀区间"""
+        order = self.name_order
+        display_names = self.display_names
+        positions = []
+        for index in range(self._lower_bound(order, display_names, prefix), len(order)):
+            position = order[index]
+            if not display_names[position].startswith(prefix):
+                break
+            positions.append(position)
+        return positions
+
+    def find_by_adcode(self, adcode):
+        """根据adcode精确查找记录"""
+        # adcode重复时只取第一条，与原先 iloc[0] 的语义一致
+        positions = self._equal_positions(self.adcode_order, self.adcodes, str(adcode))
+        if not positions:
+            return None
+        return self._record(positions[0])
+
+    def find_by_citycode(self, citycode):
+        """根据citycode精确查找记录"""
+        return self._copy(self._equal_positions(self.citycode_order, self.citycodes, str(citycode)))
+
+    def get_cities_by_province(self, province, limit=None):
+        """查找中文名以指定省份开头的城市（按原始顺序返回）"""
+        positions = sorted(self._prefix_positions(str(province)))
+        if limit is not None:
+            positions = positions[:limit]
+        return self._copy(positions)
+
+    def count_records(self):
+        """获取记录总数"""
+        return len(self.display_names)
+
+
+class CityService:
+    """
+    城市数据服务，负责懒加载与热更新共享的CityIndex
+
+    二进制文件头部记录了编译时Excel文件的SHA-256，只有两者内容不一致时才重新编译；
+    检出代码后文件的mtime不可靠，mtime只用来决定何时重新检查
+    """
+
+    def __init__(self, file_path=None, binary_path=None):
+        self.file_path = file_path or DEFAULT_CITY_FILE
+        self.binary_path = binary_path or DEFAULT_CITY_BINARY
+        self._index = None
+        # 上次检查时两个文件的mtime：(二进制文件, Excel文件)
+        self._mtimes = None
+        # Excel文件的摘要缓存：(mtime, SHA-256)
+        self._excel_digest = None
+        self._last_check = 0.0
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _digest(self, excel_mtime):
+        """Excel文件的SHA-256，mtime不变时使用缓存；文件不存在时返回None"""
+        if excel_mtime is None:
+            return None
+        if self._excel_digest is None or self._excel_digest[0] != excel_mtime:
+            try:
+                self._excel_digest = (excel_mtime, file_digest(self.file_path))
+            except OSError:
+                return None
+        return self._excel_digest[1]
+
+    def _load_binary(self, excel_digest):
+        """通过mmap加载二进制城市文件；与Excel文件内容不一致时返回False"""
+        try:
+            reader = CityBinaryReader(self.binary_path)
+        except (OSError, ValueError) as e:
+            print(f"加载城市二进制文件失败：{str(e)}")
+            return False
+
+        if excel_digest is not None and reader.source_digest != excel_digest:
+            reader.close()
+            print(f"城市二进制文件与Excel文件不一致，重新编译：{self.binary_path}")
+            return False
+
+        self._index = CityIndex.from_binary(reader)
+        print(f"成功加载城市二进制文件：{self.binary_path}")
+        return True
+
+    def _load_excel(self, excel_mtime):
+        """解析Excel文件构建索引，并重新编译二进制文件供下次启动使用"""
+        # 延迟导入，只有真正需要解析Excel时才加载pandas
+        from services.excel_handler import ExcelHandler
+
+        excel_handler = ExcelHandler(self.file_path)
+        records = excel_handler.get_data_as_dict()
+        if records is None:
+            return False
+
+        self._index = CityIndex.from_records(records)
+        if excel_handler.export_to_binary(self.binary_path):
+            # 二进制文件已是最新，避免下次检查时重复加载
+            self._mtimes = (self._mtime(self.binary_path), excel_mtime)
+        return True
+
+    def get_index(self):
+        """
+        获取当前的城市索引，必要时（首次使用或文件已修改）重新加载
+
+        Returns:
+            CityIndex or None: 城市索引，加载失败则返回None
+        """
+        now = time.monotonic()
+        if self._index is not None and now - self._last_check < MTIME_CHECK_INTERVAL:
+            return self._index
+        self._last_check = now
+
+        mtimes = (self._mtime(self.binary_path), self._mtime(self.file_path))
+        if self._index is not None and mtimes == self._mtimes:
+            return self._index
+        self._mtimes = mtimes
+        binary_mtime, excel_mtime = mtimes
+        excel_digest = self._digest(excel_mtime)
+
+        # 二进制文件与Excel文件内容一致（或没有Excel文件）时优先使用
+        if binary_mtime is not None and self._load_binary(excel_digest):
+            return self._index
+
+        if excel_digest is not None:
+            self._load_excel(excel_mtime)
+        elif self._index is None:
+            # 文件被删除时继续使用已有索引
+            print(f"错误：文件不存在 - {self.file_path}")
+        return self._index
+
+    def preload(self):
+        """预加载城市索引（可在启动时调用）"""
+        return self.get_index() is not None
+
+    def find_by_city_name(self, city_name, limit=None):
+        index = self.get_index()
+        return index.find_by_city_name(city_name, limit) if index else None
+
+    def find_by_adcode(self, adcode):
+        index = self.get_index()
+        return index.find_by_adcode(adcode) if index else None
+
+    def find_by_citycode(self, citycode):
+        index = self.get_index()
+        return index.find_by_citycode(citycode) if index else None
+
+    def get_cities_by_province(self, province, limit=None):
+        index = self.get_index()
+        return index.get_cities_by_province(province, limit) if index else None
+
+
+# 创建城市服务实例（进程内共享）
+city_service = CityService()
@@ -0,0 +1,48 @@
+class CommandDispatcher:
+    """
+    聊天命令分发器：按消息的第一个词（如 @电影、@新闻、@川小农）查表找到处理函数
+
+    每条消息只做一次切分和一次字典查找，与注册的命令数量无关；
+    新的机器人只需要注册触发词，不需要修改WebSocket处理器。
+
+    处理函数的签名为 handler(nickname, room, argument, data, broadcast)：
+        nickname: 发送者昵称
+        room: 发送者当前所在的房间
+        argument: 触发词之后的内容，没有空格分隔时为None
+        data: 客户端发来的原始消息
+        broadcast: 向发送者当前房间广播的函数
+    返回False表示消息格式不符合该命令，按普通消息处理。
+    """
+
+    def __init__(self):
+        # {触发词: 处理函数}
+        self.commands = {}
+
+    def register(self, trigger, handler):
+        """注册命令，触发词不能包含空格"""
+        if not trigger or " " in trigger:
+            raise ValueError(f"无效的触发词: {trigger!r}")
+        if trigger in self.commands:
+            raise ValueError(f"触发词已被注册: {trigger}")
+        self.commands[trigger] = handler
+
+    def lookup(self, content):
+        """
+        查找消息对应的命令
+
+        Returns:
+            (handler, argument)，不是命令时返回 (None, None)
+        """
+        if not content:
+            return None, None
+        # 去掉首尾空白后再切分，"@新闻\n" 这样的消息也能找到命令；
+        # 处理函数可以再按原始内容判断格式（例如不接受开头有空白的 @电影）
+        trigger, separator, argument = content.strip().partition(" ")
+        handler = self.commands.get(trigger)
+        if handler is None:
+            return None, None
+        return handler, argument if separator else None
+
+
+# 创建命令分发器实例（每个进程一个）
+command_dispatcher = CommandDispatcher()
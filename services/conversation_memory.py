@@ -0,0 +1,136 @@
+import hashlib
+import time
+from collections import OrderedDict, deque
+from config import (AI_MEMORY_SCOPE, AI_MEMORY_MAX_CONVERSATIONS, AI_MEMORY_IDLE_TTL, AI_MEMORY_TOKEN_BUDGET,
+                    AI_MEMORY_MAX_TURNS, AI_MEMORY_TURN_MAX_CHARS, AI_MEMORY_SUMMARY_CHARS)
+from services.metrics import metrics
+
+# 摘要中每一轮保留的字数
+SUMMARY_TURN_CHARS = 60
+ROLE_NAMES = {"user": "用户", "assistant": "川小农"}
+
+
+def estimate_tokens(text):
+    """粗略估计token数：中日韩字符约1个token一个字，其他字符约4个字符一个token"""
+    wide = sum(1 for ch in text if ch >= "⺀")
+    return wide + (len(text) - wide + 3) // 4
+
+
+class Conversation:
+    """
+    一段对话：最近的若干轮放在窗口中，超出token预算或轮数的旧轮次压缩进摘要
+
+    每一轮在加入时就组装好发给上游的消息并估算token数，请求时只需要复制列表
+    """
+    __slots__ = ('turns', 'tokens', 'summary', 'digest', 'last_used')
+
+    def __init__(self):
+        # 元素为 (消息字典, token数)
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = ""
+        # 全部对话内容的哈希，用作AI回复缓存键的一部分
+        self.digest = ""
+        self.last_used = time.monotonic()
+
+    def add(self, role, content, token_budget, max_turns, turn_max_chars, summary_chars):
+        if len(content) > turn_max_chars:
+            content = content[:turn_max_chars] + "…"
+        tokens = estimate_tokens(content)
+        self.turns.append(({"role": role, "content": content}, tokens))
+        self.tokens += tokens
+        self.digest = hashlib.sha256(f"{self.digest}\0{role}\0{content}".encode("utf-8")).hexdigest()
+
+        # 至少保留最新的一轮
+        while len(self.turns) > 1 and (self.tokens > token_budget or len(self.turns) > max_turns):
+            message, tokens = self.turns.popleft()
+            self.tokens -= tokens
+            self._summarize(message, summary_chars)
+
+    def _summarize(self, message, summary_chars):
+        # 摘要只保留每一轮的开头，超出长度时丢掉最早的部分
+        text = message["content"].replace("\n", " ")
+        if len(text) > SUMMARY_TURN_CHARS:
+            text = text[:SUMMARY_TURN_CHARS] + "…"
+        summary = f"{self.summary}\n{ROLE_NAMES.get(message['role'], message['role'])}：{text}"
+        if len(summary) > summary_chars:
+            # 从完整的一行开始截取
+            summary = summary[-summary_chars:]
+            summary = summary[summary.find("\n"):] if "\n" in summary else summary
+        self.summary = summary
+
+    def messages(self):
+        """发给上游的历史消息（不含系统提示词和本次的问题）"""
+        history = [message for message, _ in self.turns]
+        if self.summary:
+            history.insert(0, {"role": "system", "content": f"更早的对话摘要（部分内容已省略）：{self.summary}"})
+        return history
+
+
+class ConversationMemory:
+    """
+    川小农的对话记忆：按用户或按房间保存最近的对话，供多轮对话（选择主题编号、选择风格）使用
+
+    对话按最近使用排序，超过数量上限或长时间未使用的对话被淘汰；
+    每段对话的内容受token预算和轮数限制，占用的内存有上限
+    """
+
+    def __init__(self, scope=AI_MEMORY_SCOPE, max_conversations=AI_MEMORY_MAX_CONVERSATIONS,
+                 idle_ttl=AI_MEMORY_IDLE_TTL, token_budget=AI_MEMORY_TOKEN_BUDGET, max_turns=AI_MEMORY_MAX_TURNS,
+                 turn_max_chars=AI_MEMORY_TURN_MAX_CHARS, summary_chars=AI_MEMORY_SUMMARY_CHARS):
+        self.scope = scope
+        self.max_conversations = max_conversations
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.turn_max_chars = turn_max_chars
+        self.summary_chars = summary_chars
+        # {对话键: Conversation}，按最近使用排序
+        self.conversations = OrderedDict()
+
+    def key(self, user, room):
+        """对话键：scope为room时同一房间的人共享一段对话"""
+        return ("room", room) if self.scope == "room" else ("user", user)
+
+    def _expire(self, now):
+        while self.conversations:
+            key, conversation = next(iter(self.conversations.items()))
+            if now - conversation.last_used <= self.idle_ttl and len(self.conversations) <= self.max_conversations:
+                break
+            del self.conversations[key]
+
+    def get(self, key):
+        """
+        Returns:
+            (list[dict], str): 历史消息和对话内容的哈希；没有对话时为 ([], "")
+        """
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            return [], ""
+        if time.monotonic() - conversation.last_used > self.idle_ttl:
+            del self.conversations[key]
+            return [], ""
+        return conversation.messages(), conversation.digest
+
+    def add_exchange(self, key, question, answer):
+        """记录一轮完整的问答"""
+        now = time.monotonic()
+        conversation = self.conversations.get(key)
+        if conversation is None:
+            conversation = self.conversations[key] = Conversation()
+        else:
+            self.conversations.move_to_end(key)
+        conversation.last_used = now
+        for role, content in (("user", question), ("assistant", answer)):
+            conversation.add(role, content, self.token_budget, self.max_turns,
+                             self.turn_max_chars, self.summary_chars)
+        self._expire(now)
+
+    def clear(self, key):
+        return self.conversations.pop(key, None) is not None
+
+
+# 创建对话记忆实例（每个进程一个）
+conversation_memory = ConversationMemory()
+
+metrics.gauge("ai_memory_conversations", "保存在对话记忆中的对话数", func=lambda: len(conversation_memory.conversations))
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_WORKERS, DB_MAX_PENDING, DB_QUERY_TIMEOUT, DB_SLOW_WAIT
+from services.metrics import metrics
+
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "数据库请求的耗时（含排队）", ("query",))
+DB_WAIT_SECONDS = metrics.histogram("db_queue_wait_seconds", "数据库请求在线程池中排队的时间")
+
+
+class DBBusyError(Exception):
+    """数据库请求排队已满或等待超时"""
+    pass
+
+
+class DBExecutorStats:
+    """数据库线程的排队统计"""
+    def __init__(self):
+        self.submitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self):
+        completed = self.submitted - self.rejected
+        return {
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_wait": self.total_wait / completed if completed > 0 else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class DBExecutor:
+    """
+    数据库专用线程：所有SQLite调用都在这里执行，IOLoop只等待结果
+
+    排队的请求数有上限，超过时直接拒绝而不是无限堆积；
+    每个请求可以设置超时，超时后还未开始执行的请求会被撤销
+    """
+
+    def __init__(self, workers=DB_WORKERS, max_pending=DB_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.stats = DBExecutorStats()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # 线程在第一次使用时才创建，多进程模式下在fork之后
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+        return self._executor
+
+    def _record_wait(self, name, wait):
+        with self._lock:
+            self.stats.total_wait += wait
+            if wait > self.stats.max_wait:
+                self.stats.max_wait = wait
+            DB_WAIT_SECONDS.observe(wait)
+        if wait >= DB_SLOW_WAIT:
+            print(f"数据库请求排队过久: {name} 等待 {wait * 1000:.1f}ms")
+
+    async def run(self, func, *args, timeout=DB_QUERY_TIMEOUT):
+        """
+        在数据库线程中执行func(*args)
+
+        Raises:
+            DBBusyError: 排队已满，或在timeout秒内没有完成
+        """
+        self.stats.submitted += 1
+        if self.pending >= self.max_pending:
+            self.stats.rejected += 1
+            raise DBBusyError("数据库繁忙")
+
+        name = getattr(func, "__name__", "query")
+        submitted_at = time.perf_counter()
+
+        def job():
+            self._record_wait(name, time.perf_counter() - submitted_at)
+            return func(*args)
+
+        with self._lock:
+            self.pending += 1
+        future = self._get_executor().submit(job)
+        # 请求真正结束（完成、出错或被撤销）时才减少计数：超时后仍在执行的请求继续占用线程，
+        # 也继续计入排队上限
+        future.add_done_callback(self._job_done)
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            DB_QUERY_SECONDS.labels(name).observe(time.perf_counter() - submitted_at)
+            return result
+        except asyncio.TimeoutError:
+            # 还没开始执行的请求直接撤销；已在执行的请求无法中断，结果被丢弃
+            future.cancel()
+            self.stats.timeouts += 1
+            raise DBBusyError(f"数据库请求超时: {name}")
+
+    def _job_done(self, future):
+        # 在数据库线程中调用（请求被撤销时在IOLoop线程中调用）
+        with self._lock:
+            self.pending -= 1
+
+
+# 创建数据库线程实例（每个进程一个）
+db_executor = DBExecutor()
+
+metrics.counter_func("db_rejected_total", "排队已满被拒绝的数据库请求数", lambda: db_executor.stats.rejected)
+metrics.counter_func("db_timeouts_total", "超时的数据库请求数", lambda: db_executor.stats.timeouts)
+metrics.gauge("db_pending", "正在排队或执行的数据库请求数", func=lambda: db_executor.pending)
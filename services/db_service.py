@@ -1,31 +1,56 @@
 import sqlite3
 import os
 from typing import Optional, Tuple
+from config import USERS_DB
+from services.sqlite_pool import SQLitePool
+from services.db_executor import db_executor
+from services.username_index import UsernameIndex
+from services.password_hasher import password_hasher
+
+# SQL语句固定为常量，连接按SQL文本缓存预编译语句，每条语句在每个连接上只编译一次
+SQL_CREATE_USERS = '''
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT NOT NULL
+    )
+'''
+SQL_INSERT_USER = 'INSERT INTO users (username, password) VALUES (?, ?)'
+SQL_SELECT_PASSWORD = 'SELECT password FROM users WHERE username = ?'
+# 只在密码未被并发修改时更新，用于登录时把明文密码迁移为哈希
+SQL_UPDATE_PASSWORD = 'UPDATE users SET password = ? WHERE username = ? AND password = ?'
+SQL_USER_EXISTS = 'SELECT 1 FROM users WHERE username = ?'
+SQL_ALL_USERNAMES = 'SELECT username FROM users'
+
 
 class DatabaseService:
-    def __init__(self):
-        # 数据库文件路径
-        self.db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'users.db')
+    def __init__(self, db_path=None):
+        # 数据库文件路径，默认为config.USERS_DB；文件在第一次启动时创建，不纳入版本库（WAL模式会改写文件并生成-wal/-shm文件）
+        self.db_path = db_path or USERS_DB
         # 确保data目录存在
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # 连接池，连接在第一次查询时才打开
+        self.pool = SQLitePool(self.db_path)
+        # 已注册用户名的内存索引，检查用户名是否可用时不必查询数据库
+        self.usernames = UsernameIndex()
         # 初始化数据库
         self._init_db()
 
     def _init_db(self):
         """初始化数据库，创建用户表"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        # 建表使用临时连接，避免在fork之前就打开连接池中的连接
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # WAL模式是持久的，设置一次后所有连接都生效
+            conn.execute('PRAGMA journal_mode=WAL')
             # 创建用户表，存储用户名和密码
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    username TEXT PRIMARY KEY,
-                    password TEXT NOT NULL
-                )
-            ''')
+            conn.execute(SQL_CREATE_USERS)
             conn.commit()
+            self.usernames.load(row[0] for row in conn.execute(SQL_ALL_USERNAMES))
+        finally:
+            conn.close()
 
     def register_user(self, username: str, password: str) -> bool:
-        """注册新用户
+        """注册新用户（在当前线程计算密码哈希）
         
         Args:
             username: 用户名
@@ -34,25 +59,26 @@ class DatabaseService:
         Returns:
             bool: 注册是否成功
         """
+        return self._insert_user(username, password_hasher.hash_sync(password))
+
+    def _insert_user(self, username: str, stored_password: str) -> bool:
+        """插入用户，stored_password为密码哈希"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self.pool.connection() as conn:
                 # 插入新用户，使用用户名作为主键确保唯一性
-                cursor.execute(
-                    'INSERT INTO users (username, password) VALUES (?, ?)',
-                    (username, password)
-                )
-                conn.commit()
-                return True
+                conn.execute(SQL_INSERT_USER, (username, stored_password))
+            self.usernames.add(username)
+            return True
         except sqlite3.IntegrityError:
-            # 用户名已存在
+            # 用户名已存在（可能是其他进程注册的）
+            self.usernames.add(username)
             return False
         except Exception as e:
             print(f"注册用户时发生错误: {e}")
             return False
 
     def login_user(self, username: str, password: str) -> bool:
-        """用户登录
+        """用户登录（在当前线程校验密码）
         
         Args:
             username: 用户名
@@ -61,21 +87,31 @@ class DatabaseService:
         Returns:
             bool: 登录是否成功
         """
+        stored = self._get_password(username)
+        if not password_hasher.verify_sync(password, stored):
+            return False
+        if password_hasher.needs_rehash(stored):
+            self._update_password(username, stored, password_hasher.hash_sync(password))
+        return True
+
+    def _get_password(self, username: str) -> Optional[str]:
+        """查询用户的密码存储值，用户不存在时返回None"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self.pool.connection() as conn:
                 # 查询用户
-                cursor.execute(
-                    'SELECT password FROM users WHERE username = ?',
-                    (username,)
-                )
-                result = cursor.fetchone()
-                if result and result[0] == password:
-                    return True
-                return False
+                result = conn.execute(SQL_SELECT_PASSWORD, (username,)).fetchone()
+                return result[0] if result else None
         except Exception as e:
             print(f"用户登录时发生错误: {e}")
-            return False
+            return None
+
+    def _update_password(self, username: str, old_stored: str, new_stored: str) -> None:
+        """把旧的密码存储值（明文或旧参数的哈希）替换为新的哈希"""
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(SQL_UPDATE_PASSWORD, (new_stored, username, old_stored))
+        except Exception as e:
+            print(f"更新密码哈希时发生错误: {e}")
 
     def check_username_exists(self, username: str) -> bool:
         """检查用户名是否已存在
@@ -87,16 +123,45 @@ class DatabaseService:
             bool: 用户名是否已存在
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'SELECT 1 FROM users WHERE username = ?',
-                    (username,)
-                )
-                return cursor.fetchone() is not None
+            with self.pool.connection() as conn:
+                return conn.execute(SQL_USER_EXISTS, (username,)).fetchone() is not None
         except Exception as e:
             print(f"检查用户名时发生错误: {e}")
             return False
 
+    # =================== 异步接口（在数据库线程中执行，不阻塞IOLoop） ===================
+    # 数据库排队已满或超时时抛出 DBBusyError，密码计算排队已满时抛出 HasherBusyError
+
+    async def register_user_async(self, username: str, password: str) -> bool:
+        """异步注册新用户"""
+        if self.usernames.contains(username):
+            # 用户名已存在时不必计算哈希
+            return False
+        stored = await password_hasher.hash(password)
+        return await db_executor.run(self._insert_user, username, stored)
+
+    async def login_user_async(self, username: str, password: str) -> bool:
+        """异步验证用户登录，明文存储的旧密码在登录成功后迁移为哈希"""
+        stored = await db_executor.run(self._get_password, username)
+        if stored is None:
+            return False
+        if not await password_hasher.verify(password, stored):
+            return False
+        if password_hasher.needs_rehash(stored):
+            try:
+                new_stored = await password_hasher.hash(password)
+                await db_executor.run(self._update_password, username, stored, new_stored)
+            except Exception as e:
+                # 迁移失败不影响本次登录，下次登录时再试
+                print(f"迁移密码哈希失败: {e}")
+        return True
+
+    async def check_username_exists_async(self, username: str) -> bool:
+        """异步检查用户名是否已存在，内存索引能确定结果时不查询数据库"""
+        exists = self.usernames.contains(username)
+        if exists is not None:
+            return exists
+        return await db_executor.run(self.check_username_exists, username)
+
 # 创建数据库服务实例
 db_service = DatabaseService()
\ No newline at end of file
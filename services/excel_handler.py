@@ -7,6 +7,12 @@ Excel表格操作模块 - 用于处理AMap_adcode_citycode.xlsx文件
 import pandas as pd
 import os
 
+try:
+    from services.city_binary import file_digest, write_city_binary
+except ImportError:
+    # 直接以脚本方式运行本文件时
+    from city_binary import file_digest, write_city_binary
+
 class ExcelHandler:
     """
     Excel表格操作类，用于处理AMap_adcode_citycode.xlsx文件
@@ -22,7 +28,7 @@ class ExcelHandler:
         # 设置默认文件路径
         self.default_file_path = os.path.join(
             os.path.dirname(os.path.dirname(__file__)),
-            'AMap_adcode_citycode.xlsx'
+            'data', 'excel', 'AMap_adcode_citycode.xlsx'
         )
         
         self.file_path = file_path or self.default_file_path
@@ -181,6 +187,28 @@ class ExcelHandler:
             print(f"导出JSON失败：{str(e)}")
             return False
     
+    def export_to_binary(self, output_path):
+        """
+        将数据编译为紧凑的二进制文件，运行时通过mmap加载，无需pandas
+        
+        Args:
+            output_path (str): 二进制文件输出路径
+            
+        Returns:
+            bool: 导出成功返回True，否则返回False
+        """
+        if not self.loaded:
+            return False
+        
+        try:
+            # 记录Excel文件的摘要，运行时据此判断二进制文件是否需要重新编译
+            write_city_binary(self.data.to_dict('records'), output_path, file_digest(self.file_path))
+            print(f"成功导出二进制文件：{output_path}")
+            return True
+        except Exception as e:
+            print(f"导出二进制文件失败：{str(e)}")
+            return False
+    
     def count_records(self):
         """
         获取记录总数
@@ -245,5 +273,12 @@ if __name__ == "__main__":
         # 测试导出为JSON
         print("\n导出为JSON文件...")
         excel_handler.export_to_json('city_data.json')
+        
+        # 测试编译为二进制文件（运行时由services.city_service通过mmap加载）
+        print("\n编译二进制城市数据文件...")
+        excel_handler.export_to_binary(os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            'data', 'bin', 'AMap_adcode_citycode.bin'
+        ))
     else:
         print("ExcelHandler初始化失败")
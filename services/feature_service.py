@@ -1,18 +1,128 @@
+import asyncio
 import json
+import time
 import uuid
 import tornado.ioloop
-from services.ai_service import AIService
+from config import AI_STREAM_FLUSH_INTERVAL, AI_STREAM_FLUSH_CHARS, AI_MODEL, AI_STREAM_MAX_TOKENS, CHAT_DEFAULT_ROOM
+from services.ai_service import AIService, SYSTEM_PROMPT
+from services.ai_cache import ai_cache, make_cache_key
+from services.ai_scheduler import ai_scheduler, AITicket, AIQueueFullError
+from services.ai_streams import ai_streams, CANCEL_MESSAGES, CANCEL_USER_LEFT
+from services.conversation_memory import conversation_memory
 from services.movie_service import MovieService
 from services.news_service import NewsService
+from services.command_dispatcher import command_dispatcher
+from services.metrics import metrics
+
+AI_REQUESTS = metrics.counter("ai_requests_total", "AI请求数，按回复来源（cache缓存/shared共享进行中的请求/upstream上游）",
+                              ("source",))
+AI_QUEUE_WAIT_SECONDS = metrics.histogram("ai_queue_wait_seconds", "AI请求在调度器中排队的时间",
+                                          buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120))
+AI_FIRST_TOKEN_SECONDS = metrics.histogram("ai_first_token_seconds", "从请求上游到收到第一个片段的时间（TTFT）",
+                                           buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60))
+AI_TOKENS_PER_SECOND = metrics.histogram("ai_tokens_per_second", "上游流式输出速度（片段数/秒，每个片段约为一个token）",
+                                         buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300))
+
+
+class StreamCoalescer:
+    """
+    AI流式片段合并器：把同一个response_id的连续片段合并成一帧再广播，
+    每隔flush_interval秒或累计flush_chars个字符发送一次，结束时发送ai_stream_end
+    """
+    def __init__(self, broadcast_func, response_id,
+                 flush_interval=AI_STREAM_FLUSH_INTERVAL, flush_chars=AI_STREAM_FLUSH_CHARS):
+        self.broadcast_func = broadcast_func
+        self.response_id = response_id
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+
+    def add(self, content):
+        """追加一个片段"""
+        if not content:
+            return
+        self._buffer.append(content)
+        self._size += len(content)
+        if self._size >= self.flush_chars:
+            self.flush()
+        elif self._timer is None:
+            self._timer = tornado.ioloop.IOLoop.current().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """立即广播已缓冲的片段"""
+        if self._timer is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._timer)
+            self._timer = None
+        if not self._buffer:
+            return
+        content = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self.broadcast_func({
+            "type": "ai_stream_update",
+            "id": self.response_id,
+            "content": content
+        })
+
+    def finish(self):
+        """发送剩余片段和结束消息"""
+        self.flush()
+        self.broadcast_func({
+            "type": "ai_stream_end",
+            "id": self.response_id
+        })
 
 
 class FeatureService:
+    """聊天功能（电影、新闻、AI），以命令的形式注册到命令分发器"""
+
     def __init__(self):
         # 初始化各功能服务实例
         self.movie_service = MovieService()
         self.news_service = NewsService()
         self.ai_prefix = '@川小农 '
 
+    # =================== 命令注册 ===================
+    def register_commands(self, dispatcher):
+        """
+        把各功能的触发词注册到命令分发器
+
+        处理函数再按原始内容判断一次是否为命令，与 is_movie_message 等方法的语义一致
+        """
+        dispatcher.register(self.movie_service.movie_prefix.strip(), self.handle_movie_command)
+        dispatcher.register(self.news_service.news_prefix, self.handle_news_command)
+        dispatcher.register(self.ai_prefix.strip(), self.handle_ai_command)
+
+    def handle_movie_command(self, nickname, room, argument, data, broadcast):
+        """@电影 链接"""
+        content = data.get("content", "")
+        if not self.is_movie_message(content):
+            return False
+        broadcast(self.process_movie_message(nickname, content, data.get("timestamp")))
+        return True
+
+    def handle_news_command(self, nickname, room, argument, data, broadcast):
+        """@新闻（不带参数）"""
+        content = data.get("content", "")
+        if not self.is_news_request(content):
+            return False
+        broadcast(self.process_news_message(nickname, content, data.get("timestamp")))
+        return True
+
+    def handle_ai_command(self, nickname, room, argument, data, broadcast):
+        """@川小农 问题"""
+        if not self.is_ai_request(data.get("content", "")):
+            return False
+        user_msg, init_response, user_query, response_id = self.prepare_ai_response(
+            nickname, data.get("content", ""), data.get("timestamp"))
+        broadcast(user_msg)
+        broadcast(init_response)
+        # broadcast固定为提问时所在的房间，即使提问者之后切换了房间
+        self.stream_ai_response(broadcast, response_id, user_query, nickname, room)
+        return True
+
     # =================== 电影功能调用接口 ===================
     def is_movie_message(self, content):
         """检查消息是否为电影链接"""
@@ -71,35 +181,101 @@ class FeatureService:
 
         return user_msg, init_response, user_query, response_id
 
-    def stream_ai_response(self, broadcast_func, response_id, user_query):
-        """流式传输AI响应"""
+    def stream_ai_response(self, broadcast_func, response_id, user_query, nickname=None, room=CHAT_DEFAULT_ROOM):
+        """
+        流式传输AI响应
+
+        命中缓存时直接重放缓存的回复；相同的问题正在生成时共享同一个上游流；
+        否则经过AI请求调度器排队（受全局和每用户并发上限约束）后请求上游。
+        回复任务登记在ai_streams中，超时、提问者离开或停止、房间无人时被取消。
+        之前的对话作为上下文发给上游，完整的（未被截断的）回复记入对话记忆
+        """
+        def on_position(position):
+            # 向聊天室通知排队位置
+            broadcast_func({
+                "type": "ai_queue",
+                "id": response_id,
+                "position": position
+            })
+
+        ticket = AITicket(nickname, response_id)
+        memory_key = conversation_memory.key(nickname, room)
+        history, context = conversation_memory.get(memory_key)
+        key = make_cache_key(user_query, AI_MODEL, SYSTEM_PROMPT, context)
+
+        async def produce(inflight):
+            # 上游请求占用的是第一个提问者的名额，直到上游流结束才释放
+            try:
+                queued_at = time.perf_counter()
+                await ai_scheduler.acquire(ticket)
+                started_at = time.perf_counter()
+                AI_QUEUE_WAIT_SECONDS.observe(started_at - queued_at)
+                first_at = None
+                tokens = 0
+                chunks = AIService.stream_text(user_query, history)
+                try:
+                    async for content in chunks:
+                        if first_at is None:
+                            first_at = time.perf_counter()
+                            AI_FIRST_TOKEN_SECONDS.observe(first_at - started_at)
+                        tokens += 1
+                        inflight.append(content)
+                        if tokens >= AI_STREAM_MAX_TOKENS:
+                            # 截断的回复不写入缓存
+                            inflight.complete = False
+                            inflight.append("\n[回复过长，已截断]")
+                            break
+                finally:
+                    # 提前结束（截断或取消）时关闭上游响应，释放HTTP连接
+                    await chunks.aclose()
+                if tokens > 1:
+                    AI_TOKENS_PER_SECOND.observe((tokens - 1) / max(time.perf_counter() - first_at, 1e-6))
+            finally:
+                ai_scheduler.release(ticket)
+
         async def ai_stream_task():
+            # 合并连续的片段，避免每个token都向所有客户端广播一次
+            coalescer = StreamCoalescer(broadcast_func, response_id)
             try:
-                stream = await AIService.generate_response(user_query)
-
-                async for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        content = chunk.choices[0].delta.content
-                        # 向所有客户端广播消息块
-                        update_msg = {
-                            "type": "ai_stream_update",
-                            "id": response_id,
-                            "content": content
-                        }
-                        broadcast_func(update_msg)
+                cached = ai_cache.get(key)
+                if cached is not None:
+                    # 按合并器的帧大小重放缓存的回复，协议与实时生成相同
+                    for start in range(0, len(cached), coalescer.flush_chars):
+                        coalescer.add(cached[start:start + coalescer.flush_chars])
+                    AI_REQUESTS.labels("cache").inc()
+                    conversation_memory.add_exchange(memory_key, user_query, cached)
+                    return
+
+                inflight = ai_cache.get_inflight(key)
+                if inflight is None:
+                    inflight = ai_cache.start_inflight(key, produce)
+                    ticket.on_position = inflight.notify_position
+                    AI_REQUESTS.labels("upstream").inc()
+                else:
+                    AI_REQUESTS.labels("shared").inc()
 
+                async for content in inflight.subscribe(on_position):
+                    coalescer.add(content)
+                # 出错、被取消或被截断的回复不记入对话记忆
+                if inflight.complete:
+                    conversation_memory.add_exchange(memory_key, user_query, inflight.text)
+
+            except AIQueueFullError:
+                coalescer.add("[系统繁忙: AI请求排队人数已满，请稍后再试]")
+            except asyncio.CancelledError:
+                # 没有其他人在等同一个回复时上游请求随之取消
+                reason = ai_streams.reason(response_id) or CANCEL_USER_LEFT
+                coalescer.add(CANCEL_MESSAGES[reason])
             except Exception as e:
                 print(f"AI错误: {e}")
                 # 向UI发送错误消息
-                error_msg = {
-                    "type": "ai_stream_update",
-                    "id": response_id,
-                    "content": "\n[系统错误: AI连接失败]"
-                }
-                broadcast_func(error_msg)
+                coalescer.add("\n[系统错误: AI连接失败]")
+            finally:
+                ai_streams.unregister(response_id)
+                coalescer.finish()
 
-        # 生成异步任务来流式传输AI响应
-        tornado.ioloop.IOLoop.current().spawn_callback(ai_stream_task)
+        # 生成异步任务来流式传输AI响应，登记任务以便取消
+        ai_streams.register(response_id, nickname, room, asyncio.ensure_future(ai_stream_task()))
 
     # =================== 通用消息处理 ===================
     def process_regular_message(self, nickname, content, timestamp=None):
@@ -110,3 +286,8 @@ class FeatureService:
             "content": content,
             "timestamp": timestamp
         }
+
+
+# 创建功能服务实例（每个进程一个）并注册命令
+feature_service = FeatureService()
+feature_service.register_commands(command_dispatcher)
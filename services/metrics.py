@@ -0,0 +1,196 @@
+import math
+import time
+from bisect import bisect_left
+
+# 延迟直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """指标基类：带标签的指标按标签值保存子指标"""
+    TYPE = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # {标签值元组: 子指标}
+        self._children = {}
+
+    def labels(self, *values):
+        """按标签值取子指标；热路径上可以先取出子指标再反复使用"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """(后缀, 标签值, 额外标签, 数值)"""
+        if not self.labelnames:
+            yield from self._child_samples((), self)
+            return
+        for values, child in self._children.items():
+            yield from child._child_samples(values, child)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} "
+                         f"{_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    TYPE = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _child_samples(self, values, child):
+        yield "", values, None, child.value
+
+
+class Gauge(_Metric):
+    """当前值；给出func时在采集时调用func取值，热路径上不需要维护"""
+    TYPE = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+        self.func = func
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def _child_samples(self, values, child):
+        yield "", values, None, child.func() if child.func is not None else child.value
+
+
+class CounterFunc(Gauge):
+    """在采集时从已有的统计对象读取的计数"""
+    TYPE = "counter"
+
+
+class Histogram(_Metric):
+    """
+    直方图：固定分桶，observe只有一次二分查找和两次加法
+
+    采集时再把各桶的计数累加成Prometheus要求的累计值
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 最后一个桶是+Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def time(self):
+        """用法: with histogram.time(): ..."""
+        return _Timer(self)
+
+    def _child_samples(self, values, child):
+        total = 0
+        for bound, count in zip(child.buckets + (math.inf,), child.counts):
+            total += count
+            yield "_bucket", values, ("le", _format_value(float(bound))), total
+        yield "_sum", values, None, child.sum
+        yield "_count", values, None, total
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按注册顺序输出Prometheus文本格式"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"指标已被注册: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def counter_func(self, name, documentation, func):
+        return self.register(CounterFunc(name, documentation, func=func))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self.register(Gauge(name, documentation, labelnames, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+# 创建指标注册表实例（每个进程一个）
+metrics = MetricsRegistry()
@@ -0,0 +1,126 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+from config import (PASSWORD_HASH_ALGORITHM, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P,
+                    PASSWORD_PBKDF2_ITERATIONS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+# 存储格式:
+#   scrypt$N$r$p$盐$哈希
+#   pbkdf2_sha256$迭代次数$盐$哈希
+# 盐和哈希为base64编码；不带这两种前缀的是旧版本留下的明文密码
+SCRYPT_PREFIX = "scrypt$"
+PBKDF2_PREFIX = "pbkdf2_sha256$"
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+class HasherBusyError(Exception):
+    """密码计算排队已满"""
+    pass
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _b64decode(text):
+    return base64.b64decode(text.encode("ascii"))
+
+
+class PasswordHasher:
+    """
+    密码哈希：scrypt或PBKDF2，计算在有界线程池中进行，不占用IOLoop
+
+    hashlib的scrypt和pbkdf2_hmac计算时会释放GIL，多个线程可以并行计算。
+    排队的请求数有上限，登录高峰时多出的请求直接返回“繁忙”，不会无限堆积。
+    """
+
+    def __init__(self, algorithm=PASSWORD_HASH_ALGORITHM, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING):
+        self.algorithm = algorithm
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    # =================== 同步计算 ===================
+    def hash_sync(self, password):
+        """计算密码的存储值"""
+        salt = os.urandom(SALT_BYTES)
+        if self.algorithm == "pbkdf2":
+            digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt,
+                                         PASSWORD_PBKDF2_ITERATIONS, HASH_BYTES)
+            return f"{PBKDF2_PREFIX}{PASSWORD_PBKDF2_ITERATIONS}${_b64encode(salt)}${_b64encode(digest)}"
+
+        digest = self._scrypt(password, salt, PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+        return (f"{SCRYPT_PREFIX}{PASSWORD_SCRYPT_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}$"
+                f"{_b64encode(salt)}${_b64encode(digest)}")
+
+    def verify_sync(self, password, stored):
+        """校验密码；stored为明文（旧数据）时直接比较"""
+        if stored is None:
+            return False
+        try:
+            if stored.startswith(SCRYPT_PREFIX):
+                _, n, r, p, salt, expected = stored.split("$")
+                digest = self._scrypt(password, _b64decode(salt), int(n), int(r), int(p))
+            elif stored.startswith(PBKDF2_PREFIX):
+                _, iterations, salt, expected = stored.split("$")
+                digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), _b64decode(salt),
+                                             int(iterations), HASH_BYTES)
+            else:
+                return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+        except ValueError as e:
+            print(f"无法解析的密码存储格式: {e}")
+            return False
+        return hmac.compare_digest(digest, _b64decode(expected))
+
+    @staticmethod
+    def _scrypt(password, salt, n, r, p):
+        # scrypt需要约 128*n*r 字节内存
+        return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r, dklen=HASH_BYTES)
+
+    @staticmethod
+    def is_hashed(stored):
+        return stored.startswith(SCRYPT_PREFIX) or stored.startswith(PBKDF2_PREFIX)
+
+    def needs_rehash(self, stored):
+        """明文密码，或参数与当前配置不同的哈希，需要在登录成功后重新计算"""
+        if self.algorithm == "pbkdf2":
+            return not stored.startswith(f"{PBKDF2_PREFIX}{PASSWORD_PBKDF2_ITERATIONS}$")
+        return not stored.startswith(
+            f"{SCRYPT_PREFIX}{PASSWORD_SCRYPT_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}$")
+
+    # =================== 异步接口 ===================
+    def _get_executor(self):
+        # 线程在第一次使用时才创建，多进程模式下在fork之后
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        return self._executor
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusyError("密码计算繁忙")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        """在线程池中计算密码的存储值；排队已满时抛出HasherBusyError"""
+        return await self._run(self.hash_sync, password)
+
+    async def verify(self, password, stored):
+        """在线程池中校验密码；排队已满时抛出HasherBusyError"""
+        return await self._run(self.verify_sync, password, stored)
+
+
+# 创建密码哈希实例（每个进程一个）
+password_hasher = PasswordHasher()
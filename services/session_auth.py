@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from tornado.web import create_signed_value, decode_signed_value
+from config import COOKIE_SECRET, WS_TOKEN_TTL, SESSION_CACHE_SIZE, SESSION_CACHE_TTL
+
+# 登录Cookie和WebSocket令牌的签名名称
+COOKIE_NAME = "username"
+TOKEN_NAME = "ws_token"
+# 登录Cookie的有效期（天），与tornado的set_secure_cookie默认值一致
+COOKIE_MAX_AGE_DAYS = 31
+
+
+class SessionAuthenticator:
+    """
+    WebSocket握手认证：校验登录Cookie或短期签名令牌，得到用户名
+
+    校验通过的凭据放在内存LRU中，网络抖动后大量客户端同时重连时，
+    每次握手只需要一次字典查找，不需要重新校验签名，也不访问数据库
+    """
+
+    def __init__(self, secret=COOKIE_SECRET, token_ttl=WS_TOKEN_TTL,
+                 cache_size=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL):
+        self.secret = secret
+        self.token_ttl = token_ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # {(签名名称, 凭据): (用户名, 过期时间)}，按最近使用排序
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def issue_token(self, username):
+        """签发WebSocket令牌，令牌中带有过期时间"""
+        expires_at = int(time.time()) + self.token_ttl
+        value = create_signed_value(self.secret, TOKEN_NAME, f"{expires_at}:{username}")
+        return value.decode("ascii")
+
+    def verify(self, cookie=None, token=None):
+        """
+        校验凭据，令牌优先
+
+        Returns:
+            str|None: 校验通过时返回用户名
+        """
+        if token:
+            return self._verify(TOKEN_NAME, token)
+        if cookie:
+            return self._verify(COOKIE_NAME, cookie)
+        return None
+
+    def _verify(self, name, credential):
+        key = (name, credential)
+        now = time.time()
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self.cache[key]
+
+        self.misses += 1
+        if name == TOKEN_NAME:
+            username, expires_at = self._decode_token(credential, now)
+        else:
+            username = self._decode_cookie(credential)
+            expires_at = now + self.cache_ttl
+        if username is None:
+            return None
+
+        self.cache[key] = (username, min(expires_at, now + self.cache_ttl))
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return username
+
+    def _decode_token(self, token, now):
+        value = decode_signed_value(self.secret, TOKEN_NAME, token, max_age_days=1)
+        if value is None:
+            return None, 0
+        expires_at, _, username = value.decode("utf-8").partition(":")
+        try:
+            expires_at = int(expires_at)
+        except ValueError:
+            return None, 0
+        if expires_at <= now or not username:
+            return None, 0
+        return username, expires_at
+
+    def _decode_cookie(self, cookie):
+        value = decode_signed_value(self.secret, COOKIE_NAME, cookie, max_age_days=COOKIE_MAX_AGE_DAYS)
+        return value.decode("utf-8") if value else None
+
+
+# 创建会话认证实例（每个进程一个）
+session_auth = SessionAuthenticator()
@@ -0,0 +1,121 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import DB_POOL_SIZE, DB_BUSY_TIMEOUT_MS, DB_MMAP_SIZE, DB_CACHED_STATEMENTS
+
+
+class SQLitePool:
+    """
+    SQLite连接池：连接复用，避免每次查询都重新打开数据库
+
+    每个连接打开时设置一次WAL等pragma；sqlite3会按SQL文本缓存预编译语句，
+    所以调用方应使用固定的SQL常量，同一条语句在同一个连接上只编译一次。
+    连接在第一次使用时才创建，多进程模式下fork之后各进程使用自己的连接。
+    """
+
+    def __init__(self, db_path, max_size=DB_POOL_SIZE, busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+                 mmap_size=DB_MMAP_SIZE, cached_statements=DB_CACHED_STATEMENTS):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # 记录创建连接的进程，fork之后不能继续使用父进程的连接
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL模式下NORMAL只在检查点时fsync，提交不再每次都刷盘
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._created < self.max_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        # 连接都在使用中，等待归还
+        return self._idle.get()
+
+    def _release(self, conn, broken=False):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            if broken:
+                self._created -= 1
+        if broken:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        借出一个连接，退出时提交（出错时回滚）并归还
+
+        用法:
+            with pool.connection() as conn:
+                conn.execute(SQL, params)
+        """
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            # 回滚失败说明连接已不可用，丢弃它
+            broken = False
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                broken = True
+            self._release(conn, broken)
+            raise
+        else:
+            self._release(conn)
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._created -= 1
@@ -0,0 +1,87 @@
+import hashlib
+import math
+import threading
+from config import USERNAME_SET_MAX, USERNAME_BLOOM_FP_RATE
+
+
+class BloomFilter:
+    """布隆过滤器：判断“不存在”是确定的，判断“可能存在”有一定误判率"""
+
+    def __init__(self, capacity, fp_rate):
+        capacity = max(capacity, 1)
+        # 按容量和误判率计算位数和哈希函数个数
+        self.size = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # 双重哈希：用一次blake2b的两半模拟k个哈希函数
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class UsernameIndex:
+    """
+    已注册用户名的内存索引，供注册页面实时检查用户名是否可用
+
+    用户数不超过USERNAME_SET_MAX时用集合保存，结果是确定的；
+    超过时改用布隆过滤器，“不存在”仍是确定的，“可能存在”需要再查数据库。
+    多进程模式下其他进程新注册的用户名不会出现在本进程的索引中，
+    注册时仍以数据库的主键约束为准。
+    """
+
+    def __init__(self, max_set_size=USERNAME_SET_MAX, fp_rate=USERNAME_BLOOM_FP_RATE):
+        self.max_set_size = max_set_size
+        self.fp_rate = fp_rate
+        self.names = set()
+        self.bloom = None
+        # 注册在数据库线程中进行，写入时加锁
+        self._lock = threading.Lock()
+
+    def load(self, usernames):
+        """用数据库中的全部用户名重建索引"""
+        names = set(usernames)
+        if len(names) <= self.max_set_size:
+            self.names = names
+            self.bloom = None
+            return
+
+        # 为之后注册的用户预留容量；超出容量后误判率升高，但“不存在”的判断仍然可靠
+        bloom = BloomFilter(max(len(names) * 2, self.max_set_size * 4), self.fp_rate)
+        for name in names:
+            bloom.add(name)
+        self.names = set()
+        self.bloom = bloom
+
+    def add(self, username):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(username)
+                return
+            self.names.add(username)
+            if len(self.names) > self.max_set_size:
+                self.load(self.names)
+
+    def contains(self, username):
+        """
+        Returns:
+            True: 用户名已存在
+            False: 用户名不存在
+            None: 可能存在（布隆过滤器命中），需要查询数据库确认
+        """
+        if self.bloom is None:
+            return username in self.names
+        return None if username in self.bloom else False
+
+    def __len__(self):
+        return len(self.names)
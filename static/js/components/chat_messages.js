@@ -31,9 +31,27 @@ export class ChatMessages {
 
         if (data.type === 'system') {
             this.renderSystemMessage(data);
+        } else if (data.type === 'joined') {
+            // 进入房间（连接时或切换房间后）
+            this.renderSystemMessage({ content: `当前房间：${data.room}` });
+        } else if (data.type === 'presence') {
+            // 在线用户快照只更新侧边栏
+        } else if (data.type === 'presence_add' || data.type === 'presence_remove') {
+            // 合并后的加入/离开通知，不显示自己
+            const users = data.users.filter(user => user !== currentUser);
+            if (users.length > 0) {
+                const action = data.type === 'presence_add' ? '加入了' : '离开了';
+                this.renderSystemMessage({ content: `${users.join('、')} ${action}${data.room}` });
+            }
         } else if (data.type === 'ai_stream_update') {
             // 处理流式AI响应
             this.renderAIStreamUpdate(data);
+        } else if (data.type === 'ai_queue') {
+            // AI请求排队位置
+            this.featureService.updateAIQueuePosition(data);
+        } else if (data.type === 'ai_stream_end') {
+            // AI响应结束
+            this.featureService.finishAIStreamResponse(data);
         } else {
             this.renderUserMessage(data, currentUser);
         }
@@ -30,8 +30,14 @@ export class UIRenderer {
         // 委托给ChatMessages组件处理
         this.chatMessagesComponent.handleMessage(data, currentUser);
         
-        // 处理系统消息中的在线用户更新
-        if (data.type === 'system' && data.online_users) {
+        // 在线用户：进入房间时收到完整快照，之后只收到增量
+        if (data.type === 'presence') {
+            this.sidebarService.updateOnlineUsers(data.users);
+        } else if (data.type === 'presence_add') {
+            data.users.forEach(user => this.sidebarService.addUser(user));
+        } else if (data.type === 'presence_remove') {
+            data.users.forEach(user => this.sidebarService.removeUser(user));
+        } else if (data.type === 'system' && data.online_users) {
             // 使用SidebarService更新在线用户
             this.sidebarService.updateOnlineUsers(data.online_users);
         }
@@ -9,8 +9,13 @@ export class AIService {
             aiPrefix: '@川小农 ',
             thinkingMessage: '🤖 AI 正在思考中...',
             aiName: '川小农',
-            aiAvatarColor: '#00cec9'
+            aiAvatarColor: '#00cec9',
+            emptyMessage: '（没有收到回复）',
+            queueMessage: '⏳ 排队中 #'
         };
+        // 等待逐帧显示的文本: {回复ID: 文本}
+        this.pendingText = {};
+        this.animationFrame = null;
     }
 
     /**
@@ -67,8 +72,73 @@ export class AIService {
                 contentDiv.style.borderTop = "none";
                 contentDiv.style.paddingTop = "0";
             }
-            // 追加块
-            contentDiv.textContent += data.content;
+            // 服务端每隔几十毫秒才合并发送一次，这里按帧逐步显示，保持打字效果平滑
+            this.pendingText[data.id] = (this.pendingText[data.id] || '') + data.content;
+            this.scheduleReveal();
         }
     }
+
+    /**
+     * 安排下一帧显示缓冲的文本
+     */
+    scheduleReveal() {
+        if (this.animationFrame === null) {
+            this.animationFrame = requestAnimationFrame(() => this.revealPendingText());
+        }
+    }
+
+    /**
+     * 每帧显示一部分缓冲文本，积压越多显示越快，大约3帧内追上
+     */
+    revealPendingText() {
+        this.animationFrame = null;
+        for (const id of Object.keys(this.pendingText)) {
+            const contentDiv = document.getElementById(`ai-content-${id}`);
+            const text = this.pendingText[id];
+            if (!contentDiv) {
+                delete this.pendingText[id];
+                continue;
+            }
+            const count = Math.max(4, Math.ceil(text.length / 3));
+            contentDiv.textContent += text.substring(0, count);
+            if (count >= text.length) {
+                delete this.pendingText[id];
+            } else {
+                this.pendingText[id] = text.substring(count);
+            }
+        }
+        if (Object.keys(this.pendingText).length > 0) {
+            this.scheduleReveal();
+        }
+    }
+
+    /**
+     * 更新AI请求的排队位置
+     * @param {Object} data - 消息数据，position为0表示排队结束开始生成
+     */
+    updateAIQueuePosition(data) {
+        const contentDiv = document.getElementById(`ai-content-${data.id}`);
+        // 已经开始输出内容后不再显示排队信息
+        if (!contentDiv || contentDiv.dataset.streaming !== "false") return;
+
+        contentDiv.textContent = data.position > 0
+            ? `${this.config.queueMessage}${data.position}`
+            : this.config.thinkingMessage;
+    }
+
+    /**
+     * 结束AI流式响应
+     * @param {Object} data - 消息数据
+     */
+    finishAIStreamResponse(data) {
+        const contentDiv = document.getElementById(`ai-content-${data.id}`);
+        if (!contentDiv) return;
+
+        // 一个片段都没有收到，替换掉"思考中"的提示
+        if (contentDiv.dataset.streaming === "false") {
+            contentDiv.textContent = this.config.emptyMessage;
+            contentDiv.style.color = "#2d3436";
+        }
+        contentDiv.dataset.streaming = "done";
+    }
 }
\ No newline at end of file
@@ -77,13 +77,34 @@ export class ApiService {
         }
     }
 
+    /**
+     * 获取WebSocket连接令牌（需要已登录）
+     * @returns {Promise<string|null>} 令牌，未登录或请求失败时为null
+     */
+    static async getWebSocketToken() {
+        try {
+            const response = await fetch('/api/ws-token', { credentials: 'same-origin' });
+            if (!response.ok) {
+                return null;
+            }
+            const data = await response.json();
+            return data.success ? data.token : null;
+        } catch (error) {
+            console.error('获取WebSocket令牌失败:', error);
+            return null;
+        }
+    }
+
     /**
      * 创建WebSocket连接
      * @param {string} nickname - 用户昵称
      * @param {string} serverUrl - 服务器URL
+     * @param {string|null} token - WebSocket连接令牌
+     * @param {number|null} lastSeq - 最后收到的消息序号，重连时服务器补发之后的消息
+     * @param {string|null} room - 要进入的房间，为空时进入默认房间
      * @returns {WebSocket} WebSocket连接实例
      */
-    static createWebSocket(nickname, serverUrl) {
+    static createWebSocket(nickname, serverUrl, token = null, lastSeq = null, room = null) {
         try {
             let url;
             
@@ -95,6 +116,16 @@ export class ApiService {
             }
             
             url.searchParams.append('nickname', encodeURIComponent(nickname));
+            if (token) {
+                // 服务器以令牌中的用户名为准
+                url.searchParams.append('token', token);
+            }
+            if (lastSeq) {
+                url.searchParams.append('last_seq', String(lastSeq));
+            }
+            if (room) {
+                url.searchParams.append('room', room);
+            }
             return new WebSocket(url);
         } catch (error) {
             console.error('创建WebSocket连接失败:', error);
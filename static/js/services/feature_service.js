@@ -87,6 +87,22 @@ export class FeatureService {
         return this.aiService.updateAIStreamResponse(data);
     }
 
+    /**
+     * 更新AI请求的排队位置
+     * @param {Object} data - 消息数据
+     */
+    updateAIQueuePosition(data) {
+        return this.aiService.updateAIQueuePosition(data);
+    }
+
+    /**
+     * 结束AI流式响应
+     * @param {Object} data - 消息数据
+     */
+    finishAIStreamResponse(data) {
+        return this.aiService.finishAIStreamResponse(data);
+    }
+
     // =================== 工具方法 ===================
     /**
      * 在输入框中插入命令
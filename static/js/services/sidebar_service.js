@@ -125,9 +125,11 @@ export class SidebarService {
      */
     addUser(user) {
         if (!this.elements.userCount || !this.elements.onlineUsersList) return;
+        // 快照和增量可能包含同一个用户，已在列表中时不重复添加
+        if (this.findUserElement(user)) return;
 
         // 更新用户数量
-        const currentCount = parseInt(this.elements.userCount.textContent);
+        const currentCount = parseInt(this.elements.userCount.textContent) || 0;
         this.elements.userCount.textContent = currentCount + 1;
 
         // 添加新用户
@@ -142,17 +144,30 @@ export class SidebarService {
     removeUser(user) {
         if (!this.elements.userCount || !this.elements.onlineUsersList) return;
 
+        const userElement = this.findUserElement(user);
+        if (!userElement) return;
+
         // 更新用户数量
-        const currentCount = parseInt(this.elements.userCount.textContent);
+        const currentCount = parseInt(this.elements.userCount.textContent) || 1;
         this.elements.userCount.textContent = currentCount - 1;
 
         // 移除用户元素
+        userElement.remove();
+    }
+
+    /**
+     * 查找在线列表中的用户元素
+     * @param {string} user - 用户名
+     * @returns {HTMLElement|null} - 用户列表项元素
+     */
+    findUserElement(user) {
         const userElements = this.elements.onlineUsersList.querySelectorAll('.user-list-item');
-        userElements.forEach(element => {
+        for (const element of userElements) {
             if (element.querySelector('span').textContent === user) {
-                element.remove();
+                return element;
             }
-        });
+        }
+        return null;
     }
 }
 
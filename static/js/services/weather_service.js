@@ -37,11 +37,11 @@ export class WeatherService {
      */
     static async fetchCityCode(cityName) {
         return new Promise((resolve, reject) => {
-            fetch(`/api/city?name=${encodeURIComponent(cityName)}`)
+            fetch(`/api/city?name=${encodeURIComponent(cityName)}&limit=1`)
                 .then(response => response.json())
                 .then(data => {
                     if (data.success && data.data && data.data.length > 0) {
-                        // 返回第一个匹配的城市
+                        // 返回第一个匹配的城市（服务端已按匹配程度排序）
                         resolve(data.data[0]);
                     } else {
                         reject(new Error(data.message || '未找到匹配的城市'));
@@ -5,39 +5,64 @@
 import { ApiService } from './api_service.js';
 import { SessionService } from './session_service.js';
 
+// 服务器主动拒绝（未登录、昵称被占用、在其他位置重新连接）时不再自动重连；
+// 其他关闭码（包括4001：消息接收过慢，服务器丢弃了待发送的消息）自动重连并补发错过的消息
+const FINAL_CLOSE_CODES = [1008, 4000];
+
 export class WebSocketService {
     constructor() {
         this.ws = null;
         this.currentUser = '';
+        this.serverUrl = '';
         this.onMessageCallback = null;
         this.onCloseCallback = null;
         this.onErrorCallback = null;
+        // 最后收到的消息序号，断线重连时服务器补发之后的消息
+        this.lastSeq = 0;
+        // 当前所在的房间，重连时回到同一个房间
+        this.room = null;
+        this.manualClose = false;
+        this.reconnectAttempts = 0;
+        this.reconnectTimer = null;
+    }
+
+    async connect(serverUrl, nickname, onMessageCallback, onCloseCallback = null, onErrorCallback = null) {
+        this.serverUrl = serverUrl;
+        this.onMessageCallback = onMessageCallback;
+        this.onCloseCallback = onCloseCallback;
+        this.onErrorCallback = onErrorCallback;
+        this.manualClose = false;
+        await this.open(nickname, null, false);
     }
 
-    connect(serverUrl, nickname, onMessageCallback, onCloseCallback = null, onErrorCallback = null) {
+    async open(nickname, lastSeq, reconnecting) {
+        // 先用登录Cookie换取短期令牌，WebSocket服务器可能与页面不同源
+        const token = await ApiService.getWebSocketToken();
         return new Promise((resolve, reject) => {
+            let opened = false;
             try {
                 // 使用ApiService创建WebSocket连接
-                this.ws = ApiService.createWebSocket(nickname, serverUrl);
-                this.onMessageCallback = onMessageCallback;
-                this.onCloseCallback = onCloseCallback;
-                this.onErrorCallback = onErrorCallback;
+                this.ws = ApiService.createWebSocket(nickname, this.serverUrl, token, lastSeq, this.room);
 
                 this.ws.onopen = () => {
+                    opened = true;
+                    this.reconnectAttempts = 0;
                     this.currentUser = nickname;
                     // 保存会话
-                    SessionService.createSession(nickname, serverUrl);
+                    SessionService.createSession(nickname, this.serverUrl);
                     resolve();
                 };
 
                 this.ws.onmessage = (event) => {
-                    const data = JSON.parse(event.data);
-                    if (this.onMessageCallback) {
-                        this.onMessageCallback(data);
-                    }
+                    this.handleMessage(JSON.parse(event.data));
                 };
 
                 this.ws.onclose = (event) => {
+                    if ((opened || reconnecting) && !this.manualClose && !FINAL_CLOSE_CODES.includes(event.code)) {
+                        // 网络中断，稍后自动重连并补发错过的消息
+                        this.scheduleReconnect(nickname);
+                        return;
+                    }
                     if (this.onCloseCallback) {
                         this.onCloseCallback(event);
                     }
@@ -56,6 +81,46 @@ export class WebSocketService {
         });
     }
 
+    handleMessage(data) {
+        if (data.type === 'history') {
+            // 断线期间错过的消息，按原顺序逐条处理
+            data.messages.forEach((message) => this.handleMessage(message));
+            return;
+        }
+        if (data.type === 'joined') {
+            this.room = data.room;
+        }
+        if (data.seq && data.seq > this.lastSeq) {
+            this.lastSeq = data.seq;
+        }
+        if (this.onMessageCallback) {
+            this.onMessageCallback(data);
+        }
+    }
+
+    scheduleReconnect(nickname) {
+        // 指数退避，最长30秒
+        const delay = Math.min(30000, 1000 * Math.pow(2, this.reconnectAttempts));
+        this.reconnectAttempts++;
+        this.reconnectTimer = setTimeout(async () => {
+            this.reconnectTimer = null;
+            try {
+                await this.open(nickname, this.lastSeq, true);
+            } catch (e) {
+                // 连接失败时onclose会继续安排重连
+                console.error('重新连接失败:', e);
+            }
+        }, delay);
+    }
+
+    /**
+     * 切换房间
+     * @param {string} room - 房间名
+     */
+    joinRoom(room) {
+        return this.sendMessage({ type: 'join', room: room });
+    }
+
     sendMessage(message) {
         if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return false;
         
@@ -69,6 +134,11 @@ export class WebSocketService {
     }
 
     disconnect() {
+        this.manualClose = true;
+        if (this.reconnectTimer) {
+            clearTimeout(this.reconnectTimer);
+            this.reconnectTimer = null;
+        }
         if (this.ws) {
             this.ws.close();
             this.ws = null;
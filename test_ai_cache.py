@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from services.ai_cache import AIResponseCache, make_cache_key, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query("  Python  是什么？") == normalize_query("python 是什么")
+    assert normalize_query("ＡＢＣ!!") == "abc"
+    # 只有标点时保留原文，不会变成空字符串
+    assert normalize_query("？？") == "??"
+
+
+def test_cache_key_context():
+    key = make_cache_key("你好", "model", "prompt")
+    assert key == make_cache_key(" 你好？", "model", "prompt")
+    assert key == make_cache_key("你好", "model", "prompt", "")
+    assert key != make_cache_key("你好", "model", "prompt", "digest")
+    assert key != make_cache_key("你好", "other", "prompt")
+
+
+def test_lru_and_ttl():
+    cache = AIResponseCache(max_entries=2, ttl=60, file_path=None)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    # b是最久未使用的，被淘汰
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+    cache.entries["a"] = (time.time() - 1, "1")
+    assert cache.get("a") is None
+    assert cache.hits == 3 and cache.misses == 2
+
+
+def test_load_skips_expired_entries():
+    path = os.path.join(tempfile.mkdtemp(), "ai_cache.json")
+    now = time.time()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"entries": [["old", now - 1, "旧"], ["new", now + 60, "新"]]}, f, ensure_ascii=False)
+    cache = AIResponseCache(file_path=path)
+    assert cache.get("new") == "新"
+    assert cache.get("old") is None
+
+
+async def collect(inflight):
+    return [content async for content in inflight.subscribe()]
+
+
+def test_inflight_shared_by_subscribers():
+    """相同的问题只请求一次上游，后加入的订阅者先收到已有的片段"""
+    async def body():
+        cache = AIResponseCache(file_path=None)
+        calls = []
+        release = asyncio.Event()
+
+        async def produce(inflight):
+            calls.append(1)
+            inflight.append("你")
+            await release.wait()
+            inflight.append("好")
+
+        inflight = cache.start_inflight("k", produce)
+        first = asyncio.ensure_future(collect(inflight))
+        await asyncio.sleep(0)
+        assert cache.get_inflight("k") is inflight
+        second = asyncio.ensure_future(collect(cache.get_inflight("k")))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await first == ["你", "好"]
+        assert await second == ["你", "好"]
+        assert calls == [1]
+        assert cache.get("k") == "你好"
+        assert cache.get_inflight("k") is None
+    asyncio.run(body())
+
+
+def test_producer_cancelled_when_all_subscribers_leave():
+    async def body():
+        cache = AIResponseCache(file_path=None)
+        cancelled = asyncio.Event()
+
+        async def produce(inflight):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        inflight = cache.start_inflight("k", produce)
+        task = asyncio.ensure_future(collect(inflight))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0)
+        assert cache.get("k") is None
+        assert cache.get_inflight("k") is None
+    asyncio.run(body())
+
+
+def test_errors_reach_every_subscriber_and_are_not_cached():
+    async def body():
+        cache = AIResponseCache(file_path=None)
+
+        async def produce(inflight):
+            inflight.append("部分")
+            await asyncio.sleep(0)
+            raise RuntimeError("上游断开")
+
+        inflight = cache.start_inflight("k", produce)
+        results = await asyncio.gather(collect(inflight), collect(inflight), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert cache.get("k") is None
+    asyncio.run(body())
+
+
+def test_incomplete_reply_is_not_cached():
+    """达到长度上限被截断的回复照常分发，但不写入缓存"""
+    async def body():
+        cache = AIResponseCache(file_path=None)
+
+        async def produce(inflight):
+            inflight.append("很长的回复")
+            inflight.complete = False
+            inflight.append("\n[回复过长，已截断]")
+
+        inflight = cache.start_inflight("k", produce)
+        assert await collect(inflight) == ["很长的回复", "\n[回复过长，已截断]"]
+        assert cache.get("k") is None
+    asyncio.run(body())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
@@ -0,0 +1,115 @@
+import asyncio
+
+from services.ai_scheduler import AIRequestScheduler, AITicket, AIQueueFullError
+
+
+async def start(scheduler, user, name, started, positions=None):
+    """提交一个请求，放行后把name记入started，返回 (ticket, task)"""
+    ticket = AITicket(user, name, positions.setdefault(name, []).append if positions is not None else None)
+
+    async def run():
+        await scheduler.acquire(ticket)
+        started.append(name)
+
+    task = asyncio.ensure_future(run())
+    await asyncio.sleep(0)
+    return ticket, task
+
+
+def test_round_robin_between_users():
+    """一个用户连发多条时，其他用户的请求不会排在它们全部之后"""
+    async def body():
+        scheduler = AIRequestScheduler(max_concurrent=1, max_per_user=1, max_queue=10, max_queued_per_user=5)
+        started = []
+        tickets = {}
+        for user, name in (("alice", "a1"), ("alice", "a2"), ("alice", "a3"), ("bob", "b1"), ("carol", "c1")):
+            tickets[name], _ = await start(scheduler, user, name, started)
+        assert started == ["a1"]
+
+        for _ in range(4):
+            scheduler.release(tickets[started[-1]])
+            await asyncio.sleep(0)
+        # a3比b1、c1先提交，但要等其他用户各轮到一次
+        assert started == ["a1", "a2", "b1", "c1", "a3"]
+        scheduler.release(tickets["a3"])
+        assert scheduler.active == 0 and scheduler.queued == 0
+    asyncio.run(body())
+
+
+def test_per_user_limit_lets_other_users_pass():
+    """达到个人并发上限的用户不会挡住排在后面的其他用户"""
+    async def body():
+        scheduler = AIRequestScheduler(max_concurrent=2, max_per_user=1, max_queue=10, max_queued_per_user=5)
+        started = []
+        await start(scheduler, "alice", "a1", started)
+        await start(scheduler, "alice", "a2", started)
+        await start(scheduler, "bob", "b1", started)
+        assert started == ["a1", "b1"]
+        assert scheduler.queued == 1
+    asyncio.run(body())
+
+
+def test_queue_limits():
+    async def body():
+        scheduler = AIRequestScheduler(max_concurrent=1, max_per_user=1, max_queue=3, max_queued_per_user=2)
+        started = []
+        await start(scheduler, "alice", "a1", started)
+        _, a2 = await start(scheduler, "alice", "a2", started)
+        _, a3 = await start(scheduler, "alice", "a3", started)
+        # 每用户最多排队2条
+        _, a4 = await start(scheduler, "alice", "a4", started)
+        await asyncio.sleep(0)
+        assert isinstance(a4.exception(), AIQueueFullError)
+
+        # 排队总数最多3条
+        await start(scheduler, "bob", "b1", started)
+        _, c1 = await start(scheduler, "carol", "c1", started)
+        await asyncio.sleep(0)
+        assert isinstance(c1.exception(), AIQueueFullError)
+        assert scheduler.queued == 3
+        for task in (a2, a3):
+            task.cancel()
+    asyncio.run(body())
+
+
+def test_cancelled_waiter_is_removed():
+    async def body():
+        scheduler = AIRequestScheduler(max_concurrent=1, max_per_user=1, max_queue=10, max_queued_per_user=5)
+        started = []
+        first, _ = await start(scheduler, "alice", "a1", started)
+        waiting, _ = await start(scheduler, "bob", "b1", started)
+        await start(scheduler, "carol", "c1", started)
+
+        # 排队中的请求被取消（例如提问者离开）时释放排队名额
+        scheduler.release(waiting)
+        assert scheduler.queued == 1
+        scheduler.release(first)
+        await asyncio.sleep(0)
+        assert started == ["a1", "c1"]
+    asyncio.run(body())
+
+
+def test_position_updates():
+    async def body():
+        scheduler = AIRequestScheduler(max_concurrent=1, max_per_user=1, max_queue=10, max_queued_per_user=5)
+        started = []
+        positions = {}
+        first, _ = await start(scheduler, "alice", "a1", started, positions)
+        await start(scheduler, "bob", "b1", started, positions)
+        await start(scheduler, "carol", "c1", started, positions)
+        assert positions["b1"] == [1]
+        assert positions["c1"] == [2]
+
+        scheduler.release(first)
+        await asyncio.sleep(0)
+        # 0表示排队结束开始生成，其余请求的位置前移
+        assert positions["b1"] == [1, 0]
+        assert positions["c1"] == [2, 1]
+    asyncio.run(body())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
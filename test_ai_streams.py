@@ -0,0 +1,63 @@
+import asyncio
+
+from services.ai_streams import AIStreamRegistry, CANCEL_USER_LEFT, CANCEL_ROOM_EMPTY
+
+
+def start(registry, response_id, user, room="大厅"):
+    task = asyncio.ensure_future(asyncio.sleep(10))
+    registry.register(response_id, user, room, task)
+    return task
+
+
+def test_user_left_cancels_after_grace():
+    async def body():
+        registry = AIStreamRegistry(deadline=None, room_empty_grace=0.05)
+        task = start(registry, "r1", "alice")
+        other = start(registry, "r2", "bob")
+        registry.user_left("alice", lambda: False)
+        await asyncio.sleep(0.01)
+        # 等待期间不取消
+        assert not task.cancelled()
+        await asyncio.sleep(0.1)
+        assert task.cancelled()
+        assert registry.reason("r1") == CANCEL_USER_LEFT
+        assert not other.cancelled()
+        other.cancel()
+    asyncio.run(body())
+
+
+def test_reconnect_within_grace_keeps_stream():
+    async def body():
+        registry = AIStreamRegistry(deadline=None, room_empty_grace=0.05)
+        task = start(registry, "r1", "alice")
+        registry.user_left("alice", lambda: False)
+        registry.user_returned("alice")
+        await asyncio.sleep(0.1)
+        assert not task.cancelled()
+
+        # 重新连接到其他进程时is_online()为True，同样不取消
+        registry.user_left("alice", lambda: True)
+        await asyncio.sleep(0.1)
+        assert not task.cancelled()
+        task.cancel()
+    asyncio.run(body())
+
+
+def test_room_empty_cancels_room_streams():
+    async def body():
+        registry = AIStreamRegistry(deadline=None, room_empty_grace=0.05)
+        task = start(registry, "r1", "alice", "房间1")
+        other = start(registry, "r2", "bob", "房间2")
+        registry.room_empty("房间1", lambda: True)
+        await asyncio.sleep(0.1)
+        assert task.cancelled() and registry.reason("r1") == CANCEL_ROOM_EMPTY
+        assert not other.cancelled()
+        other.cancel()
+    asyncio.run(body())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
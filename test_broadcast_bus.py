@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import tornado.netutil
+
+import config
+
+# 聊天记录写到临时目录，不影响data目录
+config.CHAT_LOG_DB = os.path.join(tempfile.mkdtemp(), "chat_log.db")
+
+from bench.fake_redis import FakeRedisServer
+import handlers.websocket.chat_hub as chat_hub_module
+from handlers.websocket.chat_hub import ChatHub
+from services.chat_log import chat_log
+from services.broadcast_bus import RedisBus, UnixSocketBus
+
+
+class FakeSendQueue:
+    def __init__(self):
+        self.payloads = []
+
+    def push(self, frame, payload):
+        self.payloads.append(json.loads(payload))
+
+
+class FakeClient:
+    def __init__(self, nickname):
+        self.nickname = nickname
+        self.send_queue = FakeSendQueue()
+        self.superseded = False
+
+    def supersede(self):
+        self.superseded = True
+
+
+async def wait_for(condition, timeout=3.0):
+    """等待condition()为真，超时返回False"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+def start_fake_redis():
+    """在随机端口上启动模拟Redis服务，返回 (服务, URL)"""
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    server = FakeRedisServer()
+    server.add_sockets(sockets)
+    return server, f"redis://127.0.0.1:{sockets[0].getsockname()[1]}/0"
+
+
+def test_redis_bus_two_hubs():
+    """两个节点通过模拟Redis服务交换在线状态和聊天消息"""
+    async def run():
+        server, url = start_fake_redis()
+        first, second = ChatHub(), ChatHub()
+        first.set_bus(RedisBus(url, "test_chat"))
+        second.set_bus(RedisBus(url, "test_chat"))
+        try:
+            assert await wait_for(lambda: len(server.channels.get(b"test_chat", ())) == 2)
+            # 订阅建立后发布连接可能还没有就绪，publish会先积压再发出
+            bob = FakeClient("bob")
+            second.add_client("bob", bob, "room")
+            assert await wait_for(lambda: first.is_online("bob"))
+            assert first.online_users("room") == ["bob"]
+
+            first.broadcast({"type": "chat", "nickname": "alice", "content": "你好"}, "room")
+            assert await wait_for(lambda: any(m.get("content") == "你好" for m in bob.send_queue.payloads))
+            # 接收节点也把消息记入房间历史，重连时可以补发
+            assert len(second.history("room").messages) == 1
+            assert server.stats.published >= 2
+        finally:
+            first.bus.close()
+            second.bus.close()
+            server.stop()
+
+    asyncio.run(run())
+
+
+def test_client_seq_is_replaced():
+    """消息中已有的seq不会进入广播的JSON，客户端看到的只有服务器分配的序号"""
+    async def run():
+        hub = ChatHub()
+        bob = FakeClient("bob")
+        hub.add_client("bob", bob, "room")
+        hub.broadcast({"type": "chat", "content": "x", "seq": 10 ** 17}, "room")
+        message = bob.send_queue.payloads[-1]
+        assert message["seq"] == hub.seq_clock.last_seq < 10 ** 17
+        assert hub.history("room").since(0)[0][-1].count(b'"seq"') == 1
+
+    asyncio.run(run())
+
+
+def test_open_ai_replies_evict_oldest():
+    """结束消息丢失的AI回复不会挡住新的回复写入聊天记录"""
+    async def run():
+        hub = ChatHub()
+        limit, chat_hub_module.MAX_OPEN_AI_RESPONSES = chat_hub_module.MAX_OPEN_AI_RESPONSES, 2
+        try:
+            for response_id in ("lost1", "lost2", "new"):
+                hub.broadcast({"type": "ai_stream_update", "id": response_id, "content": response_id}, "room")
+            assert list(hub.ai_parts) == ["lost2", "new"]
+            hub.broadcast({"type": "ai_stream_end", "id": "new"}, "room")
+            assert list(hub.ai_parts) == ["lost2"]
+            assert json.loads(chat_log.pending[-1][3])["content"] == "new"
+        finally:
+            chat_hub_module.MAX_OPEN_AI_RESPONSES = limit
+            chat_log.pending.clear()
+
+    asyncio.run(run())
+
+
+def test_kick_supersedes_connection_on_other_node():
+    """已登录用户连接到另一个节点时，原节点上的旧连接被关闭"""
+    async def run():
+        server, url = start_fake_redis()
+        first, second = ChatHub(), ChatHub()
+        first.set_bus(RedisBus(url, "test_chat"))
+        second.set_bus(RedisBus(url, "test_chat"))
+        try:
+            assert await wait_for(lambda: len(server.channels.get(b"test_chat", ())) == 2)
+            old, other = FakeClient("bob"), FakeClient("carol")
+            first.add_client("bob", old, "room")
+            first.add_client("carol", other, "room")
+            assert await wait_for(lambda: second.is_online("bob"))
+
+            second.kick("bob")
+            assert await wait_for(lambda: old.superseded)
+            assert not other.superseded
+        finally:
+            first.bus.close()
+            second.bus.close()
+            server.stop()
+
+    asyncio.run(run())
+
+
+def test_unix_bus_fragments_large_payload():
+    """超过单个数据报大小的消息拆成分片发送，接收端拼接后完整交付"""
+    async def run():
+        directory = tempfile.mkdtemp()
+        sender, receiver = UnixSocketBus(directory), UnixSocketBus(directory)
+        received = []
+        sender.start(lambda payload: None)
+        receiver.start(received.append)
+        try:
+            large = os.urandom(UnixSocketBus.MAX_DATAGRAM * 5 + 123)
+            sender.publish(b"small")
+            sender.publish(large)
+            sender.publish(b"after")
+            assert await wait_for(lambda: len(received) == 3)
+            assert received == [b"small", large, b"after"]
+            assert not receiver._fragments
+        finally:
+            sender.close()
+            receiver.close()
+
+    asyncio.run(run())
+
+
+def test_unix_bus_drops_incomplete_fragments():
+    """未收齐的分片超时后被丢弃，不影响后续消息"""
+    bus = UnixSocketBus(tempfile.mkdtemp())
+    bus.FRAGMENT_TTL = -1
+    datagrams = bus._datagrams(b"x" * (UnixSocketBus.MAX_DATAGRAM * 2 + 1))
+    assert len(datagrams) == 3
+    assert bus._reassemble(datagrams[0]) is None
+    complete = bus._datagrams(b"y" * (UnixSocketBus.MAX_DATAGRAM + 1))
+    assert bus._reassemble(complete[0]) is None
+    # 第一条消息的分片已过期被清理
+    assert len(bus._fragments) == 1
+    assert bus._reassemble(complete[1]) == b"y" * (UnixSocketBus.MAX_DATAGRAM + 1)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+from services.chat_log import ChatLog
+
+
+def test_file_created_on_first_use():
+    path = os.path.join(tempfile.mkdtemp(), "data", "chat_log.db")
+    log = ChatLog(db_path=path)
+    assert not os.path.exists(path)
+    assert log.max_seq() == 0
+    assert os.path.exists(path)
+
+
+def test_messages_before_pages_by_room():
+    log = ChatLog(db_path=os.path.join(tempfile.mkdtemp(), "chat_log.db"))
+    # 不经过IOLoop的写入定时器，直接同步写入
+    log.open()
+    for seq in range(1, 6):
+        log.pending.append((seq, "大厅", "text", b'{"seq": %d}' % seq, 0.0))
+    log.pending.append((6, "房间", "text", b'{"seq": 6}', 0.0))
+    log.flush_sync()
+
+    assert log.written == 6
+    assert log.max_seq() == 6
+    assert log.messages_before("大厅", 5, 2) == [b'{"seq": 3}', b'{"seq": 4}']
+    assert log.messages_before("房间", 2 ** 63 - 1, 10) == [b'{"seq": 6}']
+    assert log.messages_before("没有的房间", 10, 10) == []
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
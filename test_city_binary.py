@@ -0,0 +1,120 @@
+import os
+import tempfile
+
+from services.city_binary import CityBinaryReader, file_digest, write_city_binary
+from services.city_service import CityIndex, CityService
+
+RECORDS = [
+    {'中文名': '中华人民共和国', 'adcode': '100000', 'citycode': '\\N'},
+    {'中文名': '北京市', 'adcode': '110000', 'citycode': '010'},
+    {'中文名': '北京市市辖区', 'adcode': '110100', 'citycode': '010'},
+    {'中文名': '东城区', 'adcode': '110101', 'citycode': '010'},
+    {'中文名': '浙江省', 'adcode': '330000', 'citycode': '\\N'},
+    {'中文名': '杭州市', 'adcode': '330100', 'citycode': '0571'},
+    {'中文名': '西湖区', 'adcode': '330106', 'citycode': '0571'},
+    {'中文名': None, 'adcode': '330199', 'citycode': '0571'},
+    {'中文名': 'ABC自治县', 'adcode': '469000', 'citycode': '1234'},
+    {'中文名': '北京市', 'adcode': '110000', 'citycode': '010'},
+]
+
+
+def rejected(func, *args):
+    """func(*args)抛出ValueError时返回True"""
+    try:
+        func(*args)
+    except ValueError:
+        return True
+    return False
+
+
+def write_records(records=RECORDS, source_digest=None):
+    path = os.path.join(tempfile.mkdtemp(), 'cities.bin')
+    if source_digest is None:
+        write_city_binary(records, path)
+    else:
+        write_city_binary(records, path, source_digest)
+    return path
+
+
+def test_columns_round_trip():
+    reader = CityBinaryReader(write_records())
+    assert len(reader) == len(RECORDS)
+    for position, record in enumerate(RECORDS):
+        assert reader.name(position) == record['中文名']
+        assert reader.adcode(position) == record['adcode']
+        # 前导零和非数字的citycode原样还原
+        assert reader.citycode(position) == record['citycode']
+    reader.close()
+
+
+def test_lookups_match_in_memory_index():
+    """从二进制文件加载的索引与从记录构建的索引查询结果相同"""
+    # 索引引用内存映射上的视图，在索引的生命周期内不关闭reader
+    binary = CityIndex.from_binary(CityBinaryReader(write_records()))
+    memory = CityIndex.from_records(RECORDS)
+
+    assert binary.count_records() == memory.count_records()
+    for keyword in ('北京', '北京市', '市', '区', 'abc', 'ABC', '西湖', '上海', '京市辖'):
+        assert binary.find_by_city_name(keyword) == memory.find_by_city_name(keyword), keyword
+    assert binary.find_by_city_name('市', limit=2) == memory.find_by_city_name('市', limit=2)
+    for adcode in ('110000', '330100', '330199', '999999', 110000):
+        assert binary.find_by_adcode(adcode) == memory.find_by_adcode(adcode), adcode
+    for citycode in ('010', '0571', '\\N', '10', '1234'):
+        assert binary.find_by_citycode(citycode) == memory.find_by_citycode(citycode), citycode
+    for province in ('北京', '浙江', '杭', '上海'):
+        assert binary.get_cities_by_province(province) == memory.get_cities_by_province(province), province
+
+    # 完全匹配排在前缀匹配之前，重复的adcode只取第一条
+    assert [city['adcode'] for city in binary.find_by_city_name('北京市')] == ['110000', '110000', '110100']
+    assert binary.find_by_adcode('110000') == {'中文名': '北京市', 'adcode': '110000', 'citycode': '010'}
+
+
+def test_invalid_files_are_rejected():
+    path = os.path.join(tempfile.mkdtemp(), 'cities.bin')
+    with open(path, 'wb') as f:
+        f.write(b'not a city file')
+    assert rejected(CityBinaryReader, path)
+
+    # 截断的文件
+    data = open(write_records(), 'rb').read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert rejected(CityBinaryReader, path)
+
+    assert rejected(write_city_binary, [{'中文名': '错误', 'adcode': '12', 'citycode': '1'}], path)
+
+
+def test_source_digest_decides_freshness():
+    """二进制文件只有在记录的摘要与Excel文件一致时才被使用，与mtime无关"""
+    directory = tempfile.mkdtemp()
+    excel_path = os.path.join(directory, 'cities.xlsx')
+    with open(excel_path, 'wb') as f:
+        f.write(b'excel v1')
+    binary_path = write_records(source_digest=file_digest(excel_path))
+    assert CityBinaryReader(binary_path).source_digest == file_digest(excel_path)
+
+    service = CityService(file_path=excel_path, binary_path=binary_path)
+    assert service._load_binary(file_digest(excel_path))
+    assert service.find_by_adcode('330100')['中文名'] == '杭州市'
+
+    # 只修改mtime不影响摘要
+    os.utime(excel_path, (1, 1))
+    assert service._digest(service._mtime(excel_path)) == file_digest(excel_path)
+
+    with open(excel_path, 'wb') as f:
+        f.write(b'excel v2')
+    assert not CityService(file_path=excel_path, binary_path=binary_path)._load_binary(file_digest(excel_path))
+
+
+def test_service_without_excel_uses_binary():
+    directory = tempfile.mkdtemp()
+    service = CityService(file_path=os.path.join(directory, 'missing.xlsx'), binary_path=write_records())
+    assert service.preload()
+    assert service.find_by_citycode('0571') == CityIndex.from_records(RECORDS).find_by_citycode('0571')
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
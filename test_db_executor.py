@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from services.db_executor import DBExecutor, DBBusyError
+
+
+def test_run_returns_result():
+    async def body():
+        executor = DBExecutor(workers=1, max_pending=2)
+        assert await executor.run(lambda a, b: a + b, 1, 2) == 3
+        assert executor.pending == 0
+    asyncio.run(body())
+
+
+def test_timed_out_job_still_counts_as_pending():
+    """超时的请求仍在线程中执行时继续占用排队名额，直到真正结束"""
+    async def body():
+        executor = DBExecutor(workers=1, max_pending=1)
+        release = threading.Event()
+
+        def slow_query():
+            release.wait(5)
+            return "done"
+
+        try:
+            await executor.run(slow_query, timeout=0.05)
+            assert False, "应当超时"
+        except DBBusyError:
+            pass
+        assert executor.pending == 1
+        try:
+            await executor.run(lambda: None)
+            assert False, "应当被拒绝"
+        except DBBusyError:
+            pass
+        assert executor.stats.timeouts == 1 and executor.stats.rejected == 1
+
+        release.set()
+        for _ in range(100):
+            if executor.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.pending == 0
+        assert await executor.run(lambda: "ok") == "ok"
+    asyncio.run(body())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
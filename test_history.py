@@ -0,0 +1,76 @@
+import json
+
+from handlers.websocket.history import MessageHistory, SequenceClock, parse_seq, stamp_seq
+
+
+def message(seq, text="x"):
+    return stamp_seq(json.dumps({"type": "text", "content": text}).encode("utf-8"), seq)
+
+
+def test_stamp_and_parse_seq():
+    payload = message(42, "你好")
+    assert parse_seq(payload) == 42
+    assert json.loads(payload) == {"seq": 42, "type": "text", "content": "你好"}
+    assert parse_seq(b'{"type": "text"}') is None
+
+
+def test_sequence_clock_is_monotonic():
+    clock = SequenceClock()
+    first = clock.next()
+    assert clock.next() > first
+    # 看到其他节点更大的序号后，本节点的序号不会比它小
+    clock.observe(first + 10 ** 9)
+    assert clock.next() == first + 10 ** 9 + 1
+
+
+def test_since_returns_newer_messages_in_order():
+    history = MessageHistory(max_messages=10, max_bytes=10 ** 6)
+    for seq in (1, 2, 3, 5):
+        history.append(seq, message(seq))
+    # 其他节点的消息晚到时按序号插入
+    history.append(4, message(4))
+
+    payloads, truncated = history.since(2)
+    assert [parse_seq(payload) for payload in payloads] == [3, 4, 5]
+    assert not truncated
+    assert history.since(5) == ([], False)
+    assert history.last_seq == 5
+
+
+def test_since_reports_evicted_messages():
+    history = MessageHistory(max_messages=3, max_bytes=10 ** 6)
+    for seq in range(1, 6):
+        history.append(seq, message(seq))
+    assert history.first_seq == 3 and history.evicted_seq == 2
+
+    payloads, truncated = history.since(1)
+    assert [parse_seq(payload) for payload in payloads] == [3, 4, 5]
+    assert truncated
+    # last_seq之后的消息都还在缓冲中
+    assert not history.since(2)[1]
+
+
+def test_since_byte_limit_keeps_newest():
+    history = MessageHistory(max_messages=100, max_bytes=10 ** 6)
+    for seq in range(1, 11):
+        history.append(seq, message(seq))
+    size = len(message(10))
+    payloads, truncated = history.since(0, max_bytes=size * 3)
+    assert [parse_seq(payload) for payload in payloads] == [8, 9, 10]
+    assert truncated
+
+
+def test_encode_sync():
+    history = MessageHistory()
+    history.append(1, message(1, "a"))
+    history.append(2, message(2, "b"))
+    data = json.loads(history.encode_sync(1))
+    assert data == {"type": "history", "truncated": False,
+                    "messages": [{"seq": 2, "type": "text", "content": "b"}]}
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
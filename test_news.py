@@ -1,13 +1,23 @@
+import requests
 import websocket
 import json
 import time
 
-# WebSocket服务器地址
-ws_url = "ws://localhost:8888/ws?nickname=test_user"
+# 服务器地址
+http_url = "http://localhost:8888"
+ws_url = "ws://localhost:8888/ws"
+
+# WebSocket连接需要登录：先注册（用户已存在时注册失败，不影响登录），再登录并获取连接令牌
+user = {"username": "test_user", "password": "password123", "confirm_password": "password123"}
+session = requests.Session()
+session.post(f"{http_url}/api/register", json=user, timeout=5)
+login_response = session.post(f"{http_url}/api/login", json=user, timeout=5)
+print(f"登录响应: {login_response.text}")
+token = session.get(f"{http_url}/api/ws-token", timeout=5).json()["token"]
 
 # 建立WebSocket连接
 ws = websocket.WebSocket()
-ws.connect(ws_url)
+ws.connect(f"{ws_url}?token={token}")
 
 print("已连接到WebSocket服务器")
 
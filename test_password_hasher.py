@@ -0,0 +1,100 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import config
+
+# 用户数据库写到临时目录，不影响data目录
+config.USERS_DB = os.path.join(tempfile.mkdtemp(), "users.db")
+
+from services.db_service import DatabaseService
+from services.password_hasher import PasswordHasher, password_hasher
+
+
+def stored_password(service, username):
+    conn = sqlite3.connect(service.db_path)
+    try:
+        return conn.execute("SELECT password FROM users WHERE username = ?", (username,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def insert_plaintext(service, username, password):
+    """模拟旧版本以明文保存的密码"""
+    conn = sqlite3.connect(service.db_path)
+    try:
+        conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_hash_and_verify():
+    for algorithm in ("scrypt", "pbkdf2"):
+        hasher = PasswordHasher(algorithm=algorithm)
+        stored = hasher.hash_sync("密码123")
+        assert hasher.is_hashed(stored)
+        assert "密码123" not in stored
+        assert hasher.verify_sync("密码123", stored)
+        assert not hasher.verify_sync("密码124", stored)
+        assert not hasher.needs_rehash(stored)
+        # 盐是随机的，相同的密码得到不同的存储值
+        assert hasher.hash_sync("密码123") != stored
+
+
+def test_plaintext_and_malformed_values():
+    assert password_hasher.verify_sync("abc", "abc")
+    assert not password_hasher.verify_sync("abd", "abc")
+    assert password_hasher.needs_rehash("abc")
+    assert not password_hasher.verify_sync("abc", None)
+    assert not password_hasher.verify_sync("abc", "scrypt$broken")
+
+
+def test_register_stores_hash():
+    service = DatabaseService(db_path=os.path.join(tempfile.mkdtemp(), "users.db"))
+    assert service.register_user("alice", "secret")
+    assert not service.register_user("alice", "other")
+    assert password_hasher.is_hashed(stored_password(service, "alice"))
+    assert service.login_user("alice", "secret")
+    assert not service.login_user("alice", "wrong")
+    assert not service.login_user("nobody", "secret")
+
+
+def test_plaintext_migrated_on_login():
+    """明文密码在第一次登录成功后替换为哈希，之后仍能用原密码登录"""
+    service = DatabaseService(db_path=os.path.join(tempfile.mkdtemp(), "users.db"))
+    insert_plaintext(service, "bob", "hunter2")
+
+    # 密码错误时不迁移
+    assert not service.login_user("bob", "wrong")
+    assert stored_password(service, "bob") == "hunter2"
+
+    assert service.login_user("bob", "hunter2")
+    stored = stored_password(service, "bob")
+    assert password_hasher.is_hashed(stored)
+    assert service.login_user("bob", "hunter2")
+    assert stored_password(service, "bob") == stored
+
+
+def test_plaintext_migrated_on_async_login():
+    async def body():
+        service = DatabaseService(db_path=os.path.join(tempfile.mkdtemp(), "users.db"))
+        insert_plaintext(service, "carol", "pa55")
+        assert not await service.login_user_async("carol", "wrong")
+        assert await service.login_user_async("carol", "pa55")
+        assert password_hasher.is_hashed(stored_password(service, "carol"))
+        assert await service.login_user_async("carol", "pa55")
+        assert not await service.login_user_async("nobody", "pa55")
+
+        assert await service.register_user_async("dave", "pw")
+        assert not await service.register_user_async("dave", "pw")
+        assert await service.check_username_exists_async("dave")
+    asyncio.run(body())
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+from handlers.websocket.frames import encode_text_frame
+from handlers.websocket.send_queue import (SendQueue, POLICY_COALESCE, POLICY_DISCONNECT, POLICY_RESYNC,
+                                           RESYNC_CLOSE_CODE, send_queue_stats)
+
+
+class FakeStream:
+    """记录写入的帧；pending为True时写入不完成，模拟慢速客户端"""
+    def __init__(self):
+        self.frames = []
+        self.pending = True
+        self.futures = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+        future = asyncio.get_running_loop().create_future()
+        if self.pending:
+            self.futures.append(future)
+        else:
+            future.set_result(None)
+        return future
+
+
+class FakeConnection:
+    def __init__(self):
+        self.stream = FakeStream()
+        self._message_bytes_out = 0
+        self._wire_bytes_out = 0
+
+    def is_closing(self):
+        return False
+
+
+class FakeHandler:
+    def __init__(self):
+        self.nickname = "slow"
+        self.ws_connection = FakeConnection()
+        self.close_code = None
+
+    def close(self, code=None, reason=None):
+        self.close_code = code
+
+
+def message(message_dict):
+    payload = json.dumps(message_dict, ensure_ascii=False).encode("utf-8")
+    return encode_text_frame(payload), payload
+
+
+def chunk(seq, response_id, content):
+    return message({"seq": seq, "type": "ai_stream_update", "id": response_id, "content": content})
+
+
+def run(coroutine_function):
+    asyncio.run(coroutine_function())
+
+
+def test_idle_connection_writes_directly():
+    async def body():
+        handler = FakeHandler()
+        queue = SendQueue(handler, 4, 1 << 20)
+        assert queue.push(*message({"seq": 1, "type": "chat", "content": "a"}))
+        assert queue.depth == 0
+        assert len(handler.ws_connection.stream.frames) == 1
+    run(body)
+
+
+def test_queued_frames_are_written_in_order():
+    async def body():
+        handler = FakeHandler()
+        stream = handler.ws_connection.stream
+        queue = SendQueue(handler, 10, 1 << 20)
+        for seq in range(1, 4):
+            queue.push(*message({"seq": seq, "type": "chat", "content": str(seq)}))
+        assert queue.depth == 2
+
+        # 上一帧写完后才写下一帧
+        stream.pending = False
+        stream.futures.pop(0).set_result(None)
+        await asyncio.sleep(0)
+        assert queue.depth == 0
+        assert [json.loads(frame[2:])["seq"] for frame in stream.frames] == [1, 2, 3]
+    run(body)
+
+
+def test_coalesce_merges_ai_chunks_without_loss():
+    async def body():
+        handler = FakeHandler()
+        stream = handler.ws_connection.stream
+        before = send_queue_stats.coalesced
+        queue = SendQueue(handler, 3, 1 << 20, POLICY_COALESCE)
+        queue.push(*message({"seq": 1, "type": "chat", "content": "first"}))
+        for seq, text in enumerate("abcd", start=2):
+            queue.push(*chunk(seq, "r1", text))
+
+        # 4个片段超出上限，合并为一帧，使用最后一个片段的序号
+        assert handler.close_code is None
+        assert queue.depth == 1
+        merged = json.loads(queue.queue[0][1])
+        assert merged["content"] == "abcd"
+        assert merged["seq"] == 5
+        assert send_queue_stats.coalesced - before == 3
+
+        stream.pending = False
+        stream.futures.pop(0).set_result(None)
+        await asyncio.sleep(0)
+        assert json.loads(stream.frames[-1][2:])["content"] == "abcd"
+    run(body)
+
+
+def test_overflow_closes_with_resync_code_instead_of_dropping():
+    async def body():
+        for policy in (POLICY_COALESCE, POLICY_RESYNC):
+            handler = FakeHandler()
+            queue = SendQueue(handler, 3, 1 << 20, policy)
+            for seq in range(1, 6):
+                queue.push(*message({"seq": seq, "type": "chat", "content": str(seq)}))
+            # 不会悄悄丢弃中间的消息，而是让客户端带着last_seq重连补发
+            assert handler.close_code == RESYNC_CLOSE_CODE
+            assert queue.closed
+            assert queue.depth == 0
+            assert not queue.push(*message({"seq": 6, "type": "chat", "content": "6"}))
+    run(body)
+
+
+def test_overflow_byte_limit():
+    async def body():
+        handler = FakeHandler()
+        queue = SendQueue(handler, 100, 64, POLICY_RESYNC)
+        queue.push(*message({"seq": 1, "type": "chat", "content": "x"}))
+        queue.push(*message({"seq": 2, "type": "chat", "content": "y" * 100}))
+        assert handler.close_code == RESYNC_CLOSE_CODE
+    run(body)
+
+
+def test_disconnect_policy_closes_for_good():
+    async def body():
+        handler = FakeHandler()
+        queue = SendQueue(handler, 1, 1 << 20, POLICY_DISCONNECT)
+        for seq in range(1, 4):
+            queue.push(*chunk(seq, "r1", "x"))
+        assert handler.close_code == 1008
+        assert queue.closed
+    run(body)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"通过: {name}")
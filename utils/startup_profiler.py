@@ -0,0 +1,91 @@
+import sys
+import time
+
+
+class _ImportTimingFinder:
+    """
+    放在 sys.meta_path 最前面的查找器，本身不加载任何模块，
+    只是给其他查找器返回的loader包上一层计时
+    """
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            # 内置/冻结模块的loader是类本身，被所有模块共享，不做包装
+            if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+                self.profiler.wrap_loader(fullname, loader)
+            return spec
+        return None
+
+
+class StartupProfiler:
+    """启动耗时分析器：统计每个模块的导入耗时和启动到开始监听的时间"""
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        # {模块名: [累计耗时, 自身耗时]}
+        self.timings = {}
+        self._stack = []
+        self._finder = None
+
+    def install(self, start_time=None):
+        """开始记录模块导入耗时"""
+        if start_time is not None:
+            self.start_time = start_time
+        if self._finder is None:
+            self._finder = _ImportTimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        """停止记录，避免影响之后的懒加载导入"""
+        if self._finder is not None and self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        self._finder = None
+
+    def wrap_loader(self, fullname, loader):
+        """替换loader实例上的exec_module，记录模块执行耗时"""
+        exec_module = loader.exec_module
+        profiler = self
+
+        def timed_exec_module(module):
+            profiler._stack.append(0.0)
+            begin = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - begin
+                children = profiler._stack.pop()
+                if profiler._stack:
+                    profiler._stack[-1] += elapsed
+                profiler.timings[fullname] = [elapsed, elapsed - children]
+                # 只计时一次，之后恢复loader原本的方法
+                del loader.exec_module
+
+        loader.exec_module = timed_exec_module
+
+    def report(self, listen_time=None, top=25):
+        """打印导入耗时最多的模块和启动到开始监听的时间"""
+        now = time.perf_counter()
+        rows = sorted(self.timings.items(), key=lambda item: item[1][0], reverse=True)
+
+        print("=" * 64)
+        print(f"{'模块':<40}{'累计(ms)':>12}{'自身(ms)':>12}")
+        for name, (cumulative, self_time) in rows[:top]:
+            print(f"{name:<40}{cumulative * 1000:>12.1f}{self_time * 1000:>12.1f}")
+        print("-" * 64)
+        print(f"共导入 {len(self.timings)} 个模块，"
+              f"导入自身耗时合计 {sum(t[1] for t in self.timings.values()) * 1000:.1f} ms")
+        if listen_time is not None:
+            print(f"从启动到开始监听: {(listen_time - self.start_time) * 1000:.1f} ms")
+        print(f"分析报告生成于启动后 {(now - self.start_time) * 1000:.1f} ms")
+        print("=" * 64)
+
+
+# 创建启动分析器实例
+startup_profiler = StartupProfiler()